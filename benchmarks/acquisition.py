@@ -0,0 +1,300 @@
+# coding: utf-8
+
+""" measure the acquisition from the socket to the files against the simulator;
+run as `python -m benchmarks.acquisition --help` """
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import product
+from multiprocessing import Event, Process, Queue
+from pathlib import Path
+from queue import Empty
+from typing import Any, Dict, List, Optional, Sequence, cast
+
+import numpy as np
+
+from channel_settings import ChannelSettings
+from e502 import E502, X502_REF_FREQ
+from e502_simulator import E502Simulator
+from file_writer import FileWriter, FileWritingMode, FileWritingRequest
+from history_buffer import HistoryBuffer
+from measurement import Measurement, MultiDeviceMeasurement
+from metrics import Histogram, MetricsSnapshot, max_rss, queue_depth
+from output_backends import backend_for
+from pipeline import FileTarget, PortionDispatcher
+from ring_buffer import RingBufferReader, RingBufferSlice, SharedRingBuffer
+
+# how often the consumer takes the portions, as the GUI timer does, in seconds
+TIMER_INTERVAL: float = 0.01
+# as many portions as the GUI keeps in the ring buffer
+RING_BUFFER_PORTIONS: int = 64
+
+
+def _simulate(host: str, raw_words: bool, ready: Event, stop: Event, results_queue: Queue[Dict[str, Any]]) -> None:
+    simulator: E502Simulator
+    with E502Simulator(host, raw_words=raw_words) as simulator:
+        ready.set()
+        stop.wait()
+        results_queue.put({
+            'frames_sent': simulator.frames_sent,
+            'bytes_sent': simulator.bytes_sent,
+            'max_lag_frames': simulator.max_lag,
+            'process_time': time.process_time(),
+            'max_rss': max_rss(),
+        })
+
+
+def _summary(histogram: Histogram) -> Dict[str, Any]:
+    return {name: value for name, value in histogram.summary().items() if name != 'count'}
+
+
+def _latest_snapshots(metrics_queue: Queue[MetricsSnapshot], snapshots: Dict[str, MetricsSnapshot]) -> None:
+    while True:
+        try:
+            snapshot: MetricsSnapshot = metrics_queue.get_nowait()
+        except Empty:
+            return
+        snapshots[snapshot['source']] = snapshot
+
+
+def run(hosts: Sequence[str], channels_count: int, sample_rate: float, portion_size: int, duration: float,
+        file_format: str, late_latency: float, decode_stream: bool = False) -> Dict[str, Any]:
+    """
+    measure a single acquisition of `duration` seconds, the data going into the files as the GUI sends them;
+    several hosts make a simulator each, and the devices of `channels_count` channels each get read at once
+    """
+    if len(hosts) > 1 and decode_stream:
+        raise ValueError('The devices read at once stream the volts only')
+    adc_frequency_divider: int = max(1, round(X502_REF_FREQ / sample_rate))
+    frame_rate: float = X502_REF_FREQ / adc_frequency_divider / channels_count
+    all_channels_count: int = channels_count * len(hosts)
+
+    simulator_results_queue: Queue[Dict[str, Any]] = Queue()
+    simulator_stop: Event = Event()
+    simulators: List[Process] = []
+    host: str
+    simulator: Process
+    for host in hosts:
+        simulator_ready: Event = Event()
+        simulators.append(Process(target=_simulate, args=(host, decode_stream, simulator_ready, simulator_stop,
+                                                          simulator_results_queue)))
+        simulators[-1].start()
+        if not simulator_ready.wait(10.0):
+            for simulator in simulators:
+                simulator.terminate()
+            raise RuntimeError('The simulator failed to start', host)
+
+    results_queue: Queue[RingBufferSlice] = Queue()
+    requests_queue: Queue[FileWritingRequest] = Queue()
+    metrics_queue: Queue[MetricsSnapshot] = Queue()
+    ring_buffer: SharedRingBuffer = SharedRingBuffer(capacity=portion_size * RING_BUFFER_PORTIONS,
+                                                     channels_count=all_channels_count)
+    ring_buffer_reader: RingBufferReader = RingBufferReader()
+    file_writer: FileWriter = FileWriter(requests_queue, metrics_queue=metrics_queue)
+    file_writer.start()
+    history: List[HistoryBuffer] = [HistoryBuffer(max(1, round(5.0 * frame_rate)))
+                                    for _ in range(all_channels_count)]
+    snapshots: Dict[str, MetricsSnapshot] = {}
+
+    settings: List[ChannelSettings] = []
+    channel: int
+    for channel in range(channels_count):
+        channel_settings: ChannelSettings = ChannelSettings()
+        channel_settings.range = 0
+        channel_settings.physical_channel = channel
+        channel_settings.mode = 0
+        channel_settings.averaging = 1
+        settings.append(channel_settings)
+
+    directory: tempfile.TemporaryDirectory
+    with tempfile.TemporaryDirectory() as directory:
+        file_targets: List[FileTarget]
+        if backend_for(Path(file_format)).ALL_CHANNELS:
+            file_targets = [(Path(directory) / f'imp_000001{file_format}', None, None)]
+        else:
+            file_targets = [(Path(directory) / f'channel {channel}' / f'imp_000001{file_format}', channel, None)
+                            for channel in range(all_channels_count)]
+        acquisition: Process
+        if len(hosts) == 1:
+            # the device of the simulator, not the dummy one the measurement might take
+            acquisition = Measurement(results_queue, ring_buffer.name, hosts[0], settings,
+                                      adc_frequency_divider=adc_frequency_divider,
+                                      data_portion_size=portion_size, digital_lines=[False] * 8,
+                                      duration=timedelta(seconds=duration), decode_stream=decode_stream,
+                                      metrics_queue=metrics_queue, device_type=E502)
+        else:
+            acquisition = MultiDeviceMeasurement(results_queue, ring_buffer.name,
+                                                 [(host, settings) for host in hosts], frame_rate,
+                                                 data_portion_size=portion_size, digital_lines=[False] * 8,
+                                                 duration=timedelta(seconds=duration))
+        dispatcher: PortionDispatcher = PortionDispatcher(ring_buffer_reader, file_requests_queue=requests_queue,
+                                                          file_targets=lambda: file_targets)
+        latency: Histogram = Histogram()
+        frames_count: int = 0
+        portions_count: int = 0
+        lost_portions_count: int = 0
+        late_portions_count: int = 0
+        consumer_start_time: float = time.process_time()
+        start_time: float = time.monotonic()
+        acquisition.start()
+        # what `App.on_timeout` does for every portion when all the data get saved
+        while acquisition.is_alive() or not results_queue.empty():
+            time.sleep(TIMER_INTERVAL)
+            while not results_queue.empty():
+                portion: RingBufferSlice = results_queue.get()
+                portions_count += 1
+                data: Optional[np.ndarray] = dispatcher.dispatch(portion)
+                if data is None:
+                    lost_portions_count += 1
+                    continue
+                frames_count += portion.count
+                for channel in range(all_channels_count):
+                    history[channel].append(data[..., channel])
+                portion_latency: float = time.monotonic() - portion.received_time
+                latency.add(portion_latency)
+                late_portions_count += portion_latency > late_latency
+            _latest_snapshots(metrics_queue, snapshots)
+        elapsed_time: float = time.monotonic() - start_time
+        consumer_process_time: float = time.process_time() - consumer_start_time
+
+        # let the files get written
+        requests_queue.put((None, cast(FileWritingMode, 'at'), np.empty(0)))
+        while queue_depth(requests_queue):
+            time.sleep(TIMER_INTERVAL)
+        drain_time: float = time.monotonic() - start_time - elapsed_time
+        file_writer.terminate()
+        file_writer.join()
+        _latest_snapshots(metrics_queue, snapshots)
+        disk_bytes: int = sum(path.stat().st_size for path in Path(directory).rglob('*') if path.is_file())
+
+    simulator_stop.set()
+    all_simulator_results: List[Dict[str, Any]] = [simulator_results_queue.get(timeout=10.0) for _ in hosts]
+    for simulator in simulators:
+        simulator.join()
+    # the frames get merged as the slowest device sends them
+    simulator_results: Dict[str, Any] = {
+        'frames_sent': min(results['frames_sent'] for results in all_simulator_results),
+        'max_lag_frames': max(results['max_lag_frames'] for results in all_simulator_results),
+        'process_time': sum(results['process_time'] for results in all_simulator_results),
+        'max_rss': max(results['max_rss'] for results in all_simulator_results),
+    }
+    ring_buffer_reader.close()
+    ring_buffer.close()
+
+    measurement: MetricsSnapshot = snapshots.get('measurement', {})
+    writer: MetricsSnapshot = snapshots.get('file_writer', {})
+    return {
+        'parameters': {
+            'devices_count': len(hosts),
+            'channels_count': channels_count,
+            'sample_rate': X502_REF_FREQ / adc_frequency_divider,
+            'frame_rate': frame_rate,
+            'portion_size': portion_size,
+            'duration': duration,
+            'file_format': file_format,
+            'decode_stream': decode_stream,
+        },
+        'elapsed_time': elapsed_time,
+        'frames_received': frames_count,
+        'frames_sent': simulator_results['frames_sent'],
+        'throughput': {
+            'frames_per_second': frames_count / elapsed_time,
+            'relative': frames_count / elapsed_time / frame_rate,
+            'received_bytes_per_second': measurement.get('counters', {}).get('received_bytes', 0) / elapsed_time,
+            'disk_bytes_per_second': disk_bytes / (elapsed_time + drain_time),
+        },
+        'portions': {
+            'count': portions_count,
+            'lost': lost_portions_count,
+            'late': late_portions_count,
+            'frames_lost_by_writer': writer.get('counters', {}).get('lost_frames', 0),
+        },
+        'simulator_max_lag_frames': simulator_results['max_lag_frames'],
+        'writer_drain_time': drain_time,
+        'latency': {
+            'consumer': _summary(latency),
+            'writer': {name: value for name, value in writer.get('histograms', {}).get('latency', {}).items()
+                       if name != 'count'},
+        },
+        'cpu_time': {
+            'simulator': simulator_results['process_time'],
+            'acquisition': measurement.get('process_time'),
+            'consumer': consumer_process_time,
+            'file_writer': writer.get('process_time'),
+        },
+        'max_rss': {
+            'simulator': simulator_results['max_rss'],
+            'acquisition': measurement.get('max_rss'),
+            'consumer': max_rss(),
+            'file_writer': writer.get('max_rss'),
+        },
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description='Measure the acquisition from the socket to the files, sweeping the parameters')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.3'],
+                        help='the loopback addresses for the simulators to listen on, several to read them at once')
+    parser.add_argument('--duration', type=float, default=3.0, help='the duration of a run, in seconds')
+    parser.add_argument('--portion-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2, 4], help='the channels of every device')
+    parser.add_argument('--sample-rates', type=float, nargs='+', default=[100e3, 500e3, 2e6],
+                        help='the ADC sample rates, for all the channels together')
+    parser.add_argument('--format', default='.bin', help='the suffix of the files to write')
+    parser.add_argument('--late-latency', type=float, default=0.5,
+                        help='the latency of a portion to take it for late, in seconds')
+    parser.add_argument('--decode', action='store_true',
+                        help='stream the raw ADC words, and calibrate them as the measurement receives them')
+    parser.add_argument('--output', type=Path, help='the JSON file for the results instead of the standard output')
+    args: argparse.Namespace = parser.parse_args(argv)
+    if len(args.hosts) > 1 and args.decode:
+        parser.error('the devices read at once stream the volts only')
+
+    runs: List[Dict[str, Any]] = []
+    portion_size: int
+    channels_count: int
+    sample_rate: float
+    for portion_size, channels_count, sample_rate in product(args.portion_sizes, args.channels, args.sample_rates):
+        result: Dict[str, Any] = run(args.hosts, channels_count, sample_rate, portion_size, args.duration,
+                                     args.format, args.late_latency, args.decode)
+        print(f'{portion_size:7d} frames × {channels_count} channels at {sample_rate:9.0f} S/s: '
+              f'{result["throughput"]["relative"]:6.1%} of the rate, '
+              f'{result["portions"]["lost"]} lost, {result["portions"]["late"]} late', file=sys.stderr)
+        runs.append(result)
+
+    report: Dict[str, Any] = {
+        'benchmark': 'acquisition',
+        'time': datetime.now().isoformat(),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'runs': runs,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with args.output.open('wt') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# coding: utf-8
+
+""" compare the text formatting of `TextBackend` to the former per-value one, checking the output is the same;
+run as `python -m benchmarks.text_backend` """
+
+from __future__ import annotations
+
+import time
+import timeit
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from text_format import format_text
+
+
+def former_format_text(data: np.ndarray) -> str:
+    return ''.join((('\t'.join(f'{xii}' for xii in xi)
+                     if isinstance(xi, Iterable)
+                     else f'{xi}'
+                     ) + '\n')
+                   for xi in data)
+
+
+def identity_data(size: int) -> Dict[str, np.ndarray]:
+    """ the values the default formatting must write exactly as the former one does """
+    rng: np.random.Generator = np.random.default_rng(1)
+    return {
+        'uniform, 2 columns': rng.uniform(-10.0, 10.0, (size, 2)).astype(np.float32),
+        # all the magnitudes, the subnormal values, the infinities, and NaN
+        'random bits, 3 columns': rng.integers(0, 1 << 32, (size, 3), dtype=np.uint64).astype(np.uint32)
+                                  .view(np.float32),
+        'powers of two': np.ldexp(np.float32(1.0), np.arange(-149, 128)).astype(np.float32),
+        'special values': np.array([[0.0, -0.0, 1.0, -2.5, 0.5, 1e-4, 9.9999e-5, 1e16, 3.4e38, 1e-45,
+                                     np.inf, -np.inf, np.nan]], dtype=np.float32),
+        'quarters': (np.arange(-size, size, dtype=np.float32) / 4.0).reshape((-1, 4)),
+        'float64 of float32': rng.uniform(-1.0, 1.0, (size, 3)).astype(np.float32).astype(np.float64),
+        'float64': rng.uniform(-1.0, 1.0, (size // 10, 3)),
+    }
+
+
+def main(size: int = 200_000, repeat: int = 7, min_speedup: float = 10.0) -> None:
+    name: str
+    values: np.ndarray
+    for name, values in identity_data(size).items():
+        with np.errstate(invalid='ignore', over='ignore'):
+            if format_text(values) != former_format_text(values):
+                raise AssertionError(f'The output differs from the former one for {name}')
+    print(f'identical to the former output for {len(identity_data(0))} sets of values')
+
+    data: np.ndarray = np.random.default_rng(0).uniform(-10.0, 10.0, size).astype(np.float32)
+    # the runs alternate for the load of the machine to affect both alike, and the CPU time of the process counts
+    former_times: List[float] = []
+    times: List[float] = []
+    for _ in range(repeat):
+        former_times.append(timeit.timeit(lambda: former_format_text(data), number=1, timer=time.process_time))
+        times.append(min(timeit.repeat(lambda: format_text(data), number=1, repeat=3,
+                                   timer=time.process_time)))
+    former_time: float = min(former_times)
+    print(f'former:         {former_time * 1e3:9.1f} ms')
+    print(f'precision None: {min(times) * 1e3:9.1f} ms, {former_time / min(times):5.1f}× faster')
+
+    precision: Optional[int]
+    for precision in (3, 6):
+        elapsed_time: float = min(timeit.repeat(lambda: format_text(data, precision), number=1, repeat=repeat,
+                                                    timer=time.process_time))
+        print(f'precision {precision!s:>4}: {elapsed_time * 1e3:9.1f} ms, {former_time / elapsed_time:5.1f}× faster')
+
+    if former_time / min(times) < min_speedup:
+        raise AssertionError(f'The default formatting is less than {min_speedup}× faster than the former one')
+
+
+if __name__ == '__main__':
+    main()
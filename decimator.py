@@ -0,0 +1,92 @@
+# coding: utf-8
+from __future__ import annotations
+
+import numpy as np
+
+from stubs import Final
+
+__all__ = ['Decimator', 'design_low_pass']
+
+
+def design_low_pass(factor: int, taps_per_phase: int = 32, beta: float = 8.0) -> np.ndarray:
+    """
+    a windowed sinc filter for decimating by `factor`, of unit gain at zero frequency
+
+    The cut-off is at the Nyquist frequency after decimating, and the Kaiser window of `beta` sets
+    the stop-band attenuation, over 70 dB for the default. The transition band is about `5 / taps_per_phase`
+    of the sample rate after decimating wide, and only its upper half aliases into its lower half,
+    so the frequencies below about `1 - 5 / taps_per_phase` of the new Nyquist frequency stay clean.
+    """
+    taps_count: int = factor * taps_per_phase
+    cutoff: float = 1.0 / factor  # a fraction of the Nyquist frequency before decimating
+    times: np.ndarray = np.arange(taps_count) - (taps_count - 1) / 2.0
+    taps: np.ndarray = cutoff * np.sinc(cutoff * times) * np.kaiser(taps_count, beta)
+    return taps / np.sum(taps)
+
+
+class Decimator:
+    """
+    Low-pass filter the frames and keep every `factor`-th of them, the filter state kept between the portions
+
+    The filter is polyphase: the frames are split into blocks of `factor`, and an output frame is
+    a sum of `taps_per_phase` blocks each multiplied by its part of the filter taps,
+    so only the frames kept get computed, and the work per frame received doesn't depend on the factor.
+    A block of all the channels is multiplied at once, as a matrix product, by the taps spread over the channels.
+    The filter starts from zeros, and it delays the frames by half of its length.
+    """
+
+    def __init__(self, factor: int, channels_count: int, taps_per_phase: int = 32,
+                 dtype: np.dtype = np.dtype(np.float32)) -> None:
+        if factor < 1:
+            raise ValueError('Invalid decimation factor', factor)
+        if taps_per_phase < 1:
+            raise ValueError('Invalid filter length', taps_per_phase)
+        self.factor: Final[int] = factor
+        self.channels_count: Final[int] = channels_count
+        self.taps_per_phase: Final[int] = taps_per_phase
+        self.dtype: Final[np.dtype] = np.dtype(dtype)
+
+        taps: np.ndarray = design_low_pass(factor, taps_per_phase) if factor > 1 else np.ones(1)
+        # the part of the taps for every block back in time, in the order of the frames within a block
+        phases: np.ndarray = taps.reshape((-1, factor))[:, ::-1]
+        self._phases_count: Final[int] = phases.shape[0]
+        # (block back in time, frame within the block × channel, channel) for the blocks flattened
+        self._kernels: np.ndarray = np.zeros((self._phases_count, factor * channels_count, channels_count),
+                                             dtype=self.dtype)
+        channel: int
+        for channel in range(channels_count):
+            self._kernels[:, channel::channels_count, channel] = phases
+        # the frames of the former blocks that the next frames kept depend on, and the frames of an incomplete block
+        self._history: np.ndarray = np.empty((0, channels_count), dtype=self.dtype)
+        self.reset()
+
+    @property
+    def pending_count(self) -> int:
+        """ how many frames wait for their block to be complete """
+        return self._history.shape[0] - (self._phases_count - 1) * self.factor
+
+    def reset(self) -> None:
+        self._history = np.zeros(((self._phases_count - 1) * self.factor, self.channels_count), dtype=self.dtype)
+
+    def input_count(self, output_count: int) -> int:
+        """ how many frames to receive to get exactly `output_count` frames out """
+        return max(0, output_count * self.factor - self.pending_count)
+
+    def decimate(self, frames: np.ndarray) -> np.ndarray:
+        frames = np.asarray(frames).reshape((-1, self.channels_count))
+        if self.factor == 1:
+            return frames.astype(self.dtype, copy=False)
+        data: np.ndarray = np.concatenate((self._history, frames.astype(self.dtype, copy=False)))
+        blocks_count: int = data.shape[0] // self.factor
+        output_count: int = blocks_count - (self._phases_count - 1)
+        if output_count <= 0:
+            self._history = data
+            return np.empty((0, self.channels_count), dtype=self.dtype)
+        blocks: np.ndarray = data[:blocks_count * self.factor].reshape((blocks_count, -1))
+        output: np.ndarray = np.zeros((output_count, self.channels_count), dtype=self.dtype)
+        back: int
+        for back in range(self._phases_count):
+            first: int = self._phases_count - 1 - back
+            output += blocks[first:first + output_count] @ self._kernels[back]
+        self._history = data[output_count * self.factor:].copy()
+        return output
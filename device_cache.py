@@ -0,0 +1,97 @@
+# coding: utf-8
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from stubs import Final
+
+__all__ = ['DeviceCache', 'cache_directory']
+
+
+def cache_directory() -> Path:
+    """ where the application keeps the data it can always get anew """
+    if sys.platform == 'win32':
+        return Path(os.environ.get('LOCALAPPDATA', Path.home() / 'AppData' / 'Local')) / 'e-502'
+    if sys.platform == 'darwin':
+        return Path.home() / 'Library' / 'Caches' / 'e-502'
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'e-502'
+
+
+class DeviceCache:
+    """
+    The hardware info and the calibration tables of the devices, stored on the disk between the connections
+
+    An entry is valid for the device it has been read from while the module data the device reports stays the same:
+    the module data holds the serial number and the firmware versions, and it is read in a single round trip,
+    unlike the calibration that takes reading the flash memory.
+    Also, an entry expires after `max_age` seconds, for the calibration might be rewritten in place.
+    """
+
+    VERSION: Final[int] = 1
+
+    def __init__(self, path: Optional[Path] = None, max_age: float = 30 * 24 * 3600.) -> None:
+        self.path: Final[Path] = path if path is not None else cache_directory() / 'devices.json'
+        self.max_age: Final[float] = max_age
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @staticmethod
+    def _key(ip: str, module_data: bytes) -> str:
+        return ip + '/' + hashlib.sha1(module_data).hexdigest()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                data: Dict[str, Any] = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = {}
+            if not isinstance(data, dict) or data.get('version') != self.VERSION:
+                data = {}
+            self._entries = data.get('devices', {})
+        return self._entries
+
+    def _save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path: Path = self.path.with_name(self.path.name + f'.{os.getpid()}')
+            temporary_path.write_text(json.dumps({'version': self.VERSION, 'devices': self._entries}, indent=1))
+            # the readers in other processes never get a partially written file
+            temporary_path.replace(self.path)
+        except OSError:
+            pass  # it's just a cache
+
+    def get(self, ip: str, module_data: bytes, field: str) -> Any:
+        """ get the stored value of the field, or `None` if the device has changed or the entry has expired """
+        entry: Optional[Dict[str, Any]] = self._load().get(self._key(ip, module_data))
+        if entry is None or time.time() - entry.get('time', 0.) > self.max_age:
+            return None
+        return entry.get(field)
+
+    def put(self, ip: str, module_data: bytes, field: str, value: Any) -> None:
+        entries: Dict[str, Dict[str, Any]] = self._load()
+        key: str = self._key(ip, module_data)
+        # another device at the same address makes the entries of the former one useless
+        stale_keys: List[str] = [k for k in entries if k.startswith(ip + '/') and k != key]
+        for stale_key in stale_keys:
+            del entries[stale_key]
+        entry: Dict[str, Any] = entries.setdefault(key, {})
+        if time.time() - entry.get('time', 0.) > self.max_age:
+            entry.clear()
+        entry.setdefault('time', time.time())
+        entry[field] = value
+        self._save()
+
+    def invalidate(self, ip: Optional[str] = None) -> None:
+        """ forget the device at `ip`, or all the devices """
+        entries: Dict[str, Dict[str, Any]] = self._load()
+        if ip is None:
+            entries.clear()
+        else:
+            for key in [k for k in entries if k.startswith(ip + '/')]:
+                del entries[key]
+        self._save()
@@ -1,27 +1,140 @@
 # coding: utf-8
 import socket
-import struct
+import sys
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Union, Tuple, List, Optional, Sequence
+from typing import Dict, Iterator, Union, Tuple, List, Optional, Sequence
 
 import numpy as np
 
 from channel_settings import ChannelSettings
+from device_cache import DeviceCache
 from hardware_info import HardwareInfo
+from stream_decoder import StreamDecoder
 from stubs import Final
 
-__all__ = ['E502', 'X502_ADC_FREQ_DIV_MAX']
+try:
+    import fcntl
+    import termios
+except ImportError:  # Windows
+    fcntl = None
+    termios = None
+
+__all__ = ['E502', 'RegisterBatch', 'X502_ADC_FREQ_DIV_MAX', 'X502_REF_FREQ', 'CONTROL_PORT', 'DATA_PORT',
+           'adc_frame_rate', 'make_request', 'parse_response_header', 'parse_calibration_data', 'parse_module_data']
 
 X502_ADC_FREQ_DIV_MAX: Final[int] = 1 << 20
+X502_REF_FREQ: Final[float] = 2e6
+
+CONTROL_PORT: Final[int] = 11114
+DATA_PORT: Final[int] = 11115
+
+# 'CTL1', error code, response size
+RESPONSE_HEADER_SIZE: Final[int] = 12
+# how many requests may be sent before their responses get read, for the socket buffers not to overflow
+MAX_PIPELINED_REQUESTS: Final[int] = 64
+
+
+def adc_frame_rate(adc_frequency_divider: int, channels_count: int) -> float:
+    """ the rate of the frames, each holding a sample of every logical channel, with no delay between the frames """
+    return X502_REF_FREQ / adc_frequency_divider / max(1, channels_count)
+
+
+def make_request(command: int, parameter: int, payload: Union[bytes, int, bool], response_size: int) -> bytes:
+    if isinstance(payload, bool):
+        payload = int(payload)
+    if isinstance(payload, int):
+        payload = payload.to_bytes(4, 'little')
+    if len(payload) > 512:
+        raise ValueError('Too large payload')
+    if response_size > 512:
+        raise ValueError('Too long response')
+    return b''.join((
+        b'CTL1',
+        command.to_bytes(4, 'little'),
+        parameter.to_bytes(4, 'little'),
+        len(payload).to_bytes(4, 'little'),
+        response_size.to_bytes(4, 'little'),
+        payload,
+    ))
+
+
+def parse_response_header(header: bytes, verbose: bool = False) -> Tuple[int, int]:
+    """ get the error code and the size of the response that follows the header """
+    if verbose:
+        print(f"CTL1          = {header[:4]!r}")
+    if header[:4] != b'CTL1':
+        raise ConnectionError('Invalid response signature', header[:4])
+    error: int = int.from_bytes(header[4:8], 'little', signed=True)
+    if verbose:
+        print(f"error         = {error:x}")
+    response_size: int = int.from_bytes(header[8:12], 'little')
+    if verbose:
+        print(f"response size = {response_size}")
+    return error, response_size
+
+
+def parse_module_data(data: bytes) -> Tuple[str, str, str]:
+    """ get the device name, the serial number, and the firmware version from the 192 bytes of the module data """
+    if len(data) < 96:
+        raise ValueError('Incorrect module data')
+
+    def text(start: int) -> str:
+        return data[start:start + 32].split(b'\0', 1)[0].decode('ascii', errors='replace')
+
+    return text(0), text(32), text(64)
+
+
+def parse_calibration_data(data: bytes, verbose: bool = False) -> Dict[int, Tuple[List[float], List[float]]]:
+    """ get the offsets and the scales, range by range, channel by channel, for ADC (1) and DAC (2) """
+    coefficients: Dict[int, Tuple[List[float], List[float]]] = {1: ([], []), 2: ([], [])}
+    offset: int = 0
+    while offset + 48 <= len(data):
+        target: int = int.from_bytes(data[offset + 12:offset + 16], 'little')
+        if verbose:
+            print('for', ['', 'ADC', 'DAC'][target] + ':')
+            print('calibration time:', datetime.fromtimestamp(int.from_bytes(data[offset + 32:offset + 40], 'little')))
+        channels_count: int = int.from_bytes(data[offset + 40:offset + 44], 'little')
+        ranges_count: int = int.from_bytes(data[offset + 44:offset + 48], 'little')
+        # offset and scale pairs, range by range, channel by channel
+        pairs: np.ndarray = np.frombuffer(data, dtype='<f8', count=2 * ranges_count * channels_count,
+                                          offset=offset + 48).reshape((-1, 2))
+        if verbose:
+            r: int
+            c: int
+            for r in range(ranges_count):
+                for c in range(channels_count):
+                    print(f'for range {r} of channel {c}: '
+                          f'offset is {pairs[r * channels_count + c, 0]}, scale is {pairs[r * channels_count + c, 1]}')
+        if target in coefficients:
+            coefficients[target][0].extend(pairs[:, 0].tolist())
+            coefficients[target][1].extend(pairs[:, 1].tolist())
+        offset += 48 + pairs.nbytes
+    return coefficients
+
+
+class RegisterBatch:
+    """ the register writes sent back to back, with their responses collected afterwards """
+
+    def __init__(self) -> None:
+        # the registers written, in the order of the responses awaited
+        self.pending: List[int] = []
+        # the registers written along with the error codes of the writes
+        self.results: List[Tuple[int, int]] = []
+
+    @property
+    def errors(self) -> Dict[int, int]:
+        """ the registers that failed to be written, the last error code for each """
+        return {register: error for register, error in self.results if error}
 
 
 class E502:
-    def __init__(self, ip: str, verbose: bool = False) -> None:
+    def __init__(self, ip: str, verbose: bool = False, cache: Optional[DeviceCache] = None) -> None:
         self._ip: Final[str] = ip[:]
         self._control_socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._control_socket.connect((ip, 11114))
+        self._control_socket.connect((ip, CONTROL_PORT))
         self._data_socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._data_socket.connect((ip, 11115))
+        self._data_socket.connect((ip, DATA_PORT))
         self._settings: List[ChannelSettings] = []
         self._verbose: Final[bool] = verbose
 
@@ -31,39 +144,73 @@ class E502:
         self._dac_scales: List[float] = []
         self._dac_offsets: List[float] = []
 
+        self._data_buffer: np.ndarray = np.empty((0, 0), dtype=np.float32)
+        self._words_buffer: np.ndarray = np.empty(0, dtype=np.uint32)
+        self._decoder: Optional[StreamDecoder] = None
+        # what the data connection has given, for the throughput to be measured
+        self.received_bytes_count: int = 0
+        self.receive_calls_count: int = 0
+
+        self._batch: Optional[RegisterBatch] = None
+
+        # the hardware info and the calibration are read from the cache while the module data matches
+        self._cache: Final[Optional[DeviceCache]] = cache
+        self._module_data: Optional[bytes] = None
+
     def __del__(self) -> None:
         self._control_socket.close()
         self._data_socket.close()
 
     def send_request(self, command: int, parameter: int, payload: Union[bytes, int, bool], response_size: int) -> None:
-        if isinstance(payload, bool):
-            payload = int(payload)
-        if isinstance(payload, int):
-            payload = payload.to_bytes(4, 'little')
-        if len(payload) > 512:
-            raise ValueError('Too large payload')
-        if response_size > 512:
-            raise ValueError('Too long response')
-        self._control_socket.send(b''.join((
-            b'CTL1',
-            command.to_bytes(4, 'little'),
-            parameter.to_bytes(4, 'little'),
-            len(payload).to_bytes(4, 'little'),
-            response_size.to_bytes(4, 'little'),
-            payload,
-        )))
+        self._control_socket.sendall(make_request(command, parameter, payload, response_size))
+
+    def _receive(self, size: int) -> bytes:
+        """ receive exactly `size` bytes from the control socket, however short the reads are """
+        data: bytearray = bytearray(size)
+        view: memoryview = memoryview(data)
+        received_count: int = 0
+        while received_count < size:
+            piece_size: int = self._control_socket.recv_into(view[received_count:], size - received_count)
+            if not piece_size:
+                raise ConnectionError('Control connection closed')
+            received_count += piece_size
+        return bytes(data)
+
+    def _collect_batch_responses(self) -> None:
+        batch: Final[RegisterBatch] = self._batch
+        self._batch = None  # for `get_response` to get the responses
+        try:
+            while batch.pending:
+                batch.results.append((batch.pending[0], self.get_response()[1]))
+                del batch.pending[0]
+        finally:
+            self._batch = batch
+        if self._verbose and batch.errors:
+            print('errors:', batch.errors)
+
+    @contextmanager
+    def batch(self) -> Iterator[RegisterBatch]:
+        """ send the register writes inside the block without waiting for the device to respond to each """
+        if self._batch is not None:  # nested
+            yield self._batch
+            return
+        self._batch = RegisterBatch()
+        try:
+            yield self._batch
+        finally:
+            try:
+                self._collect_batch_responses()
+            finally:
+                self._batch = None
 
     def get_response(self) -> Tuple[bytes, int]:
-        ctl1: bytes = self._control_socket.recv(4)
-        if self._verbose:
-            print(f"CTL1          = {ctl1!r}")
-        error: int = int.from_bytes(self._control_socket.recv(4), 'little', signed=True)
-        if self._verbose:
-            print(f"error         = {error:x}")
-        response_size: int = int.from_bytes(self._control_socket.recv(4), 'little')
-        if self._verbose:
-            print(f"response size = {response_size}")
-        response: bytes = self._control_socket.recv(response_size)
+        if self._batch is not None and self._batch.pending:
+            # the responses come in the order of the requests
+            self._collect_batch_responses()
+        error: int
+        response_size: int
+        error, response_size = parse_response_header(self._receive(RESPONSE_HEADER_SIZE), self._verbose)
+        response: bytes = self._receive(response_size)
         if self._verbose:
             print(f"response      = {response!r}")
         return response, error
@@ -158,6 +305,11 @@ class E502:
         if isinstance(payload, int):
             payload = payload.to_bytes(4, 'little')
         self.send_request(0x11, number, payload, 0)
+        if self._batch is not None:
+            self._batch.pending.append(number)
+            if len(self._batch.pending) >= MAX_PIPELINED_REQUESTS:
+                self._collect_batch_responses()
+            return 0
         return self.get_response()[1]
 
     def read_int(self, number: int) -> Tuple[int, int]:
@@ -193,7 +345,25 @@ class E502:
         self.send_request(0x80, 0, bytes(), 192)
         return self.get_response()
 
+    def _cached_module_data(self) -> Optional[bytes]:
+        """ the module data to look the device up in the cache by, read once per connection """
+        if self._cache is None:
+            return None
+        if self._module_data is None:
+            data: bytes
+            error: int
+            data, error = self.read_module_data()
+            if error:
+                return None
+            self._module_data = data
+        return self._module_data
+
     def hardware(self) -> Optional[HardwareInfo]:
+        module_data: Final[Optional[bytes]] = self._cached_module_data()
+        if module_data is not None:
+            cached_data: Optional[str] = self._cache.get(self._ip, module_data, 'hardware')
+            if cached_data is not None:
+                return HardwareInfo(bytes.fromhex(cached_data))
         data: bytes
         error: int
         data, error = self.read_register(0x010a)
@@ -204,47 +374,44 @@ class E502:
         else:
             if self._verbose:
                 print(HardwareInfo(data))
+            if module_data is not None:
+                self._cache.put(self._ip, module_data, 'hardware', data.hex())
             return HardwareInfo(data)
 
     def calibration_data(self) -> None:
-        data: bytes
-        error: int
-        data, error = self.read_flash_memory(0x1F0080, 0xe0)
-        if self._verbose and error:
-            print('error:', error)
-            return
-        while data:
-            target: int = int.from_bytes(data[12:16], 'little')
-            if self._verbose:
-                print('for', ['', 'ADC', 'DAC'][target] + ':')
-                print('calibration time:', datetime.fromtimestamp(int.from_bytes(data[32:40], 'little')))
-            channels_count: int = int.from_bytes(data[40:44], 'little')
-            ranges_count: int = int.from_bytes(data[44:48], 'little')
-            offset: int = 48
-            for r in range(ranges_count):
-                for c in range(channels_count):
-                    if self._verbose:
-                        print(f'for range {r} of channel {c}: ', end='')
-                        print(f'offset is', *struct.unpack_from('<d', data, offset), end=', ')
-                    if target == 1:
-                        self._adc_offsets.extend(struct.unpack_from('<d', data, offset))
-                    elif target == 2:
-                        self._dac_offsets.extend(struct.unpack_from('<d', data, offset))
-                    offset += 8
-                    if self._verbose:
-                        print(f'scale is', *struct.unpack_from('<d', data, offset))
-                    if target == 1:
-                        self._adc_scales.extend(struct.unpack_from('<d', data, offset))
-                    elif target == 2:
-                        self._dac_scales.extend(struct.unpack_from('<d', data, offset))
-                    offset += 8
-            data = data[offset:]
+        module_data: Final[Optional[bytes]] = self._cached_module_data()
+        coefficients: Optional[Dict[int, Tuple[List[float], List[float]]]] = None
+        if module_data is not None:
+            cached_coefficients: Optional[Dict[str, List[List[float]]]] = self._cache.get(self._ip, module_data,
+                                                                                          'calibration')
+            if cached_coefficients is not None:
+                coefficients = {int(target): (offsets, scales)
+                                for target, (offsets, scales) in cached_coefficients.items()}
+        if coefficients is None:
+            data: bytes
+            error: int
+            data, error = self.read_flash_memory(0x1F0080, 0xe0)
+            if error:
+                if self._verbose:
+                    print('error:', error)
+                return
+            coefficients = parse_calibration_data(data, self._verbose)
+            if module_data is not None:
+                self._cache.put(self._ip, module_data, 'calibration', coefficients)
+        self._adc_offsets[:], self._adc_scales[:] = coefficients[1]
+        self._dac_offsets[:], self._dac_scales[:] = coefficients[2]
+        self._decoder = None
+
+    @property
+    def adc_calibration(self) -> Dict[str, List[float]]:
+        """ the offsets and the scales of the ADC ranges, empty until `calibration_data` has read them """
+        return {'adc_offsets': list(self._adc_offsets), 'adc_scales': list(self._adc_scales)}
 
     def reset_data_socket(self) -> int:
         self.send_request(0x23, 0, bytes(), 0)
         response: Final[int] = self.get_response()[1]
         self._data_socket.close()
-        self._data_socket.connect((self._ip, 11115))
+        self._data_socket.connect((self._ip, DATA_PORT))
         return response
 
     def read_channels_settings_table(self) -> Tuple[Sequence[ChannelSettings], int]:
@@ -262,38 +429,38 @@ class E502:
             channels_settings.append(ChannelSettings(channel_settings))
         return channels_settings, 0
 
-    def write_channels_settings_table(self, channels_settings: Sequence[ChannelSettings]) -> None:
+    def write_channels_settings_table(self, channels_settings: Sequence[ChannelSettings]) -> Dict[int, int]:
+        """ write the table, and return the registers failed to be written along with the error codes """
         self._settings = list(channels_settings)
-        self.write_register(0x300, len(channels_settings) - 1)
-        channel: int
-        channel_settings: ChannelSettings
-        for channel, channel_settings in enumerate(channels_settings):
-            self.write_register(0x200 + 4 * (len(channels_settings) - channel - 1), int(channel_settings))
-
-    def write_analog(self, index: int, value: float) -> None:
+        self._decoder = None
+        batch: RegisterBatch
+        with self.batch() as batch:
+            self.write_register(0x300, len(channels_settings) - 1)
+            channel: int
+            channel_settings: ChannelSettings
+            for channel, channel_settings in enumerate(channels_settings):
+                self.write_register(0x200 + 4 * (len(channels_settings) - channel - 1), int(channel_settings))
+        return batch.errors
+
+    def write_analog(self, index: int, value: float) -> int:
         if not self._dac_scales:
             self.calibration_data()
         if not (0 <= index < len(self._dac_scales)):
             raise ValueError('Invalid analog output')
         payload: bytes = round(value * self._dac_scales[index] * 6000 + self._dac_offsets[index])\
             .to_bytes(2, 'little', signed=True) + b'\0' + [b'\x40', b'\x80'][index]
-        self.send_request(
-            0x11, 0x312,
-            payload,
-            0)
+        return self.write_register(0x312, payload)
 
-    def write_digital(self, index: int, on: bool) -> None:
+    def write_digital(self, index: int, on: bool) -> int:
         if not (0 <= index < len(self._digital_out)):
             raise ValueError('Invalid digital output')
         self._digital_out[index] = on
-        self.send_request(
-            0x11, 0x312,
-            sum((1 << i) for i, v in enumerate(self._digital_out) if v),
-            0)
+        return self.write_register(0x312, sum((1 << i) for i, v in enumerate(self._digital_out) if v))
 
     def preload_adc(self) -> None:
-        self.write_register(0x30C, 1)
-        self.write_register(0x30C, 1)  # by design, not an error
+        with self.batch():
+            self.write_register(0x30C, 1)
+            self.write_register(0x30C, 1)  # by design, not an error
 
     def set_sync_io(self, running: bool) -> None:
         self.write_register(0x30A, running)
@@ -304,24 +471,82 @@ class E502:
     def set_adc_frequency_divider(self, new_value: int) -> None:
         if not (1 <= new_value <= X502_ADC_FREQ_DIV_MAX):
             raise ValueError('Invalid ADC frequency divider')
-        self.write_register(0x302, new_value - 1)
-        self.write_register(0x412, new_value - 1)
+        with self.batch():
+            self.write_register(0x302, new_value - 1)
+            self.write_register(0x412, new_value - 1)
 
     def set_digital_lines_frequency_divider(self, new_value: int) -> None:
         if new_value <= 0:
             raise ValueError('Invalid digital lines frequency divider')
         self.write_register(0x306, new_value - 1)
 
-    def get_data(self, size: int) -> np.ndarray:
+    def get_data(self, size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ receive `size` frames into `out` or into a reusable buffer that the next call overwrites """
+
         if size < 0:
             raise ValueError('Invalid data size', size)
 
-        data: bytes = b''
-        remaining_count: int = size * np.dtype(np.float32).itemsize * len(self._settings)
+        channels_count: Final[int] = len(self._settings)
+        if out is None:
+            if self._data_buffer.shape[0] < size or self._data_buffer.shape[1] != channels_count:
+                self._data_buffer = np.empty((size, channels_count), dtype=np.float32)
+            out = self._data_buffer[:size]
+        elif out.shape != (size, channels_count) or out.dtype != np.float32 or not out.flags.c_contiguous:
+            raise ValueError('Invalid output array', out.shape, out.dtype)
+
+        self._receive_data(memoryview(out).cast('B'))
+        return out
+
+    def _receive_data(self, view: memoryview) -> None:
+        received_count: int = 0
+        remaining_count: int = view.nbytes
         while remaining_count > 0:
-            data_piece: bytes = self._data_socket.recv(remaining_count)
-            remaining_count -= len(data_piece)
-            data += data_piece
-        if remaining_count < 0:
-            data = data[:remaining_count]
-        return np.frombuffer(data, np.float32).reshape((len(self._settings), -1), ).T
+            piece_size: int = self._data_socket.recv_into(view[received_count:], remaining_count)
+            self.receive_calls_count += 1
+            if not piece_size:
+                raise ConnectionError('Data connection closed')
+            received_count += piece_size
+            remaining_count -= piece_size
+        self.received_bytes_count += received_count
+
+    def pending_bytes_count(self) -> Optional[int]:
+        """ how many bytes of the data wait in the socket to be received, if the platform tells it """
+        if fcntl is None:
+            return None
+        count: bytearray = bytearray(4)
+        fcntl.ioctl(self._data_socket.fileno(), termios.FIONREAD, count)
+        return int.from_bytes(count, sys.byteorder, signed=True)
+
+    def get_words(self, count: int) -> np.ndarray:
+        """ receive `count` raw stream words into a reusable buffer that the next call overwrites """
+        if count < 0:
+            raise ValueError('Invalid words count', count)
+        if self._words_buffer.size < count:
+            self._words_buffer = np.empty(count, dtype=np.uint32)
+        words: np.ndarray = self._words_buffer[:count]
+        self._receive_data(memoryview(words).cast('B'))
+        return words
+
+    @property
+    def decoder(self) -> StreamDecoder:
+        """ the decoder for the current channels table and calibration """
+        if self._decoder is None:
+            self._decoder = StreamDecoder(self._settings, self._adc_offsets, self._adc_scales)
+        return self._decoder
+
+    def get_voltages(self, size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ receive `size` frames of raw words, and convert them into calibrated volts in `out` """
+        if size < 0:
+            raise ValueError('Invalid data size', size)
+        decoder: Final[StreamDecoder] = self.decoder
+        if out is None:
+            out = np.empty((size, decoder.channels_count), dtype=np.float32)
+        elif out.shape != (size, decoder.channels_count) or out.dtype != np.float32:
+            raise ValueError('Invalid output array', out.shape, out.dtype)
+        filled_count: int = 0
+        while filled_count < size:
+            # digital inputs words and service messages among the words make the frames fewer
+            words: np.ndarray = self.get_words((size - filled_count) * decoder.channels_count
+                                               - decoder.pending_count)
+            filled_count += decoder.decode(words, out=out[filled_count:])[0].shape[0]
+        return out
@@ -0,0 +1,317 @@
+# coding: utf-8
+from __future__ import annotations
+
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from channel_settings import ChannelSettings
+from e502 import (CONTROL_PORT, DATA_PORT, MAX_PIPELINED_REQUESTS, RESPONSE_HEADER_SIZE, X502_ADC_FREQ_DIV_MAX,
+                  RegisterBatch, make_request, parse_calibration_data, parse_response_header)
+from hardware_info import HardwareInfo
+from stubs import Final
+
+__all__ = ['AsyncE502']
+
+
+class AsyncE502:
+    """
+    The same commands as `E502` has, as coroutines, for a single event loop to drive several devices at once
+
+    The control requests are serialized, for the responses come in the order of the requests,
+    while the data stream is received independently of them.
+    """
+
+    def __init__(self, ip: str, verbose: bool = False) -> None:
+        self._ip: Final[str] = ip[:]
+        self._verbose: Final[bool] = verbose
+        self._control_reader: Optional[asyncio.StreamReader] = None
+        self._control_writer: Optional[asyncio.StreamWriter] = None
+        self._control_lock: asyncio.Lock = asyncio.Lock()
+        self._data_socket: Optional[socket.socket] = None
+        self._settings: List[ChannelSettings] = []
+
+        self._digital_out: List[bool] = [False] * 16
+        self._adc_scales: List[float] = []
+        self._adc_offsets: List[float] = []
+        self._dac_scales: List[float] = []
+        self._dac_offsets: List[float] = []
+
+        self._data_buffer: np.ndarray = np.empty((0, 0), dtype=np.float32)
+
+        # the register writes deferred till the end of the `batch` block or till another request
+        self._batch: Optional[RegisterBatch] = None
+        self._batched_writes: Optional[List[Tuple[int, Union[bool, int, bytes]]]] = None
+
+    async def __aenter__(self) -> AsyncE502:
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *_args: object) -> None:
+        await self.close()
+
+    @property
+    def ip(self) -> str:
+        return self._ip
+
+    async def connect(self) -> None:
+        self._control_reader, self._control_writer = await asyncio.open_connection(self._ip, CONTROL_PORT)
+        await self._connect_data_socket()
+
+    async def _connect_data_socket(self) -> None:
+        # a bare socket rather than a stream lets the frames be received right into the target array
+        data_socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        data_socket.setblocking(False)
+        try:
+            await asyncio.get_running_loop().sock_connect(data_socket, (self._ip, DATA_PORT))
+        except BaseException:
+            data_socket.close()
+            raise
+        self._data_socket = data_socket
+
+    async def close(self) -> None:
+        if self._data_socket is not None:
+            self._data_socket.close()
+            self._data_socket = None
+        if self._control_writer is not None:
+            self._control_writer.close()
+            try:
+                await self._control_writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._control_reader = self._control_writer = None
+
+    async def _get_response(self) -> Tuple[bytes, int]:
+        try:
+            error: int
+            response_size: int
+            error, response_size = parse_response_header(
+                await self._control_reader.readexactly(RESPONSE_HEADER_SIZE), self._verbose)
+            response: bytes = await self._control_reader.readexactly(response_size)
+        except asyncio.IncompleteReadError as ex:
+            raise ConnectionError('Control connection closed') from ex
+        if self._verbose:
+            print(f"response      = {response!r}")
+        return response, error
+
+    async def transact(self, command: int, parameter: int, payload: Union[bytes, int, bool],
+                       response_size: int) -> Tuple[bytes, int]:
+        """ send a request and wait for its response, not letting other requests in between """
+        if self._control_reader is None or self._control_writer is None:
+            raise ConnectionError('Not connected')
+        # the request is to see the registers written before it, as with `E502`
+        await self._send_batched_writes()
+        request: bytes = make_request(command, parameter, payload, response_size)
+        async with self._control_lock:
+            self._control_writer.write(request)
+            await self._control_writer.drain()
+            return await self._get_response()
+
+    async def write_registers(self, writes: Sequence[Tuple[int, Union[bool, int, bytes]]]) -> RegisterBatch:
+        """ send the register writes back to back, and only then collect the responses """
+        if self._control_reader is None or self._control_writer is None:
+            raise ConnectionError('Not connected')
+        batch: RegisterBatch = RegisterBatch()
+        start: int
+        number: int
+        payload: Union[bool, int, bytes]
+        async with self._control_lock:
+            for start in range(0, len(writes), MAX_PIPELINED_REQUESTS):
+                for number, payload in writes[start:start + MAX_PIPELINED_REQUESTS]:
+                    self._control_writer.write(make_request(0x11, number, payload, 0))
+                    batch.pending.append(number)
+                await self._control_writer.drain()
+                while batch.pending:
+                    batch.results.append((batch.pending[0], (await self._get_response())[1]))
+                    del batch.pending[0]
+        if self._verbose and batch.errors:
+            print('errors:', batch.errors)
+        return batch
+
+    async def _send_batched_writes(self) -> None:
+        """ send the register writes deferred so far, adding their results to those of the batch """
+        if not self._batched_writes:
+            return
+        writes: List[Tuple[int, Union[bool, int, bytes]]] = self._batched_writes[:]
+        self._batched_writes.clear()
+        self._batch.results.extend((await self.write_registers(writes)).results)
+
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[RegisterBatch]:
+        """
+        defer the register writes inside the block, and send them back to back on leaving it
+
+        Any other request sends the writes deferred before it first, so it sees them done.
+        The writes are sent even if the block raises, and a nested block joins the outer one.
+        The results of the writes are known only after they are sent, so they are zero inside the block.
+        """
+        if self._batch is not None:  # nested
+            yield self._batch
+            return
+        batch: RegisterBatch = RegisterBatch()
+        self._batch = batch
+        self._batched_writes = []
+        try:
+            yield batch
+        finally:
+            try:
+                await self._send_batched_writes()
+            finally:
+                self._batch = None
+                self._batched_writes = None
+
+    async def read_register(self, number: int) -> Tuple[bytes, int]:
+        return await self.transact(0x10, number, bytes(), 4)
+
+    async def write_register(self, number: int, payload: Union[bool, int, bytes]) -> int:
+        if self._batched_writes is not None:
+            self._batched_writes.append((number, payload))
+            return 0
+        return (await self.transact(0x11, number, payload, 0))[1]
+
+    async def read_int(self, number: int) -> Tuple[int, int]:
+        response: Final[Tuple[bytes, int]] = await self.read_register(number)
+        return int.from_bytes(response[0], 'little'), response[1]
+
+    async def read_flash_memory(self, address: int, length: int) -> Tuple[bytes, int]:
+        if not (0 < length < 512):
+            raise ValueError('Invalid data length to read')
+        return await self.transact(0x17, address, bytes(), length)
+
+    async def write_flash_memory(self, address: int, data: bytes) -> Tuple[bytes, int]:
+        if not (0 < len(data) < 512):
+            raise ValueError('Invalid data length to write')
+        return await self.transact(0x18, address, data, 0)
+
+    async def start_data_stream(self, as_dac: bool = False) -> int:
+        return (await self.transact(0x12, (1 << 16) if as_dac else 0, bytes(), 0))[1]
+
+    async def stop_data_stream(self, as_dac: bool = False) -> int:
+        return (await self.transact(0x13, (1 << 16) if as_dac else 0, bytes(), 0))[1]
+
+    async def is_data_stream_running(self, as_dac: bool = False) -> Tuple[bool, int]:
+        response: Final[Tuple[bytes, int]] = await self.transact(0x15, (1 << 16) if as_dac else 0, bytes(), 1)
+        return bool(int.from_bytes(response[0], 'little')), response[1]
+
+    async def read_module_data(self) -> Tuple[bytes, int]:
+        return await self.transact(0x80, 0, bytes(), 192)
+
+    async def hardware(self) -> Optional[HardwareInfo]:
+        data: bytes
+        error: int
+        data, error = await self.read_register(0x010a)
+        if error:
+            if self._verbose:
+                print('error:', error)
+            return None
+        if self._verbose:
+            print(HardwareInfo(data))
+        return HardwareInfo(data)
+
+    async def calibration_data(self) -> None:
+        data: bytes
+        error: int
+        data, error = await self.read_flash_memory(0x1F0080, 0xe0)
+        if error:
+            if self._verbose:
+                print('error:', error)
+            return
+        coefficients: Dict[int, Tuple[List[float], List[float]]] = parse_calibration_data(data, self._verbose)
+        self._adc_offsets[:], self._adc_scales[:] = coefficients[1]
+        self._dac_offsets[:], self._dac_scales[:] = coefficients[2]
+
+    async def reset_data_socket(self) -> int:
+        response: Final[int] = (await self.transact(0x23, 0, bytes(), 0))[1]
+        if self._data_socket is not None:
+            self._data_socket.close()
+            self._data_socket = None
+        await self._connect_data_socket()
+        return response
+
+    async def read_channels_settings_table(self) -> Tuple[Sequence[ChannelSettings], int]:
+        channels_count: int
+        error: int
+        channels_count, error = await self.read_int(0x300)
+        channels_settings: List[ChannelSettings] = []
+        if error:
+            return channels_settings, error
+        channel: int
+        for channel in range(channels_count + 1):
+            channel_settings, error = await self.read_int(0x200 + 4 * (channels_count - channel - 1))
+            if error:
+                return channels_settings, error
+            channels_settings.append(ChannelSettings(channel_settings))
+        return channels_settings, 0
+
+    async def write_channels_settings_table(self, channels_settings: Sequence[ChannelSettings]) -> Dict[int, int]:
+        """ write the table, and return the registers failed to be written along with the error codes """
+        self._settings = list(channels_settings)
+        writes: List[Tuple[int, int]] = [(0x300, len(channels_settings) - 1)]
+        channel: int
+        channel_settings: ChannelSettings
+        for channel, channel_settings in enumerate(channels_settings):
+            writes.append((0x200 + 4 * (len(channels_settings) - channel - 1), int(channel_settings)))
+        return (await self.write_registers(writes)).errors
+
+    async def write_analog(self, index: int, value: float) -> int:
+        if not self._dac_scales:
+            await self.calibration_data()
+        if not (0 <= index < len(self._dac_scales)):
+            raise ValueError('Invalid analog output')
+        payload: bytes = round(value * self._dac_scales[index] * 6000 + self._dac_offsets[index])\
+            .to_bytes(2, 'little', signed=True) + b'\0' + [b'\x40', b'\x80'][index]
+        return await self.write_register(0x312, payload)
+
+    async def write_digital(self, index: int, on: bool) -> int:
+        if not (0 <= index < len(self._digital_out)):
+            raise ValueError('Invalid digital output')
+        self._digital_out[index] = on
+        return await self.write_register(0x312, sum((1 << i) for i, v in enumerate(self._digital_out) if v))
+
+    async def preload_adc(self) -> None:
+        await self.write_registers([(0x30C, 1), (0x30C, 1)])  # twice by design, not an error
+
+    async def set_sync_io(self, running: bool) -> None:
+        await self.write_register(0x30A, running)
+
+    async def enable_in_stream(self, from_adc: bool = False, from_digital_inputs: bool = False) -> None:
+        await self.write_register(0x419, int(from_adc) + int(from_digital_inputs) * 2)
+
+    async def set_adc_frequency_divider(self, new_value: int) -> None:
+        if not (1 <= new_value <= X502_ADC_FREQ_DIV_MAX):
+            raise ValueError('Invalid ADC frequency divider')
+        await self.write_registers([(0x302, new_value - 1), (0x412, new_value - 1)])
+
+    async def set_digital_lines_frequency_divider(self, new_value: int) -> None:
+        if new_value <= 0:
+            raise ValueError('Invalid digital lines frequency divider')
+        await self.write_register(0x306, new_value - 1)
+
+    async def get_data(self, size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ receive `size` frames into `out` or into a reusable buffer that the next call overwrites """
+
+        if size < 0:
+            raise ValueError('Invalid data size', size)
+        if self._data_socket is None:
+            raise ConnectionError('Not connected')
+
+        channels_count: Final[int] = len(self._settings)
+        if out is None:
+            if self._data_buffer.shape[0] < size or self._data_buffer.shape[1] != channels_count:
+                self._data_buffer = np.empty((size, channels_count), dtype=np.float32)
+            out = self._data_buffer[:size]
+        elif out.shape != (size, channels_count) or out.dtype != np.float32 or not out.flags.c_contiguous:
+            raise ValueError('Invalid output array', out.shape, out.dtype)
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        view: memoryview = memoryview(out).cast('B')
+        received_count: int = 0
+        while received_count < view.nbytes:
+            piece_size: int = await loop.sock_recv_into(self._data_socket, view[received_count:])
+            if not piece_size:
+                raise ConnectionError('Data connection closed')
+            received_count += piece_size
+        return out
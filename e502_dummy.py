@@ -3,12 +3,15 @@ from __future__ import annotations
 
 import sys
 import time
-from typing import Tuple, List, Sequence
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple, List, Optional, Sequence
 
 import numpy as np
 from numpy.typing import NDArray
 
 from channel_settings import ChannelSettings
+from device_cache import DeviceCache
+from e502 import RegisterBatch
 from stubs import Final
 
 __all__ = ['E502', 'X502_ADC_FREQ_DIV_MAX']
@@ -17,7 +20,7 @@ X502_ADC_FREQ_DIV_MAX: Final[int] = 1 << 20
 
 
 class E502:
-    def __init__(self, ip: str, verbose: bool = False) -> None:
+    def __init__(self, ip: str, verbose: bool = False, cache: Optional[DeviceCache] = None) -> None:
         print('dummy e-502 is being used', file=sys.stderr)
 
         self._ip: Final[str] = ip[:]
@@ -30,6 +33,8 @@ class E502:
         self._dac_scales: List[float] = []
         self._dac_offsets: List[float] = []
         self._is_data_steam_running: bool = False
+        self.received_bytes_count: int = 0
+        self.receive_calls_count: int = 0
 
     def start_data_stream(self, as_dac: bool = False) -> int:
         self._is_data_steam_running = True
@@ -42,14 +47,27 @@ class E502:
     def is_data_stream_running(self, as_dac: bool = False) -> Tuple[bool, int]:
         return self._is_data_steam_running, 0
 
-    def write_channels_settings_table(self, channels_settings: Sequence[ChannelSettings]) -> None:
+    def calibration_data(self) -> None:
+        pass
+
+    @property
+    def adc_calibration(self) -> Dict[str, List[float]]:
+        """ the offsets and the scales of the ADC ranges, empty until `calibration_data` has read them """
+        return {'adc_offsets': list(self._adc_offsets), 'adc_scales': list(self._adc_scales)}
+
+    @contextmanager
+    def batch(self) -> Iterator[RegisterBatch]:
+        yield RegisterBatch()
+
+    def write_channels_settings_table(self, channels_settings: Sequence[ChannelSettings]) -> Dict[int, int]:
         self._settings = list(channels_settings)
+        return {}
 
-    def write_analog(self, index: int, value: float) -> None:
-        pass
+    def write_analog(self, index: int, value: float) -> int:
+        return 0
 
-    def write_digital(self, index: int, on: bool) -> None:
-        pass
+    def write_digital(self, index: int, on: bool) -> int:
+        return 0
 
     def preload_adc(self) -> None:
         pass
@@ -66,9 +84,22 @@ class E502:
     def set_digital_lines_frequency_divider(self, new_value: int) -> None:
         pass
 
-    def get_data(self, size: int) -> NDArray[np.float64]:
+    def get_data(self, size: int, out: Optional[NDArray[np.float32]] = None) -> NDArray[np.float32]:
         if size < 0:
             raise ValueError('Invalid data size', size)
+        if out is None:
+            out = np.empty((size, len(self._settings)), dtype=np.float32)
+        elif out.shape != (size, len(self._settings)):
+            raise ValueError('Invalid output array', out.shape, out.dtype)
         time.sleep(0.5)
         print(f'{size} random numbers')
-        return np.random.random((size, len(self._settings)))
+        out[...] = np.random.random(out.shape)
+        self.received_bytes_count += out.nbytes
+        self.receive_calls_count += 1
+        return out
+
+    def pending_bytes_count(self) -> Optional[int]:
+        return None
+
+    def get_voltages(self, size: int, out: Optional[NDArray[np.float32]] = None) -> NDArray[np.float32]:
+        return self.get_data(size, out=out)
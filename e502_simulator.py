@@ -0,0 +1,381 @@
+# coding: utf-8
+
+""" an E-502 emulated on the local network, for running and benchmarking the code with no device;
+run as `python -m e502_simulator` """
+
+from __future__ import annotations
+
+import argparse
+import random
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from channel_settings import ChannelSettings
+from e502 import CONTROL_PORT, DATA_PORT, X502_REF_FREQ
+from stream_decoder import StreamDecoder, X502_ADC_SCALE_CODE_MAX
+from stubs import Final
+
+__all__ = ['E502Simulator', 'SignalFunction', 'default_signal', 'make_calibration_image']
+
+# the volts of the logical channels, frame by frame, for the times of the frames, in seconds
+SignalFunction = Callable[[np.ndarray, Sequence[ChannelSettings]], np.ndarray]
+
+REQUEST_HEADER_SIZE: Final[int] = 20
+
+ERROR_INVALID_COMMAND: Final[int] = -1
+ERROR_INVALID_ADDRESS: Final[int] = -2
+ERROR_INVALID_SIZE: Final[int] = -3
+
+FLASH_SIZE: Final[int] = 0x200000
+CALIBRATION_ADDRESS: Final[int] = 0x1F0080
+
+HARDWARE_REGISTER: Final[int] = 0x010a
+LCH_CNT_REGISTER: Final[int] = 0x300
+ADC_FREQ_DIV_REGISTER: Final[int] = 0x302
+GO_SYNC_IO_REGISTER: Final[int] = 0x30A
+
+
+def default_signal(times: np.ndarray, settings: Sequence[ChannelSettings]) -> np.ndarray:
+    """ 1 ms pulses of 4 V every 10 ms on the first channel, and a noisy 1 kHz sine of 1 V on the rest """
+    volts: np.ndarray = np.empty((times.size, len(settings)), dtype=np.float64)
+    if len(settings):
+        volts[:, 0] = np.where(np.mod(times, 0.01) < 0.001, 4.0, 0.0)
+    if len(settings) > 1:
+        volts[:, 1:] = np.sin(2.0 * np.pi * 1e3 * times)[:, np.newaxis]
+        volts[:, 1:] += np.random.default_rng().normal(0.0, 0.01, (times.size, len(settings) - 1))
+    return volts
+
+
+def make_calibration_image(adc_coefficients: Sequence[Tuple[float, float]],
+                           dac_coefficients: Sequence[Tuple[float, float]],
+                           calibration_time: Optional[int] = None) -> bytes:
+    """ the calibration blocks as `parse_calibration_data` reads them: the offset and the scale pairs by the range """
+    if calibration_time is None:
+        calibration_time = int(time.time())
+    blocks: List[bytes] = []
+    target: int
+    coefficients: Sequence[Tuple[float, float]]
+    channels_count: int
+    for target, coefficients, channels_count in ((1, adc_coefficients, 1),
+                                                 (2, dac_coefficients, len(dac_coefficients))):
+        header: bytearray = bytearray(48)
+        header[12:16] = target.to_bytes(4, 'little')
+        header[32:40] = calibration_time.to_bytes(8, 'little')
+        header[40:44] = channels_count.to_bytes(4, 'little')
+        header[44:48] = (len(coefficients) // channels_count).to_bytes(4, 'little')
+        blocks.append(bytes(header) + np.asarray(coefficients, dtype='<f8').tobytes())
+    return b''.join(blocks)
+
+
+def _receive_exactly(connection: socket.socket, size: int, stopping: threading.Event) -> Optional[bytes]:
+    """ the bytes, or `None` if the connection gets closed first """
+    data: bytearray = bytearray(size)
+    view: memoryview = memoryview(data)
+    received_count: int = 0
+    while received_count < size:
+        try:
+            piece_size: int = connection.recv_into(view[received_count:], size - received_count)
+        except socket.timeout:
+            if stopping.is_set():
+                return None
+            continue
+        except OSError:
+            return None
+        if not piece_size:
+            return None
+        received_count += piece_size
+    return bytes(data)
+
+
+class E502Simulator:
+    """
+    A TCP server that speaks the E-502 control protocol on `control_port` and streams the frames on `data_port`
+
+    The control requests are served from a register file and a flash image with the calibration in it.
+    The stream runs while both the data stream is started and the synchronous input is on,
+    at the frame rate the ADC frequency divider and the channels table give, paced by the clock, not by the reader.
+    The frames are either the float32 volts that `E502.get_data` expects, or, if `raw_words`,
+    the ADC words that `StreamDecoder` converts with the calibration.
+    The sends get delayed by up to `jitter` seconds, and, if `max_fragment_size` is set,
+    split into random pieces of at most as many bytes, to look like a real network.
+
+    Several simulators may run at once on the loopback addresses other than 127.0.0.1, as 127.0.0.2 and so on.
+    """
+
+    # how often the frames are sent, in seconds, and the most frames to catch up at once, in seconds of them
+    SEND_INTERVAL: Final[float] = 0.001
+    MAX_CATCH_UP: Final[float] = 0.05
+
+    def __init__(self, host: str = '127.0.0.1', control_port: int = CONTROL_PORT, data_port: int = DATA_PORT,
+                 raw_words: bool = False, jitter: float = 0.0, max_fragment_size: int = 0,
+                 signal_function: SignalFunction = default_signal, serial_number: str = 'SIM000001',
+                 verbose: bool = False) -> None:
+        self.host: Final[str] = host
+        self.raw_words: bool = raw_words
+        self.jitter: float = jitter
+        self.max_fragment_size: int = max_fragment_size
+        self.signal_function: SignalFunction = signal_function
+        self.verbose: bool = verbose
+
+        self.registers: Dict[int, int] = {
+            HARDWARE_REGISTER: int.from_bytes(b'\x13\x03\x0a\x01', 'little'),
+            LCH_CNT_REGISTER: 0,
+            ADC_FREQ_DIV_REGISTER: 0,
+        }
+        self.flash: bytearray = bytearray(b'\xff' * FLASH_SIZE)
+        rng: np.random.Generator = np.random.default_rng(sum(serial_number.encode()))
+        # a code offset and a scale close to one for every range
+        self.adc_coefficients: List[Tuple[float, float]] = [
+            (float(rng.uniform(-1000.0, 1000.0)), float(rng.uniform(0.999, 1.001)))
+            for _ in ChannelSettings.VOLTAGE_RANGE]
+        self.dac_coefficients: List[Tuple[float, float]] = [(0.0, 1.0), (0.0, 1.0)]
+        calibration: bytes = make_calibration_image(self.adc_coefficients, self.dac_coefficients)
+        self.flash[CALIBRATION_ADDRESS:CALIBRATION_ADDRESS + len(calibration)] = calibration
+        self.module_data: bytes = (b'E502'.ljust(32, b'\0') + serial_number.encode().ljust(32, b'\0')).ljust(192, b'\0')
+
+        # what has been streamed, for the benchmarks to compare with what has been received
+        self.frames_sent: int = 0
+        self.bytes_sent: int = 0
+        self.send_calls_count: int = 0
+        # the most frames the stream has been behind the clock, for the reader was slow
+        self.max_lag: int = 0
+
+        self._stream_started: bool = False
+        self._stopping: threading.Event = threading.Event()
+        self._state_changed: threading.Condition = threading.Condition()
+        self._data_connection: Optional[socket.socket] = None
+        self._listeners: List[socket.socket] = []
+        self._threads: List[threading.Thread] = []
+        self._ports: Tuple[int, int] = (control_port, data_port)
+
+    def __enter__(self) -> E502Simulator:
+        self.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.stop()
+
+    @property
+    def streaming(self) -> bool:
+        return self._stream_started and bool(self.registers.get(GO_SYNC_IO_REGISTER, 0))
+
+    @property
+    def settings(self) -> List[ChannelSettings]:
+        """ the logical channels table, the first channel first """
+        channels_count: int = self.registers.get(LCH_CNT_REGISTER, 0) + 1
+        return [ChannelSettings(self.registers.get(0x200 + 4 * (channels_count - channel - 1), 0))
+                for channel in range(channels_count)]
+
+    @property
+    def frame_rate(self) -> float:
+        return X502_REF_FREQ / (self.registers.get(ADC_FREQ_DIV_REGISTER, 0) + 1) / len(self.settings)
+
+    def start(self) -> None:
+        self._stopping.clear()
+        port: int
+        target: Callable[[socket.socket], None]
+        for port, target in zip(self._ports, (self._serve_control, self._serve_data)):
+            listener: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, port))
+            listener.listen()
+            # for the threads to notice the stop
+            listener.settimeout(0.1)
+            self._listeners.append(listener)
+            self._threads.append(threading.Thread(target=self._accept, args=(listener, target), daemon=True))
+        self._threads.append(threading.Thread(target=self._stream, daemon=True))
+        thread: threading.Thread
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        # for a send blocked by a slow reader to end
+        self._set_data_connection(None)
+        thread: threading.Thread
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        listener: socket.socket
+        for listener in self._listeners:
+            listener.close()
+        self._listeners.clear()
+
+    def _accept(self, listener: socket.socket, target: Callable[[socket.socket], None]) -> None:
+        while not self._stopping.is_set():
+            try:
+                connection: socket.socket = listener.accept()[0]
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            connection.settimeout(0.1)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            target(connection)
+
+    def _serve_control(self, connection: socket.socket) -> None:
+        threading.Thread(target=self._control_session, args=(connection,), daemon=True).start()
+
+    def _control_session(self, connection: socket.socket) -> None:
+        with connection:
+            while not self._stopping.is_set():
+                header: Optional[bytes] = _receive_exactly(connection, REQUEST_HEADER_SIZE, self._stopping)
+                if header is None or header[:4] != b'CTL1':
+                    return
+                command: int = int.from_bytes(header[4:8], 'little')
+                parameter: int = int.from_bytes(header[8:12], 'little')
+                payload_size: int = int.from_bytes(header[12:16], 'little')
+                response_size: int = int.from_bytes(header[16:20], 'little')
+                payload: Optional[bytes] = _receive_exactly(connection, payload_size, self._stopping)
+                if payload is None:
+                    return
+                error: int
+                response: bytes
+                error, response = self.handle_request(command, parameter, payload, response_size)
+                if self.verbose:
+                    print(f'command {command:#x}, parameter {parameter:#x}: error {error}, {len(response)} bytes')
+                try:
+                    connection.sendall(b''.join((b'CTL1', error.to_bytes(4, 'little', signed=True),
+                                                 len(response).to_bytes(4, 'little'), response)))
+                except OSError:
+                    return
+
+    def handle_request(self, command: int, parameter: int, payload: bytes, response_size: int) -> Tuple[int, bytes]:
+        """ the error code and the response to a control request """
+        if command == 0x10:  # read a register
+            return 0, (self.registers.get(parameter, 0) & 0xFFFFFFFF).to_bytes(4, 'little')
+        if command == 0x11:  # write a register
+            if len(payload) != 4:
+                return ERROR_INVALID_SIZE, b''
+            with self._state_changed:
+                self.registers[parameter] = int.from_bytes(payload, 'little')
+                self._state_changed.notify_all()
+            return 0, b''
+        if command in (0x12, 0x13):  # start or stop the data stream
+            if not parameter >> 16:  # the input one, for there is no output stream here
+                with self._state_changed:
+                    self._stream_started = command == 0x12
+                    self._state_changed.notify_all()
+            return 0, b''
+        if command == 0x15:  # whether the data stream is running
+            return 0, bytes([self._stream_started and not parameter >> 16])
+        if command == 0x17:  # read the flash memory
+            if not (0 <= parameter and parameter + response_size <= FLASH_SIZE):
+                return ERROR_INVALID_ADDRESS, b''
+            return 0, bytes(self.flash[parameter:parameter + response_size])
+        if command == 0x18:  # write the flash memory
+            if not (0 <= parameter and parameter + len(payload) <= FLASH_SIZE):
+                return ERROR_INVALID_ADDRESS, b''
+            self.flash[parameter:parameter + len(payload)] = payload
+            return 0, b''
+        if command == 0x23:  # reset the data connection
+            self._set_data_connection(None)
+            return 0, b''
+        if command == 0x80:  # read the module data
+            return 0, self.module_data[:response_size]
+        return ERROR_INVALID_COMMAND, b''
+
+    def _set_data_connection(self, connection: Optional[socket.socket]) -> None:
+        with self._state_changed:
+            if self._data_connection is not None:
+                try:
+                    self._data_connection.shutdown(socket.SHUT_RDWR)
+                except OSError:  # it's been closed by the client already
+                    pass
+                self._data_connection.close()
+            self._data_connection = connection
+            self._state_changed.notify_all()
+
+    def _serve_data(self, connection: socket.socket) -> None:
+        # a new data connection replaces the former one, as on the device
+        connection.settimeout(None)
+        self._set_data_connection(connection)
+
+    def encode(self, volts: np.ndarray, settings: Sequence[ChannelSettings]) -> bytes:
+        """ the bytes of the stream for the frames of volts """
+        if not self.raw_words:
+            return volts.astype(np.float32).tobytes()
+        offsets: np.ndarray = np.array([self.adc_coefficients[s.range][0] for s in settings])
+        scales: np.ndarray = np.array([self.adc_coefficients[s.range][1] * s.range_value() for s in settings])
+        codes: np.ndarray = np.clip(np.rint(volts * X502_ADC_SCALE_CODE_MAX / scales - offsets),
+                                    -(1 << 23), (1 << 23) - 1).astype(np.int64)
+        tags: np.ndarray = np.array([(s.mode << 4) | s.physical_channel for s in settings], dtype=np.int64)
+        words: np.ndarray = StreamDecoder.ADC_FLAG | (tags << StreamDecoder.TAG_SHIFT) | (codes & 0xFFFFFF)
+        return words.astype('<u4').tobytes()
+
+    def _send(self, connection: socket.socket, data: bytes) -> None:
+        if self.jitter > 0.0:
+            time.sleep(random.uniform(0.0, self.jitter))
+        view: memoryview = memoryview(data)
+        start: int = 0
+        while start < len(data):
+            end: int = (min(len(data), start + random.randint(1, self.max_fragment_size))
+                        if self.max_fragment_size > 0 else len(data))
+            connection.sendall(view[start:end])
+            self.send_calls_count += 1
+            start = end
+        self.bytes_sent += len(data)
+
+    def _stream(self) -> None:
+        start_time: float = 0.0
+        frame_rate: float = 1.0
+        settings: List[ChannelSettings] = []
+        streaming: bool = False
+        frames_count: int = 0  # since the stream start
+        connection: Optional[socket.socket]
+        while not self._stopping.is_set():
+            with self._state_changed:
+                if not self.streaming or self._data_connection is None:
+                    streaming = False
+                    self._state_changed.wait(0.1)
+                    continue
+                connection = self._data_connection
+                if not streaming:
+                    streaming = True
+                    settings = self.settings
+                    frame_rate = self.frame_rate
+                    start_time = time.monotonic()
+                    frames_count = 0
+            due_count: int = int((time.monotonic() - start_time) * frame_rate) - frames_count
+            self.max_lag = max(self.max_lag, due_count)
+            count: int = min(due_count, max(1, round(frame_rate * E502Simulator.MAX_CATCH_UP)))
+            if count <= 0:
+                time.sleep(min(E502Simulator.SEND_INTERVAL, (1 - due_count) / frame_rate))
+                continue
+            times: np.ndarray = (frames_count + np.arange(count)) / frame_rate
+            try:
+                self._send(connection, self.encode(self.signal_function(times, settings), settings))
+            except OSError:
+                with self._state_changed:
+                    if self._data_connection is connection:
+                        self._data_connection = None
+                continue
+            frames_count += count
+            self.frames_sent += count
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description='Emulate an E-502 on the local network')
+    parser.add_argument('--host', default='127.0.0.1', help='the address to listen on')
+    parser.add_argument('--raw-words', action='store_true', help='stream the ADC words instead of float32 volts')
+    parser.add_argument('--jitter', type=float, default=0.0, help='the longest delay of a send, in seconds')
+    parser.add_argument('--max-fragment-size', type=int, default=0, help='the longest piece of a send, in bytes')
+    parser.add_argument('--verbose', action='store_true', help='print the control requests')
+    args: argparse.Namespace = parser.parse_args()
+    simulator: E502Simulator = E502Simulator(args.host, raw_words=args.raw_words, jitter=args.jitter,
+                                             max_fragment_size=args.max_fragment_size, verbose=args.verbose)
+    with simulator:
+        print(f'E-502 simulator is listening on {args.host}; press Ctrl+C to stop')
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,29 +2,59 @@
 
 from __future__ import annotations
 
+import signal
+import time
+from collections import OrderedDict
 from multiprocessing import Process, Queue
 from pathlib import Path
-from typing import Iterable, Optional, TextIO, Tuple
+from queue import Empty
+from types import FrameType
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
 
 import numpy as np
 
-from stubs import Literal
+from metrics import Metrics, MetricsSnapshot, queue_depth
+from output_backends import FileWritingMode, OutputBackend, backend_for
+from ring_buffer import RingBufferReader, RingBufferSlice
 
-FileWritingMode = Literal['w', 'w+', '+w', 'wt', 'tw', 'wt+', 'w+t', '+wt', 'tw+', 't+w', '+tw',
-                          'a', 'a+', '+a', 'at', 'ta', 'at+', 'a+t', '+at', 'ta+', 't+a', '+ta',
-                          'x', 'x+', '+x', 'xt', 'tx', 'xt+', 'x+t', '+xt', 'tx+', 't+x', '+tx']
+__all__ = ['FileWriter', 'FileWritingMode', 'FileWritingRequest', 'segment_file_path']
+
+# the data to append to the file or the measurement parameters to store alongside;
+# a request with no path makes all the files get flushed and closed, for it marks the end of a measurement,
+# or of a segment of it, the files of which are complete
+FileWritingRequest = Tuple[Optional[Path], FileWritingMode, Union[np.ndarray, RingBufferSlice, Mapping[str, Any]]]
+
+
+def segment_file_path(path: Path, segment: int) -> Path:
+    """ the segments are numbered on from the index in the name of the first file, like the measurements are """
+    if not segment:
+        return path
+    prefix: str
+    index: str
+    prefix, _, index = path.stem.rpartition('_')
+    return path.with_name(f'{prefix}_{int(index) + segment:06g}{path.suffix}')
 
 
 class FileWriter(Process):
-    def __init__(self, requests_queue: Queue[Tuple[Optional[Path], FileWritingMode, np.ndarray]],
-                 auto_create_directories: bool = True):
+    def __init__(self, requests_queue: Queue[FileWritingRequest],
+                 auto_create_directories: bool = True,
+                 max_open_files: int = 64, idle_timeout: float = 5.0, buffer_size: int = 1 << 20,
+                 metrics_queue: Optional[Queue[MetricsSnapshot]] = None,
+                 **backend_options: Any):
         super(Process, self).__init__()
 
-        self.requests_queue: Queue[Tuple[Optional[Path], FileWritingMode, np.ndarray]] = requests_queue
+        self.requests_queue: Queue[FileWritingRequest] = requests_queue
         self.auto_create_directories: bool = auto_create_directories
+        self.max_open_files: int = max_open_files
+        self.idle_timeout: float = idle_timeout
+        self.backend_options: Dict[str, Any] = dict(backend_options, buffering=buffer_size)
+        self.metrics_queue: Optional[Queue[MetricsSnapshot]] = metrics_queue
 
         self._terminating: bool = False
 
+        # the files open for appending, the least recently used first, along with the time of their last use
+        self._backends: OrderedDict[Tuple[Path, FileWritingMode], Tuple[OutputBackend, float]] = OrderedDict()
+
     def terminate(self) -> None:
         self._terminating = True
         super().terminate()
@@ -33,21 +63,88 @@ class FileWriter(Process):
     def done(self) -> bool:
         return self.requests_queue.empty()
 
+    def _backend(self, file_path: Path, file_mode: FileWritingMode) -> OutputBackend:
+        backend: OutputBackend
+        key: Tuple[Path, FileWritingMode] = (file_path, file_mode)
+        if key in self._backends:
+            backend = self._backends.pop(key)[0]
+        else:
+            if self.auto_create_directories:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+            backend = backend_for(file_path)(file_path, file_mode, **self.backend_options)
+        self._backends[key] = backend, time.monotonic()
+        while len(self._backends) > self.max_open_files:
+            self._backends.popitem(last=False)[1][0].close()
+        return backend
+
+    def _close_backends(self, idle_timeout: Optional[float] = None) -> None:
+        """ close the files unused for `idle_timeout` seconds, or all of them """
+        now: float = time.monotonic()
+        key: Tuple[Path, FileWritingMode]
+        backend: OutputBackend
+        last_use_time: float
+        for key, (backend, last_use_time) in list(self._backends.items()):
+            if idle_timeout is None or now - last_use_time >= idle_timeout:
+                backend.close()
+                del self._backends[key]
+
     def run(self) -> None:
         file_path: Optional[Path]
         file_mode: FileWritingMode
-        x: np.ndarray
-        f_out: TextIO
+        x: Union[np.ndarray, RingBufferSlice, Mapping[str, Any], None]
+        backend: OutputBackend
+        ring_buffer_reader: RingBufferReader = RingBufferReader()
+        metrics: Metrics = Metrics('file_writer', self.metrics_queue)
+        received_time: float
+        write_start_time: float
 
-        while not self._terminating:
-            file_path, file_mode, x = self.requests_queue.get(block=True)
-            if file_path is None:
-                continue
-            if self.auto_create_directories:
-                file_path.parent.mkdir(parents=True, exist_ok=True)
-            with file_path.open(file_mode) as f_out:
-                f_out.writelines((('\t'.join(f'{xii}' for xii in xi)
-                                   if isinstance(xi, Iterable)
-                                   else f'{xi}'
-                                   ) + '\n')
-                                 for xi in x)
+        def on_terminate(_signal_number: int, _frame: Optional[FrameType]) -> None:
+            raise SystemExit
+
+        # let the buffered data be written when the process gets terminated
+        signal.signal(signal.SIGTERM, on_terminate)
+
+        try:
+            while not self._terminating:
+                metrics.set('backlog', queue_depth(self.requests_queue))
+                metrics.set('open_files', len(self._backends))
+                metrics.publish()
+                try:
+                    file_path, file_mode, x = self.requests_queue.get(
+                        block=True, timeout=(self.idle_timeout if self._backends
+                                             else metrics.interval if self.metrics_queue is not None else None))
+                except Empty:
+                    self._close_backends(self.idle_timeout)
+                    continue
+                metrics.count('requests')
+                if file_path is None:
+                    self._close_backends()
+                    continue
+                received_time = 0.0
+                if isinstance(x, RingBufferSlice):
+                    received_time = x.received_time
+                    lost_frames_count: int = x.count
+                    x = ring_buffer_reader.read(x)
+                    if x is None:  # the data has been overwritten already
+                        metrics.count('lost_frames', lost_frames_count)
+                        continue
+                write_start_time = time.monotonic()
+                backend = self._backend(file_path, file_mode)
+                if isinstance(x, Mapping):
+                    backend.write_header(x)
+                else:
+                    backend.write(x)
+                    metrics.count('written_bytes', x.nbytes)
+                metrics.observe('write_time', time.monotonic() - write_start_time)
+                if received_time:
+                    # from the socket to the file, though maybe not to the disk yet, for the files are buffered
+                    metrics.observe('latency', time.monotonic() - received_time)
+                if 'a' not in file_mode:
+                    # writing or creating the file anew by every request is what such a mode means
+                    self._backends.pop((file_path, file_mode))
+                    backend.close()
+                self._close_backends(self.idle_timeout)
+        finally:
+            self._close_backends()
+            ring_buffer_reader.close()
+            metrics.publish(force=True)
@@ -2,21 +2,37 @@
 
 from __future__ import annotations
 
-from datetime import date, timedelta
+import math
+import time
+from datetime import date, datetime, timedelta
 from multiprocessing import Queue
 from pathlib import Path
-from typing import List, Optional, Tuple, cast
+from typing import Any, Dict, List, Optional, Sequence, Tuple, cast
 
 import numpy as np
+import pyqtgraph as pg  # type: ignore
 
-from file_writer import FileWriter, FileWritingMode
+from e502 import adc_frame_rate
+from file_writer import FileWriter, FileWritingMode, FileWritingRequest
+from output_backends import backend_for
 from gui.channel_settings import ChannelSettings
 from gui.gui import GUI
-from gui.measurement import Measurement
+from mapped_recording import MappedRecording
+from measurement import MIN_RING_BUFFER_PORTIONS, Measurement
+from metrics import Metrics, MetricsLog, MetricsSnapshot, queue_depth
 from gui.pg_qt import *
+from history_buffer import HistoryBuffer
+from pipeline import FileTarget, PortionDispatcher
+from ring_buffer import RingBufferReader, RingBufferSlice, SharedRingBuffer
+from spectrum import SpectrumStage
+from stubs import Final
+from trigger import TriggerDetector, TriggerStage
 
 __all__ = ['App']
 
+# how many portions the shared memory holds for the consumers to catch up
+RING_BUFFER_PORTIONS: Final[int] = 64
+
 
 class App(GUI):
     def __init__(self) -> None:
@@ -25,28 +41,202 @@ class App(GUI):
         self.timer: QTimer = QTimer(self)
         self.timer.timeout.connect(self.on_timeout)
 
-        self.requests_queue: Queue[Tuple[Optional[Path], FileWritingMode, np.ndarray]] = Queue()
-        self.results_queue: Queue[np.ndarray] = Queue()
+        self.requests_queue: Queue[FileWritingRequest] = Queue()
+        self.metrics_queue: Queue[MetricsSnapshot] = Queue()
+        self.metrics: Metrics = Metrics('gui')
+        # there is no widget for it, for the log is for finding the bottlenecks rather than for every day
+        metrics_log_path: str = cast(str, self.settings.value('metrics/logPath', '', str))
+        self.metrics_log: Optional[MetricsLog] = MetricsLog(Path(metrics_log_path)) if metrics_log_path else None
+        self._metrics_time: float = time.monotonic()
+        self._timeout_time: Optional[float] = None
+        self.results_queue: Queue[RingBufferSlice] = Queue()
+        self.ring_buffer: Optional[SharedRingBuffer] = None
+        self.ring_buffer_reader: RingBufferReader = RingBufferReader()
         self.measurement: Optional[Measurement] = None
-        self.file_writer: FileWriter = FileWriter(self.requests_queue)
+        self.dispatcher: Optional[PortionDispatcher] = None
+        # there is no widget for it, for the full precision is what most users need
+        text_precision: int = cast(int, self.settings.value('parameters/textPrecision', -1, int))
+        hdf5_compression: str = cast(str, self.settings.value('parameters/hdf5Compression', '', str))
+        self.file_writer: FileWriter = FileWriter(self.requests_queue,
+                                                  precision=(text_precision if text_precision >= 0 else None),
+                                                  compression=(hdf5_compression or None),
+                                                  metrics_queue=self.metrics_queue)
         self.file_writer.start()
 
-        self._data: List[np.ndarray] = []
+        self.spectrum_portions_queue: Queue[RingBufferSlice] = Queue()
+        self.spectra_queue: Queue[Tuple[np.ndarray, np.ndarray]] = Queue()
+        self.spectrum_stage: Optional[SpectrumStage] = None
+
+        self.trigger_portions_queue: Queue[RingBufferSlice] = Queue()
+        self.pulses_queue: Queue[Tuple[int, np.ndarray, np.ndarray, np.ndarray]] = Queue()
+        self.trigger_stage: Optional[TriggerStage] = None
+
+        # the latest samples of every channel measured
+        self._data: List[HistoryBuffer] = []
         self._index_map: List[int] = []
         self._start_date: date = date.today()
         self._measurement_index: int = 1
+        # the part of a continuous measurement being received, which adds to the measurement index in the file names
+        self._segment: int = 0
+        self._spectrum_curves: List[pg.PlotDataItem] = []
+        self._pulse_curves: List[pg.PlotDataItem] = []
 
     def __del__(self) -> None:
+        self._stop_spectrum_stage()
+        self._stop_trigger_stage()
         self.file_writer.terminate()
         self.file_writer.join(1)
+        self.ring_buffer_reader.close()
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+        if self.metrics_log is not None:
+            self.metrics_log.close()
+
+    @property
+    def _recording_directly(self) -> bool:
+        """ whether the measurement process writes the file by itself """
+        return self.combo_file_format.currentData() == MappedRecording.SUFFIX
+
+    @property
+    def _keeping_pulses_only(self) -> bool:
+        """ whether the windows about the triggers are kept instead of all the data """
+        return (bool(self.combo_pulses.currentData())
+                and all(self.CHANNEL_NAMES.index(name) in self._index_map for name in ('Sync', 'Signal')))
+
+    @property
+    def _all_channels_in_file(self) -> bool:
+        return self._recording_directly or backend_for(Path(self.combo_file_format.currentData())).ALL_CHANNELS
+
+    def _saving_location(self, tab_index: Optional[int] = None) -> Path:
+        """ the file for the channel of the tab, or the file for all the channels if the format holds them all """
+        location: Path = (self.saving_location.path
+                          / str(self._start_date.year)
+                          / str(self._start_date.month)
+                          / str(self._start_date.day))
+        if not self._all_channels_in_file and tab_index is not None:
+            location /= self.CHANNEL_NAMES[tab_index]
+        return location / f'imp_{self._measurement_index + self._segment:06g}{self.combo_file_format.currentData()}'
+
+    def _file_header(self, tab_indices: Sequence[int]) -> Dict[str, Any]:
+        tab_index: int
+        header: Dict[str, Any] = {
+            'channels': [{
+                'name': self.CHANNEL_NAMES[tab_index],
+                'range': self.tabs[tab_index].range,
+                'range_value': self.tabs[tab_index].range_value(),
+                'physical_channel': self.tabs[tab_index].physical_channel,
+                'mode': self.tabs[tab_index].mode,
+                'averaging': self.tabs[tab_index].averaging,
+            } for tab_index in tab_indices],
+            # the frames per second of the data stored, after the divider and the decimation
+            'frame_rate': (adc_frame_rate(self.spin_frequency_divider.value(), len(self._index_map))
+                           / self.spin_decimation.value()),
+            'requested_sample_rate': self.spin_sample_rate.value(),
+            'adc_frequency_divider': self.spin_frequency_divider.value(),
+            'decimation': self.spin_decimation.value(),
+            # whether the volts have been calibrated here rather than by the device
+            'decode_stream': self.check_decode_stream.isChecked(),
+            'start_time': datetime.now().isoformat(),
+            'dtype': self.ring_buffer.dtype.str if self.ring_buffer is not None else None,
+        }
+        if self.measurement is not None:
+            # the measurement being started puts its own calibration into the recording
+            header.update(self.measurement.calibration)
+        if self.measurement is not None and self.measurement.continuous:
+            header['segment'] = self._segment
+            header['first_frame'] = self._segment * self.measurement.segment_size
+        return header
 
-    def _saving_location(self, channel: int) -> Path:
-        return (self.saving_location.path
-                / str(self._start_date.year)
-                / str(self._start_date.month)
-                / str(self._start_date.day)
-                / self.tabs[channel].title()
-                / f'imp_{self._measurement_index:06g}.csv')
+    def _file_targets(self) -> List[FileTarget]:
+        """ the files of the segment being received to save all the frames into """
+        if self._all_channels_in_file:
+            return [(self._saving_location(), None, self._file_header(self._index_map))]
+        return [(self._saving_location(i), ch, self._file_header([i])) for ch, i in enumerate(self._index_map)]
+
+    def _start_spectrum_stage(self, frame_rate: float) -> None:
+        file_path: Optional[Path] = None
+        if self.saving_location.path is not None:
+            file_path = self._saving_location()
+            if self._recording_directly:
+                file_path = file_path.with_suffix('.npy')
+            # the same name as the data file has, for the file writer to take it for the same measurement
+            file_path = file_path.parent / 'Spectrum' / file_path.name
+        # there are no widgets for the parameters, for the defaults suit most uses
+        self.spectrum_stage = SpectrumStage(
+            self.spectrum_portions_queue, self.spectra_queue,
+            sample_rate=frame_rate, channels_count=len(self._index_map),
+            segment_size=cast(int, self.settings.value('spectrum/segmentSize', 4096, int)),
+            overlap=cast(float, self.settings.value('spectrum/overlap', 0.5, float)),
+            window=cast(str, self.settings.value('spectrum/window', 'hann', str)),
+            publish_interval=cast(float, self.settings.value('spectrum/publishInterval', 1.0, float)),
+            file_requests_queue=self.requests_queue, file_path=file_path)
+        self.spectrum_stage.start()
+        self.spectrum_plot.clear()
+        self._spectrum_curves = [self.spectrum_plot.plot(name=self.CHANNEL_NAMES[i],
+                                                         pen=pg.intColor(index, hues=max(len(self._index_map), 2)))
+                                 for index, i in enumerate(self._index_map)]
+
+    def _stop_spectrum_stage(self) -> None:
+        if self.spectrum_stage is not None:
+            # the stage publishes the last spectrum and ends
+            self.spectrum_stage.terminate()
+            self.spectrum_stage.join(1)
+            self.spectrum_stage = None
+
+    def _start_trigger_stage(self, frame_rate: float) -> None:
+        sync_index: int = self.CHANNEL_NAMES.index('Sync')
+        signal_index: int = self.CHANNEL_NAMES.index('Signal')
+        file_path: Optional[Path] = None
+        if self.saving_location.path is not None:
+            file_path = self._saving_location()
+            # a window per row, which a file of the channels by the columns doesn't hold
+            if self._recording_directly or self._all_channels_in_file:
+                file_path = file_path.with_suffix('.npy')
+            file_path = file_path.parent / 'Pulses' / file_path.name
+        header: Dict[str, Any] = self._file_header(self._index_map)
+        channels: List[Dict[str, Any]] = header.pop('channels')
+        header['sync_channel'] = channels[self._index_map.index(sync_index)]
+        header['signal_channel'] = channels[self._index_map.index(signal_index)]
+        # there are no widgets for the parameters but the kind of the data kept, for they rarely change
+        self.settings.beginGroup('trigger')
+        pre: int = cast(int, self.settings.value('preTriggerSamples', 100, int))
+        post: int = cast(int, self.settings.value('postTriggerSamples', 1000, int))
+        mode: str = cast(str, self.settings.value('mode', 'edge', str))
+        holdoff: int = cast(int, self.settings.value('holdoffSamples', 0, int))
+        if mode == 'level':
+            # a pulse makes a window, not a window per sample of it
+            holdoff = max(holdoff, pre + post)
+        detector: TriggerDetector = TriggerDetector(
+            level=cast(float, self.settings.value('level', 1.0, float)),
+            hysteresis=cast(float, self.settings.value('hysteresis', 0.1, float)),
+            mode=mode,
+            slope=cast(str, self.settings.value('slope', 'rising', str)),
+            holdoff=holdoff)
+        snapshot_interval: float = cast(float, self.settings.value('snapshotInterval', 10.0, float))
+        self.settings.endGroup()
+        self.trigger_stage = TriggerStage(
+            self.trigger_portions_queue, self.pulses_queue,
+            sync_column=self._index_map.index(sync_index), signal_column=self._index_map.index(signal_index),
+            detector=detector, pre=pre, post=post,
+            average_only=(self.combo_pulses.currentData() == 'average'), snapshot_interval=snapshot_interval,
+            file_requests_queue=self.requests_queue, file_path=file_path, file_header=header)
+        self.trigger_stage.start()
+        self.pulse_plot.clear()
+        times: np.ndarray = np.arange(-pre, post) / frame_rate
+        self._pulse_curves = [self.pulse_plot.plot(times, np.full(times.shape, np.nan),
+                                                   name=name, pen=pg.intColor(index, hues=2))
+                              for index, name in enumerate((self.tr('Latest'), self.tr('Average')))]
+        # the average plus and minus the standard deviation
+        deviation_pen: pg.QtGui.QPen = pg.mkPen(pg.intColor(1, hues=2), style=Qt.PenStyle.DotLine)
+        self._pulse_curves += [self.pulse_plot.plot(times, np.full(times.shape, np.nan), name=name, pen=deviation_pen)
+                               for name in (self.tr('Standard deviation'), None)]
+
+    def _stop_trigger_stage(self) -> None:
+        if self.trigger_stage is not None:
+            # the stage stores the average pulse, if it's needed, and ends
+            self.trigger_stage.terminate()
+            self.trigger_stage.join(1)
+            self.trigger_stage = None
 
     def on_button_start_clicked(self) -> None:
         super(App, self).on_button_start_clicked()
@@ -61,16 +251,66 @@ class App(GUI):
         if date.today() != self._start_date:
             self._measurement_index = 1
         self._start_date = date.today()
-        while any(self._saving_location(i + 1).exists() for i in range(len(self.tabs))):
+        self._segment = 0
+        while any(self._saving_location(i).exists() for i in range(len(self.tabs))):
             self._measurement_index += 1
-        self._data = [np.empty(0) for _ in active_settings]
-        self.measurement = Measurement(self.results_queue,
+        # the rate of the frames after decimating them
+        frame_rate: float = (adc_frame_rate(self.spin_frequency_divider.value(), len(active_settings))
+                             / self.spin_decimation.value())
+        history_length: int = math.ceil(self.spin_history_length.value() * frame_rate)
+        self._data = [HistoryBuffer(max(1, history_length)) for _ in active_settings]
+        self.plot.reset([self.CHANNEL_NAMES[i] for i in self._index_map], frame_rate)
+
+        ring_buffer_capacity: int = self.spin_portion_size.value() * RING_BUFFER_PORTIONS
+        portion_latency_bounds: Tuple[float, float] = (
+            cast(float, self.settings.value('portionSize/minLatency', 0.01, float)),
+            cast(float, self.settings.value('portionSize/maxLatency', 0.5, float)))
+        if self.check_adaptive_portion_size.isChecked():
+            # room for the largest portions the latency allows
+            ring_buffer_capacity = max(ring_buffer_capacity,
+                                       math.ceil(portion_latency_bounds[1] * frame_rate) * MIN_RING_BUFFER_PORTIONS)
+        if (self.ring_buffer is None
+                or self.ring_buffer.channels_count != len(active_settings)
+                or self.ring_buffer.capacity < ring_buffer_capacity):
+            self.ring_buffer_reader.close()
+            if self.ring_buffer is not None:
+                self.ring_buffer.close()
+            self.ring_buffer = SharedRingBuffer(capacity=ring_buffer_capacity, channels_count=len(active_settings))
+
+        recording_path: Optional[Path] = None
+        if self.saving_location.path is not None and self._recording_directly and not self._keeping_pulses_only:
+            recording_path = self._saving_location()
+
+        self.measurement = Measurement(self.results_queue, self.ring_buffer.name,
                                        ip_address=self.text_ip_address.text,
                                        settings=active_settings,
                                        adc_frequency_divider=self.spin_frequency_divider.value(),
                                        data_portion_size=self.spin_portion_size.value(),
                                        digital_lines=self.digital_lines,
-                                       duration=timedelta(seconds=self.spin_duration.value()))
+                                       duration=timedelta(seconds=self.spin_duration.value()),
+                                       recording_path=recording_path,
+                                       recording_metadata=self._file_header(self._index_map),
+                                       continuous=self.check_continuous.isChecked(),
+                                       decode_stream=self.check_decode_stream.isChecked(),
+                                       decimation=self.spin_decimation.value(),
+                                       metrics_queue=self.metrics_queue,
+                                       adaptive_portion_size=self.check_adaptive_portion_size.isChecked(),
+                                       portion_latency_bounds=portion_latency_bounds)
+        if self.check_spectrum.isChecked():
+            self._start_spectrum_stage(frame_rate)
+        if self._keeping_pulses_only:
+            self._start_trigger_stage(frame_rate)
+        saving_all_data: bool = (self.saving_location.path is not None and not self._recording_directly
+                                 and not self._keeping_pulses_only)
+        self.dispatcher = PortionDispatcher(
+            self.ring_buffer_reader,
+            stages_queues=[queue for queue, stage in ((self.spectrum_portions_queue, self.spectrum_stage),
+                                                      (self.trigger_portions_queue, self.trigger_stage))
+                           if stage is not None],
+            file_requests_queue=self.requests_queue,
+            file_targets=(self._file_targets if saving_all_data else None))
+        self.status_panel.clear()
+        self._timeout_time = None
         self.measurement.start()
         self.timer.start(10)
 
@@ -79,23 +319,72 @@ class App(GUI):
         if self.measurement is not None:
             self.measurement.terminate()
             self.measurement.join(.1)
+        self._stop_spectrum_stage()
+        self._stop_trigger_stage()
+        # the files of the segments received are taken
+        self._measurement_index += self._segment
+        self._segment = 0
+        # let the files of the measurement get flushed and closed
+        self.requests_queue.put((None, cast(FileWritingMode, 'at'), np.empty(0)))
         super(App, self).on_button_stop_clicked()
 
+    def _update_metrics(self) -> None:
+        snapshot: MetricsSnapshot
+        while not self.metrics_queue.empty():
+            snapshot = self.metrics_queue.get()
+            self.status_panel.update_metrics(snapshot)
+            if self.metrics_log is not None:
+                self.metrics_log.write(snapshot)
+        if time.monotonic() - self._metrics_time < self.metrics.interval:
+            return
+        self._metrics_time = time.monotonic()
+        self.metrics.set('results_queue_depth', queue_depth(self.results_queue))
+        self.metrics.set('requests_queue_depth', queue_depth(self.requests_queue))
+        snapshot = self.metrics.snapshot()
+        self.status_panel.update_metrics(snapshot)
+        if self.metrics_log is not None:
+            self.metrics_log.write(snapshot)
+
     def on_timeout(self) -> None:
         ch: int
-        d: np.ndarray
+        if self._timeout_time is not None:
+            self.metrics.observe('timer_interval', time.monotonic() - self._timeout_time)
+        self._timeout_time = time.monotonic()
         while not self.results_queue.empty():
-            data: np.ndarray = self.results_queue.get()
-            for ch in range(data.shape[1]):
-                channel_data: np.ndarray = data[..., ch]
-                if not channel_data.size:
-                    continue
-                self._data[ch] = np.concatenate((self._data[ch], channel_data))
-                tab_index: int = self._index_map[ch]
-                if self.saving_location.path is not None:
-                    self.requests_queue.put((self._saving_location(self.tabs[tab_index].channel),
-                                             cast(FileWritingMode, 'at'),
-                                             channel_data))
+            portion: RingBufferSlice = self.results_queue.get()
+            if not portion.count or self.dispatcher is None:
+                continue
+            # the names of the files of a new segment are got from it
+            self._segment = portion.segment
+            data: Optional[np.ndarray] = self.dispatcher.dispatch(portion)
+            if data is not None:
+                for ch in range(len(self._index_map)):
+                    self._data[ch].append(data[..., ch])
+                    self.plot.append(ch, data[..., ch])
+                if portion.received_time:
+                    self.metrics.observe('display_latency', time.monotonic() - portion.received_time)
+            else:
+                self.metrics.count('lost_frames', portion.count)
+        frequencies: np.ndarray
+        spectrum: np.ndarray
+        while not self.spectra_queue.empty():
+            frequencies, spectrum = self.spectra_queue.get()
+            for ch, curve in enumerate(self._spectrum_curves):
+                # the zero frequency doesn't fit the logarithmic scale
+                curve.setData(frequencies[1:], spectrum[ch, 1:])
+        triggers_count: int
+        latest_pulse: np.ndarray
+        average_pulse: np.ndarray
+        pulse_deviation: np.ndarray
+        while not self.pulses_queue.empty():
+            triggers_count, latest_pulse, average_pulse, pulse_deviation = self.pulses_queue.get()
+            self.pulse_plot.getPlotItem().setTitle(self.tr('%n pulse(s)', '', triggers_count))
+            if self._pulse_curves:
+                for curve, pulse in zip(self._pulse_curves, (latest_pulse, average_pulse,
+                                                             average_pulse + pulse_deviation,
+                                                             average_pulse - pulse_deviation)):
+                    curve.setData(curve.xData, pulse)
+        self._update_metrics()
         if self.measurement is not None and not self.measurement.is_alive():
             self.on_button_stop_clicked()
             self.on_button_start_clicked()
@@ -13,7 +13,11 @@ from gui.channel_settings import ChannelSettings
 from gui.digital_lines import DigitalLines
 from gui.dir_path_entry import DirPathEntry
 from gui.ip_address_entry import IPAddressEntry
+from gui.live_plot import LivePlot
+from gui.status_panel import StatusPanel
 from gui.pg_qt import *
+from mapped_recording import MappedRecording
+from output_backends import BACKENDS
 from stubs import Final
 
 __all__ = ['GUI']
@@ -42,11 +46,20 @@ class GUI(QMainWindow):
         self.text_ip_address: IPAddressEntry = IPAddressEntry(self.parameters_box)
         self.spin_sample_rate: pg.SpinBox = pg.SpinBox(self.parameters_box)
         self.spin_duration: pg.SpinBox = pg.SpinBox(self.parameters_box)
+        self.check_continuous: QCheckBox = QCheckBox(self.parameters_box)
+        self.spin_history_length: pg.SpinBox = pg.SpinBox(self.parameters_box)
+        self.check_spectrum: QCheckBox = QCheckBox(self.parameters_box)
+        self.combo_pulses: QComboBox = QComboBox(self.parameters_box)
         self.spin_portion_size: QSpinBox = QSpinBox(self.parameters_box)
+        self.check_adaptive_portion_size: QCheckBox = QCheckBox(self.parameters_box)
+        self.check_decode_stream: QCheckBox = QCheckBox(self.parameters_box)
         self.spin_frequency_divider: QSpinBox = QSpinBox(self.parameters_box)
+        self.spin_decimation: QSpinBox = QSpinBox(self.parameters_box)
         self.digital_lines: DigitalLines = DigitalLines(parent=self.parameters_box)
+        self.status_panel: StatusPanel = StatusPanel(self.central_widget)
 
         self.saving_location: DirPathEntry = DirPathEntry('', self)
+        self.combo_file_format: QComboBox = QComboBox(self.parameters_box)
 
         self.tabs_container: QTabWidget = QTabWidget(self.central_widget)
         self.tabs: List[ChannelSettings] = [ChannelSettings(self.settings) for _ in range(len(GUI.CHANNEL_NAMES))]
@@ -54,6 +67,11 @@ class GUI(QMainWindow):
         self.button_start: QPushButton = QPushButton(self.central_widget)
         self.button_stop: QPushButton = QPushButton(self.central_widget)
 
+        self.plots_layout: QVBoxLayout = QVBoxLayout()
+        self.plot: LivePlot = LivePlot(self.central_widget)
+        self.spectrum_plot: pg.PlotWidget = pg.PlotWidget(self.central_widget)
+        self.pulse_plot: pg.PlotWidget = pg.PlotWidget(self.central_widget)
+
         self.setup_ui_appearance()
         self.load_settings()
         self.setup_actions()
@@ -82,13 +100,45 @@ class GUI(QMainWindow):
             'bounds': (1.0, np.inf)
         }
         self.spin_duration.setOpts(**opts)
+        opts['bounds'] = (0.1, np.inf)
+        self.spin_history_length.setOpts(**opts)
+
+        self.check_continuous.setText(self.tr('Measure continuously, split into files by the duration'))
+
+        self.check_spectrum.setText(self.tr('Compute power spectra'))
+
+        self.combo_pulses.addItem(self.tr('All the data'), '')
+        self.combo_pulses.addItem(self.tr('Pulses triggered by Sync'), 'windows')
+        self.combo_pulses.addItem(self.tr('Average pulse triggered by Sync'), 'average')
 
         self.spin_portion_size.setRange(1, 1_000_000)
+        self.check_adaptive_portion_size.setText(self.tr('Tune the portion size to the load'))
+        self.check_decode_stream.setText(self.tr('Receive the raw ADC words and calibrate them here'))
         self.spin_frequency_divider.setRange(1, X502_ADC_FREQ_DIV_MAX)
+        self.spin_decimation.setRange(1, 1_000_000)
+
+        self.combo_file_format.addItem(self.tr('Text (*.csv)'), '.csv')
+        self.combo_file_format.addItem(self.tr('Binary (*.bin)'), '.bin')
+        self.combo_file_format.addItem(self.tr('NumPy (*.npy)'), '.npy')
+        if '.h5' in BACKENDS:
+            self.combo_file_format.addItem(self.tr('HDF5 (*.h5)'), '.h5')
+        self.combo_file_format.addItem(self.tr('Memory-mapped (*.e502)'), MappedRecording.SUFFIX)
 
         self.main_layout.addWidget(self.scrollable_box)
+        self.main_layout.addLayout(self.plots_layout, 1)
+        self.plots_layout.addWidget(self.plot, 1)
+        self.plots_layout.addWidget(self.spectrum_plot, 1)
+        self.spectrum_plot.getPlotItem().setLabel('bottom', self.tr('Frequency'), 'Hz')
+        self.spectrum_plot.getPlotItem().setLogMode(y=True)
+        self.spectrum_plot.getPlotItem().showGrid(x=True, y=True)
+        self.spectrum_plot.getPlotItem().addLegend()
+        self.plots_layout.addWidget(self.pulse_plot, 1)
+        self.pulse_plot.getPlotItem().setLabel('bottom', self.tr('Time since trigger'), 's')
+        self.pulse_plot.getPlotItem().showGrid(x=True, y=True)
+        self.pulse_plot.getPlotItem().addLegend()
         self.controls_layout.addWidget(self.parameters_box)
         self.controls_layout.addWidget(self.digital_lines)
+        self.controls_layout.addWidget(self.status_panel)
         self.controls_layout.addStretch(1)
         self.controls_layout.addWidget(self.tabs_container)
         self.controls_layout.addLayout(self.buttons_layout)
@@ -108,9 +158,17 @@ class GUI(QMainWindow):
         self.parameters_layout.addRow(self.tr('IP address:'), self.text_ip_address)
         self.parameters_layout.addRow(self.tr('Sample rate:'), self.spin_sample_rate)
         self.parameters_layout.addRow(self.tr('Measurement duration:'), self.spin_duration)
+        self.parameters_layout.addRow('', self.check_continuous)
+        self.parameters_layout.addRow(self.tr('History length:'), self.spin_history_length)
+        self.parameters_layout.addRow('', self.check_spectrum)
+        self.parameters_layout.addRow(self.tr('Keep:'), self.combo_pulses)
         self.parameters_layout.addRow(self.tr('Portion size:'), self.spin_portion_size)
+        self.parameters_layout.addRow('', self.check_adaptive_portion_size)
+        self.parameters_layout.addRow('', self.check_decode_stream)
         self.parameters_layout.addRow(self.tr('Sync input frequency divider:'), self.spin_frequency_divider)
+        self.parameters_layout.addRow(self.tr('Decimation factor:'), self.spin_decimation)
         self.parameters_layout.addRow(self.tr('Data location:'), self.saving_location)
+        self.parameters_layout.addRow(self.tr('File format:'), self.combo_file_format)
 
         title: str
         t: ChannelSettings
@@ -131,6 +189,8 @@ class GUI(QMainWindow):
 
     def setup_actions(self) -> None:
         self.button_start.clicked.connect(self.on_button_start_clicked)
+        self.check_spectrum.toggled.connect(self.spectrum_plot.setVisible)
+        self.combo_pulses.currentIndexChanged.connect(self.on_combo_pulses_changed)
         self.button_stop.clicked.connect(self.on_button_stop_clicked)
 
         index: int
@@ -150,9 +210,21 @@ class GUI(QMainWindow):
         self.text_ip_address.text = cast(str, self.settings.value('ipAddress', '192.168.0.1', str))
         self.spin_sample_rate.setValue(cast(float, self.settings.value('sampleRate', 2e6, float)))
         self.spin_duration.setValue(cast(float, self.settings.value('measurementDuration', 60.0, float)))
+        self.check_continuous.setChecked(cast(bool, self.settings.value('continuousMeasurement', False, bool)))
+        self.spin_history_length.setValue(cast(float, self.settings.value('historyLength', 5.0, float)))
+        self.check_spectrum.setChecked(cast(bool, self.settings.value('computeSpectra', False, bool)))
+        self.spectrum_plot.setVisible(self.check_spectrum.isChecked())
+        self.combo_pulses.setCurrentIndex(max(0, self.combo_pulses.findData(
+            cast(str, self.settings.value('keptData', '', str)))))
+        self.pulse_plot.setVisible(bool(self.combo_pulses.currentData()))
         self.spin_portion_size.setValue(cast(int, self.settings.value('samplesPortionSize', 1000, int)))
+        self.check_adaptive_portion_size.setChecked(cast(bool, self.settings.value('adaptivePortionSize', False, bool)))
+        self.check_decode_stream.setChecked(cast(bool, self.settings.value('decodeStream', False, bool)))
         self.spin_frequency_divider.setValue(cast(int, self.settings.value('frequencyDivider', 1, int)))
+        self.spin_decimation.setValue(cast(int, self.settings.value('decimationFactor', 1, int)))
         self.saving_location.text.setText(cast(str, self.settings.value('savingLocation', str(Path.cwd()), str)))
+        self.combo_file_format.setCurrentIndex(max(0, self.combo_file_format.findData(
+            cast(str, self.settings.value('fileFormat', '.csv', str)))))
         self.settings.endGroup()
 
         i: int
@@ -169,9 +241,17 @@ class GUI(QMainWindow):
         self.settings.setValue('ipAddress', self.text_ip_address.text)
         self.settings.setValue('sampleRate', self.spin_sample_rate.value())
         self.settings.setValue('measurementDuration', self.spin_duration.value())
+        self.settings.setValue('continuousMeasurement', self.check_continuous.isChecked())
+        self.settings.setValue('historyLength', self.spin_history_length.value())
+        self.settings.setValue('computeSpectra', self.check_spectrum.isChecked())
+        self.settings.setValue('keptData', self.combo_pulses.currentData())
         self.settings.setValue('samplesPortionSize', self.spin_portion_size.value())
+        self.settings.setValue('adaptivePortionSize', self.check_adaptive_portion_size.isChecked())
+        self.settings.setValue('decodeStream', self.check_decode_stream.isChecked())
         self.settings.setValue('frequencyDivider', self.spin_frequency_divider.value())
+        self.settings.setValue('decimationFactor', self.spin_decimation.value())
         self.settings.setValue('savingLocation', str(self.saving_location.path))
+        self.settings.setValue('fileFormat', self.combo_file_format.currentData())
         self.settings.endGroup()
 
         self.settings.beginWriteArray('digitalLines', len(self.digital_lines))
@@ -202,6 +282,9 @@ class GUI(QMainWindow):
         self.tabs_container.setEnabled(True)
         self.button_start.setEnabled(True)
 
+    def on_combo_pulses_changed(self, _index: int) -> None:
+        self.pulse_plot.setVisible(bool(self.combo_pulses.currentData()))
+
     def on_tab_channel_changed(self, channel: int) -> None:
         index: int
         tab: ChannelSettings
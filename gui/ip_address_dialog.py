@@ -4,10 +4,10 @@ from __future__ import annotations
 
 from multiprocessing import Queue
 from queue import Empty
-from typing import Optional
+from typing import Dict, Optional, cast
 
 from gui.pg_qt import *
-from port_scanner import IPv4PortScanner
+from port_scanner import DiscoveredDevice, DiscoveryCache, IPv4PortScanner
 
 __all__ = ['IPAddressDialog']
 
@@ -30,8 +30,21 @@ class IPAddressDialog(QDialog):
         layout.addWidget(self.buttons)
         self.timer: QTimer = QTimer(self)
 
-        self.results_queue: Queue[str] = Queue()
-        self.scanner: IPv4PortScanner = IPv4PortScanner(self.results_queue)
+        self.results_queue: Queue[DiscoveredDevice] = Queue()
+        settings: QSettings = QSettings('config.ini', QSettings.Format.IniFormat, self)
+        cache: DiscoveryCache = DiscoveryCache(max_age=cast(float, settings.value('discovery/cacheMaxAge',
+                                                                                  24 * 3600., float)))
+        self.scanner: IPv4PortScanner = IPv4PortScanner(
+            self.results_queue,
+            # zero for as many as the open files limit allows
+            concurrency=cast(int, settings.value('discovery/concurrency', 0, int)) or None,
+            timeout=cast(float, settings.value('discovery/timeout', 1.0, float)),
+            cache=cache)
+        # the items by the addresses, for a device found anew to replace its cached item
+        self._items: Dict[str, QListWidgetItem] = {}
+        device: DiscoveredDevice
+        for device in cache.devices():
+            self._add_device(device, cached=True)
 
         self.timer.setInterval(100)
         self.timer.timeout.connect(self.on_timeout)
@@ -64,16 +77,26 @@ class IPAddressDialog(QDialog):
     def address(self) -> str:
         if self.list_addresses.currentItem() is None:
             return ''
-        return self.list_addresses.currentItem().text()
+        return cast(str, self.list_addresses.currentItem().data(Qt.ItemDataRole.UserRole))
+
+    def _add_device(self, device: DiscoveredDevice, cached: bool = False) -> None:
+        item: Optional[QListWidgetItem] = self._items.get(device.ip)
+        if item is None:
+            item = QListWidgetItem(self.list_addresses)
+            item.setData(Qt.ItemDataRole.UserRole, device.ip)
+            self._items[device.ip] = item
+        item.setText(self.tr('{0} (found before)').format(device) if cached else str(device))
+        item.setToolTip(self.tr('Serial number: {0}\nFirmware: {1}\nLatency: {2:.3g} ms').format(
+            device.serial_number, device.firmware_version, device.latency * 1e3))
 
     def on_timeout(self) -> None:
         while not self.results_queue.empty():
             try:
-                host: str = self.results_queue.get(block=True, timeout=0.01)
+                device: DiscoveredDevice = self.results_queue.get(block=True, timeout=0.01)
             except Empty:
                 pass  # wait more for data
             else:
-                self.list_addresses.addItem(host)
+                self._add_device(device)
 
     def on_current_item_changed(self, current: Optional[QListWidgetItem], previous: Optional[QListWidgetItem]) -> None:
         if current is not None and previous is None:
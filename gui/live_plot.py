@@ -0,0 +1,108 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyqtgraph as pg  # type: ignore
+
+from gui.pg_qt import *
+from min_max_pyramid import MinMaxPyramid
+from stubs import Final
+
+__all__ = ['LivePlot']
+
+
+class LivePlot(pg.PlotWidget):
+    """
+    The curves of the channels being measured, drawn from the min/max pyramids of them
+
+    The curves are redrawn no more often than `max_frame_rate` times a second, and only when the data or the view
+    has changed. A curve never has more points than the plot has pixels across, whatever the span shown.
+    While the view is at the latest data, it follows the data coming; panning or zooming stops following.
+    """
+
+    def __init__(self, parent: Optional[QWidget] = None, max_frame_rate: float = 30.0,
+                 follow_span: float = 10.0) -> None:
+        super(LivePlot, self).__init__(parent)
+        self.max_frame_rate: float = max_frame_rate
+        # the time span, in seconds, shown when following the data
+        self.follow_span: float = follow_span
+
+        self._pyramids: List[MinMaxPyramid] = []
+        self._curves: List[pg.PlotDataItem] = []
+        self._frame_rate: float = 1.0
+        self._following: bool = True
+        self._dirty: bool = False
+        self._last_redraw_time: float = 0.0
+        self._setting_range: bool = False
+
+        self.getPlotItem().setLabel('bottom', self.tr('Time'), 's')
+        self.getPlotItem().addLegend()
+        self.getPlotItem().showGrid(x=True, y=True)
+        # the time span is set here, and the values span follows the curves
+        self.getViewBox().enableAutoRange(x=False, y=True)
+        self.getPlotItem().sigXRangeChanged.connect(self.on_x_range_changed)
+
+        self._timer: Final[QTimer] = QTimer(self)
+        self._timer.timeout.connect(self.redraw)
+        self._timer.start(max(1, round(1000 / self.max_frame_rate)))
+
+    def reset(self, names: Sequence[str], frame_rate: float) -> None:
+        """ start anew with a curve for every channel named """
+        curve: pg.PlotDataItem
+        for curve in self._curves:
+            self.removeItem(curve)
+        self._frame_rate = frame_rate
+        self._pyramids = [MinMaxPyramid() for _ in names]
+        self._curves = [self.plot(name=name, pen=pg.intColor(index, hues=max(len(names), 2)))
+                        for index, name in enumerate(names)]
+        self._following = True
+        self._dirty = True
+
+    def append(self, channel: int, data: np.ndarray) -> None:
+        self._pyramids[channel].append(data)
+        self._dirty = True
+
+    def on_x_range_changed(self, *_args: object) -> None:
+        if self._setting_range:
+            return
+        if self._pyramids:
+            latest_time: float = self._pyramids[0].total_count / self._frame_rate
+            # the view that ends at the latest data keeps following it
+            self._following = self.getViewBox().viewRange()[0][1] >= latest_time
+        self._dirty = True
+
+    def _visible_samples(self) -> Tuple[int, int]:
+        x_range: Tuple[float, float] = self.getViewBox().viewRange()[0]
+        return int(np.floor(x_range[0] * self._frame_rate)), int(np.ceil(x_range[1] * self._frame_rate)) + 1
+
+    def redraw(self) -> None:
+        if not self._dirty or not self._pyramids or not self.isVisible():
+            return
+        if time.monotonic() - self._last_redraw_time < 1.0 / self.max_frame_rate:
+            return
+        self._dirty = False
+        self._last_redraw_time = time.monotonic()
+
+        if self._following:
+            latest_time: float = self._pyramids[0].total_count / self._frame_rate
+            self._setting_range = True
+            try:
+                self.getViewBox().setXRange(max(0.0, latest_time - self.follow_span), latest_time, padding=0.0)
+            finally:
+                self._setting_range = False
+
+        start: int
+        end: int
+        start, end = self._visible_samples()
+        width: float = max(1.0, self.getViewBox().width())
+        pyramid: MinMaxPyramid
+        curve: pg.PlotDataItem
+        for pyramid, curve in zip(self._pyramids, self._curves):
+            indices: np.ndarray
+            values: np.ndarray
+            indices, values = pyramid.envelope(start, end, round(width))
+            curve.setData(indices / self._frame_rate, values)
@@ -6,14 +6,14 @@ from pyqtgraph import Qt
 
 if Qt.QT_LIB == Qt.PYSIDE6:
     from PySide6.QtCore import QTimer, QSettings, Qt, Signal, QRect, QByteArray, QPoint, QModelIndex, \
-        QLocale, QLibraryInfo, QTranslator
+        QLocale, QLibraryInfo, QTranslator, QT_TRANSLATE_NOOP
     from PySide6.QtWidgets import QGroupBox, QHBoxLayout, QPushButton, QWidget, QFormLayout, QGroupBox, QSizePolicy, \
         QSpinBox, QLineEdit, QApplication, QLabel, QStyle, QFileDialog, QMainWindow, QVBoxLayout, QTabWidget, \
         QCheckBox, QComboBox, QToolButton, QDialog, QListWidget, QDialogButtonBox, QListWidgetItem, QScrollArea, QFrame
     from PySide6.QtGui import QColor, QCloseEvent, QValidator, QPalette, QPaintEvent
 elif Qt.QT_LIB == Qt.PYQT5:
     from PyQt5.QtCore import QTimer, QSettings, Qt, pyqtSignal as Signal, QRect, QByteArray, QPoint, QModelIndex, \
-        QLocale, QLibraryInfo, QTranslator
+        QLocale, QLibraryInfo, QTranslator, QT_TRANSLATE_NOOP
     from PyQt5.QtWidgets import QGroupBox, QHBoxLayout, QPushButton, QWidget, QFormLayout, QGroupBox, QSizePolicy, \
         QSpinBox, QLineEdit, QApplication, QLabel, QStyle, QFileDialog, QMainWindow, QVBoxLayout, QTabWidget, \
         QCheckBox, QComboBox, QToolButton, QDialog, QListWidget, QDialogButtonBox, QListWidgetItem, QScrollArea, QFrame
@@ -23,14 +23,14 @@ elif Qt.QT_LIB == Qt.PYQT5:
     QLibraryInfo.path = QLibraryInfo.location
 elif Qt.QT_LIB == Qt.PYQT6:
     from PyQt6.QtCore import QTimer, QSettings, Qt, pyqtSignal as Signal, QRect, QByteArray, QPoint, QModelIndex, \
-        QLocale, QLibraryInfo, QTranslator
+        QLocale, QLibraryInfo, QTranslator, QT_TRANSLATE_NOOP
     from PyQt6.QtWidgets import QGroupBox, QHBoxLayout, QPushButton, QWidget, QFormLayout, QGroupBox, QSizePolicy, \
         QSpinBox, QLineEdit, QApplication, QLabel, QStyle, QFileDialog, QMainWindow, QVBoxLayout, QTabWidget, \
         QCheckBox, QComboBox, QToolButton, QDialog, QListWidget, QDialogButtonBox, QListWidgetItem, QScrollArea, QFrame
     from PyQt6.QtGui import QCloseEvent, QColor, QPaintEvent, QPalette, QValidator
 elif Qt.QT_LIB == Qt.PYSIDE2:
     from PySide2.QtCore import QTimer, Qt, QSettings, Signal, QRect, QByteArray, QPoint, QModelIndex, \
-        QLocale, QLibraryInfo, QTranslator
+        QLocale, QLibraryInfo, QTranslator, QT_TRANSLATE_NOOP
     from PySide2.QtWidgets import QGroupBox, QHBoxLayout, QPushButton, QWidget, QFormLayout, QGroupBox, QSizePolicy, \
         QSpinBox, QLineEdit, QApplication, QLabel, QStyle, QFileDialog, QMainWindow, QVBoxLayout, QTabWidget, \
         QCheckBox, QComboBox, QToolButton, QDialog, QListWidget, QDialogButtonBox, QListWidgetItem, QScrollArea, QFrame
@@ -58,6 +58,7 @@ __all__ = [
     'QSettings',
     'QTimer',
     'QTranslator',
+    'QT_TRANSLATE_NOOP',
     'Signal',
 
     'QSizePolicy', 'QStyle',
@@ -0,0 +1,99 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from gui.pg_qt import *
+from metrics import MetricsSnapshot
+
+__all__ = ['StatusPanel']
+
+
+class StatusPanel(QGroupBox):
+    """ the throughput, the queues, and the latency of the stages of a measurement, by the latest metrics """
+
+    # the label, the source, the kind of the metric, and its name
+    ROWS: Tuple[Tuple[str, str, str, str], ...] = (
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Received:'), 'measurement', 'rate', 'received_bytes'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Receive calls:'), 'measurement', 'rate', 'receive_calls'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Portion size:'), 'measurement', 'gauge', 'portion_size'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Portion time:'), 'measurement', 'histogram', 'portion_time'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Results queue:'), 'gui', 'gauge', 'results_queue_depth'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Display latency:'), 'gui', 'histogram', 'display_latency'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Timer interval:'), 'gui', 'histogram', 'timer_interval'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Writer backlog:'), 'gui', 'gauge', 'requests_queue_depth'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Written:'), 'file_writer', 'rate', 'written_bytes'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Write latency:'), 'file_writer', 'histogram', 'latency'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Frames lost for display:'), 'gui', 'counter', 'lost_frames'),
+        (QT_TRANSLATE_NOOP('StatusPanel', 'Frames lost for files:'), 'file_writer', 'counter', 'lost_frames'),
+    )
+
+    def __init__(self, parent: Optional[QWidget] = None) -> None:
+        super(StatusPanel, self).__init__(parent)
+        self.setTitle(self.tr('Status'))
+        layout: QFormLayout = QFormLayout(self)
+        # by the source and the name of the metric
+        self._labels: Dict[Tuple[str, str], QLabel] = {}
+        self._snapshots: Dict[str, MetricsSnapshot] = {}
+        self._previous_snapshots: Dict[str, MetricsSnapshot] = {}
+        title: str
+        source: str
+        name: str
+        for title, source, _, name in StatusPanel.ROWS:
+            self._labels[source, name] = QLabel('—', self)
+            layout.addRow(self.tr(title), self._labels[source, name])
+
+    def clear(self) -> None:
+        self._snapshots.clear()
+        self._previous_snapshots.clear()
+        label: QLabel
+        for label in self._labels.values():
+            label.setText('—')
+
+    @staticmethod
+    def _format_seconds(value: Optional[float]) -> str:
+        if value is None:
+            return '—'
+        if value < 1.0:
+            return f'{value * 1e3:.3g} ms'
+        return f'{value:.3g} s'
+
+    def _rate(self, source: str, name: str) -> Optional[float]:
+        current: Optional[MetricsSnapshot] = self._snapshots.get(source)
+        previous: Optional[MetricsSnapshot] = self._previous_snapshots.get(source)
+        if current is None or previous is None or name not in current['counters']:
+            return None
+        duration: float = current['monotonic_time'] - previous['monotonic_time']
+        if duration <= 0.0:
+            return None
+        return (current['counters'][name] - previous['counters'].get(name, 0)) / duration
+
+    def update_metrics(self, snapshot: MetricsSnapshot) -> None:
+        """ take the latest snapshot of the metrics of a process into account """
+        source: str = snapshot['source']
+        if source in self._snapshots:
+            self._previous_snapshots[source] = self._snapshots[source]
+        self._snapshots[source] = snapshot
+
+        kind: str
+        name: str
+        for _, source, kind, name in StatusPanel.ROWS:
+            if source != snapshot['source']:
+                continue
+            text: str = '—'
+            if kind == 'rate':
+                rate: Optional[float] = self._rate(source, name)
+                if rate is not None:
+                    text = (self.tr('{0:.3g} MB/s').format(rate / 1e6) if name.endswith('bytes')
+                            else self.tr('{0:.0f} /s').format(rate))
+            elif kind == 'histogram':
+                summary: Optional[Mapping[str, Any]] = snapshot['histograms'].get(name)
+                if summary is not None and summary['count']:
+                    text = self.tr('{0} median, {1} at 99%').format(self._format_seconds(summary['p50']),
+                                                                     self._format_seconds(summary['p99']))
+            else:
+                value: Optional[float] = snapshot['gauges' if kind == 'gauge' else 'counters'].get(name)
+                if value is not None:
+                    text = f'{value:.0f}'
+            self._labels[source, name].setText(text)
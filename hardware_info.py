@@ -10,12 +10,14 @@ class HardwareInfo:
         self._plda_version: Optional[int] = None
         self._board_revision: Optional[int] = None
         self._fpga_version: Optional[Tuple[int, int]] = None
+        self._data: bytes = bytes()
         self.fill_from_bytes(data)
 
     def fill_from_bytes(self, data: bytes) -> None:
         if not isinstance(data, bytes):
             raise TypeError('The data should be bytes')
         if len(data) == 4:
+            self._data = data
             self._has_dac = bool(data[0] & 1)
             self._has_galvanic_decoupling = bool(data[0] & 2)
             self._has_black_fin = bool(data[0] & 4)
@@ -23,6 +25,7 @@ class HardwareInfo:
             self._board_revision = data[1] & 0x0f
             self._fpga_version = data[3], data[2]
         elif data:
+            self._data = bytes()
             self._has_dac = None
             self._has_galvanic_decoupling = None
             self._has_black_fin = None
@@ -48,6 +51,11 @@ class HardwareInfo:
             'XD'[bool(self._has_dac)]
         ))
 
+    @property
+    def data(self) -> bytes:
+        """ the register value the info has been filled from """
+        return self._data
+
     @property
     def has_dac(self) -> Optional[bool]:
         return self._has_dac
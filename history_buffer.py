@@ -0,0 +1,75 @@
+# coding: utf-8
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.typing import DTypeLike
+
+from stubs import Final
+
+__all__ = ['HistoryBuffer']
+
+
+class HistoryBuffer:
+    """
+    The last `capacity` samples appended, stored circularly
+
+    Every sample is written twice, `capacity` apart, so that the latest samples are always a contiguous part
+    of the storage, and getting them takes no copying.
+    """
+
+    def __init__(self, capacity: int, shape: Tuple[int, ...] = (), dtype: DTypeLike = np.float32) -> None:
+        if capacity <= 0:
+            raise ValueError('Invalid capacity', capacity)
+        self.capacity: Final[int] = capacity
+        self._storage: np.ndarray = np.empty((2 * capacity,) + tuple(shape), dtype=dtype)
+        # where the next sample goes, always less than the capacity
+        self._position: int = 0
+        self._size: int = 0
+        # how many samples have been appended ever
+        self.total_count: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._storage.dtype
+
+    def clear(self) -> None:
+        self._position = 0
+        self._size = 0
+        self.total_count = 0
+
+    def append(self, data: np.ndarray) -> None:
+        data = np.asarray(data)
+        count: int = data.shape[0]
+        self.total_count += count
+        if count > self.capacity:
+            data = data[-self.capacity:]
+            self._position = (self._position + count - self.capacity) % self.capacity
+            count = self.capacity
+        start: int = self._position
+        end: int = start + count
+        # the first copy goes to the lower half and wraps around, the second one goes to the upper half
+        if end <= self.capacity:
+            self._storage[start:end] = data
+            self._storage[start + self.capacity:end + self.capacity] = data
+        else:
+            split: int = self.capacity - start
+            self._storage[start:self.capacity] = data[:split]
+            self._storage[:end - self.capacity] = data[split:]
+            self._storage[start + self.capacity:] = data[:split]
+            self._storage[self.capacity:end] = data[split:]
+        self._position = end % self.capacity
+        self._size = min(self.capacity, self._size + count)
+
+    def last(self, count: Optional[int] = None) -> np.ndarray:
+        """ a read-only view of the latest `count` samples, or all of them, the oldest first """
+        if count is None or count > self._size:
+            count = self._size
+        end: int = self._position + self.capacity
+        view: np.ndarray = self._storage[end - count:end]
+        view.flags.writeable = False
+        return view
@@ -0,0 +1,140 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+import numpy as np
+from numpy.typing import DTypeLike
+
+from stubs import Final
+
+__all__ = ['MappedRecording']
+
+
+class MappedRecording:
+    """
+    A file preallocated for the frames of a whole measurement and mapped into memory
+
+    The frames are received right into the mapping via `reserve` and `commit`.
+    The count of the frames committed is stored in the header with a single aligned write after the frames get synced,
+    so a crash or a power loss leaves a file readable up to the last committed frame.
+    """
+
+    SUFFIX: Final[str] = '.e502'
+
+    MAGIC: Final[bytes] = b'E502REC1'
+    HEADER_DTYPE: Final[np.dtype] = np.dtype([
+        ('magic', 'S8'),
+        ('committed', '<u8'),
+        ('capacity', '<u8'),
+        ('data_offset', '<u8'),
+        ('channels_count', '<u4'),
+        ('metadata_size', '<u4'),
+        ('dtype', 'S8'),
+        ('sample_rate', '<f8'),
+    ])
+    # where the metadata JSON starts
+    METADATA_OFFSET: Final[int] = 64
+
+    def __init__(self, path: Path, capacity: int = 0, channels_count: int = 0, dtype: DTypeLike = np.float32,
+                 sample_rate: float = 0.0, metadata: Optional[Mapping[str, Any]] = None,
+                 writable: bool = True) -> None:
+        """ create a recording of `capacity` frames, or open the existing one if `capacity` is zero """
+        self.path: Final[Path] = path
+        self._writable: Final[bool] = writable
+        if capacity:
+            metadata_bytes: bytes = json.dumps(metadata or {}, default=str).encode()
+            data_offset: int = -(-(self.METADATA_OFFSET + len(metadata_bytes)) // mmap.PAGESIZE) * mmap.PAGESIZE
+            dtype = np.dtype(dtype).newbyteorder('<')
+            with path.open('w+b') as f:
+                f.truncate(data_offset + capacity * channels_count * dtype.itemsize)
+                f.seek(self.METADATA_OFFSET)
+                f.write(metadata_bytes)
+                f.seek(0)
+                f.write(np.array((self.MAGIC, 0, capacity, data_offset, channels_count, len(metadata_bytes),
+                                  dtype.str.encode(), sample_rate), dtype=self.HEADER_DTYPE).tobytes())
+
+        with path.open('r+b' if writable else 'rb') as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=(mmap.ACCESS_WRITE if writable
+                                                                     else mmap.ACCESS_READ))
+        header: np.void = np.frombuffer(self._mmap, dtype=self.HEADER_DTYPE, count=1)[0]
+        if header['magic'] != self.MAGIC:
+            del header
+            self._mmap.close()
+            raise ValueError('Not a recording', path)
+
+        self.capacity: Final[int] = int(header['capacity'])
+        self.channels_count: Final[int] = int(header['channels_count'])
+        self.dtype: Final[np.dtype] = np.dtype(header['dtype'].decode())
+        self.sample_rate: Final[float] = float(header['sample_rate'])
+        self._data_offset: Final[int] = int(header['data_offset'])
+        self._metadata_size: Final[int] = int(header['metadata_size'])
+        del header
+
+        # the count is a single aligned value for it to be updated at once
+        self._committed: np.ndarray = np.ndarray((), dtype='<u8', buffer=self._mmap,
+                                                 offset=self.HEADER_DTYPE.fields['committed'][1])
+        self._frames: np.ndarray = np.ndarray((self.capacity, self.channels_count), dtype=self.dtype,
+                                              buffer=self._mmap, offset=self._data_offset)
+        self._written: int = self.committed
+        self._synced: int = self.committed
+
+    def __del__(self) -> None:
+        self.close()
+
+    @property
+    def committed(self) -> int:
+        return int(self._committed)
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self._written
+
+    @property
+    def frames(self) -> np.ndarray:
+        """ the frames safely stored """
+        return self._frames[:self.committed]
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return json.loads(self._mmap[self.METADATA_OFFSET:self.METADATA_OFFSET + self._metadata_size])
+
+    def reserve(self, count: int) -> np.ndarray:
+        """ get the view to write the next `count` frames into """
+        if not (0 <= count <= self.free):
+            raise ValueError('Invalid frames count', count)
+        return self._frames[self._written:self._written + count]
+
+    def commit(self, count: int) -> None:
+        """ mark the frames written into the view got from `reserve` as ready to be stored """
+        if not (0 <= count <= self.free):
+            raise ValueError('Invalid frames count', count)
+        self._written += count
+
+    def sync(self) -> None:
+        """ write the frames onto the disk, and only then count them as committed """
+        if self._written == self._synced:
+            return
+        frame_size: int = self.channels_count * self.dtype.itemsize
+        start: int = (self._data_offset + self._synced * frame_size) // mmap.ALLOCATIONGRANULARITY \
+            * mmap.ALLOCATIONGRANULARITY
+        self._mmap.flush(start, self._data_offset + self._written * frame_size - start)
+        self._committed[()] = self._written
+        self._mmap.flush(0, mmap.PAGESIZE)
+        self._synced = self._written
+
+    def close(self) -> None:
+        if not hasattr(self, '_frames'):
+            return
+        if self._writable:
+            self.sync()
+        # the arrays refer to the mapping, and it can't be closed while they exist
+        del self._committed, self._frames
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # some views are still in use, e.g., by a traceback; the mapping gets closed along with them
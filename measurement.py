@@ -0,0 +1,330 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import asyncio
+import math
+import signal
+import time
+from datetime import timedelta, datetime
+from multiprocessing import Process, Queue
+from pathlib import Path
+from types import FrameType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Sequence, Optional, Tuple
+
+import numpy as np
+
+from channel_settings import ChannelSettings
+from decimator import Decimator
+from device_cache import DeviceCache
+try:
+    from e502_dummy import E502
+except (ImportError, ModuleNotFoundError):
+    from e502 import E502
+from e502 import adc_frame_rate
+from file_writer import segment_file_path
+from mapped_recording import MappedRecording
+from metrics import Metrics, MetricsSnapshot, queue_depth
+from multi_device import DeviceStatistics, MultiDeviceAcquisition
+from portion_sizer import PortionSizer
+from ring_buffer import RingBufferSlice, SharedRingBuffer
+from stubs import Final
+
+__all__ = ['MIN_RING_BUFFER_PORTIONS', 'Measurement', 'MultiDeviceMeasurement']
+
+# how often the recorded frames get written onto the disk, in seconds
+RECORDING_SYNC_INTERVAL: Final[float] = 1.0
+# the fewest portions the ring buffer holds when the portion size is tuned
+MIN_RING_BUFFER_PORTIONS: Final[int] = 8
+
+
+class Measurement(Process):
+    def __init__(self, results_queue: Queue[RingBufferSlice], ring_buffer_name: str,
+                 ip_address: str, settings: Sequence[ChannelSettings], adc_frequency_divider: int,
+                 data_portion_size: int, digital_lines: Iterable[bool],
+                 duration: Optional[timedelta] = None,
+                 recording_path: Optional[Path] = None,
+                 recording_metadata: Optional[Mapping[str, Any]] = None,
+                 decode_stream: bool = False,
+                 continuous: bool = False,
+                 decimation: int = 1,
+                 metrics_queue: Optional[Queue[MetricsSnapshot]] = None,
+                 adaptive_portion_size: bool = False,
+                 portion_latency_bounds: Tuple[float, float] = (0.01, 0.5),
+                 device_type: Callable[..., E502] = E502) -> None:
+        super(Measurement, self).__init__()
+        self.results_queue: Queue[RingBufferSlice] = results_queue
+        self.ring_buffer_name: str = ring_buffer_name
+
+        # a new measurement connects anew, but the calibration doesn't need to be read again
+        self.device: E502 = device_type(ip_address, cache=DeviceCache())
+        self.device.write_channels_settings_table(settings)
+        self.device.set_adc_frequency_divider(adc_frequency_divider)
+        # whether to receive the raw words and convert them into calibrated volts here
+        self.decode_stream: bool = decode_stream
+        # the calibration goes into the file headers, too, and it's cached, so it's read always
+        self.device.calibration_data()
+        self.calibration: Dict[str, List[float]] = self.device.adc_calibration
+
+        self.data_portion_size: int = data_portion_size
+        # when set, `data_portion_size` is only the initial size, and the sizes get tuned within the latency bounds
+        self.adaptive_portion_size: bool = adaptive_portion_size
+        self.portion_latency_bounds: Tuple[float, float] = portion_latency_bounds
+        self.digital_lines: List[bool] = list(digital_lines)
+
+        self.duration: Optional[timedelta] = duration
+        # when set, the stream never stops, and the duration is that of a segment, counted in frames
+        self.continuous: bool = continuous
+        if self.continuous and self.duration is None:
+            raise ValueError('The duration is required to split the measurement into segments')
+
+        # when set, the frames get filtered and thinned out before being stored or shown, so the frame rate is lower
+        self.decimator: Optional[Decimator] = Decimator(decimation, len(settings)) if decimation > 1 else None
+        self.frame_rate: float = adc_frame_rate(adc_frequency_divider, len(settings)) / max(1, decimation)
+        # the frames to receive at once when decimating
+        self._raw_frames: np.ndarray = np.empty((max(data_portion_size, decimation) if decimation > 1 else 0,
+                                                 len(settings)), dtype=np.float32)
+        self.segment_size: int = (max(1, round(self.duration.total_seconds() * self.frame_rate))
+                                  if self.duration is not None else 0)
+        # when set, the frames get received right into the file, and the queue only serves displaying them
+        self.recording_path: Optional[Path] = recording_path
+        self.recording_metadata: Optional[Mapping[str, Any]] = recording_metadata
+        if self.recording_path is not None and self.duration is None:
+            raise ValueError('The duration is required to allocate the recording')
+
+        self.metrics_queue: Optional[Queue[MetricsSnapshot]] = metrics_queue
+
+        self._terminating: bool = False
+
+    def terminate(self) -> None:
+        self._terminating = True
+
+        self.device.set_sync_io(False)
+        self.device.stop_data_stream()
+
+        super(Measurement, self).terminate()
+
+    def _receive(self, out: np.ndarray) -> None:
+        if self.decode_stream:
+            self.device.get_voltages(out.shape[0], out=out)
+        else:
+            self.device.get_data(out.shape[0], out=out)
+
+    def _receive_portion(self, ring_buffer: SharedRingBuffer, count: int) -> RingBufferSlice:
+        """ receive the data right into the shared memory """
+        view: np.ndarray
+        for view in ring_buffer.reserve(count):
+            self._receive(view)
+        return ring_buffer.commit()
+
+    def _record_portion(self, recording: MappedRecording, ring_buffer: SharedRingBuffer,
+                        count: int) -> RingBufferSlice:
+        """ receive the data right into the recording file, and share a copy for displaying """
+        count = min(count, recording.free)
+        view: np.ndarray = recording.reserve(count)
+        self._receive(view)
+        recording.commit(count)
+        return ring_buffer.write(view)
+
+    def _decimate_portion(self, recording: Optional[MappedRecording], ring_buffer: SharedRingBuffer,
+                          count: int) -> Optional[RingBufferSlice]:
+        """ receive as many frames as make `count` frames decimated, and store the latter """
+        if recording is not None:
+            count = min(count, recording.free)
+        raw_count: int = self.decimator.input_count(count)
+        if self._raw_frames.shape[0] < raw_count:
+            self._raw_frames = np.empty((raw_count, self._raw_frames.shape[1]), dtype=self._raw_frames.dtype)
+        raw_frames: np.ndarray = self._raw_frames[:raw_count]
+        self._receive(raw_frames)
+        frames: np.ndarray = self.decimator.decimate(raw_frames)
+        if not frames.shape[0]:
+            return None
+        if recording is not None:
+            recording.reserve(frames.shape[0])[...] = frames
+            recording.commit(frames.shape[0])
+        return ring_buffer.write(frames)
+
+    def _portion_sizer(self, ring_buffer: SharedRingBuffer) -> PortionSizer:
+        initial_size: int = self.data_portion_size
+        if self.decimator is not None:
+            initial_size = max(1, initial_size // self.decimator.factor)
+        return PortionSizer(self.frame_rate, *self.portion_latency_bounds, initial_size=initial_size,
+                            max_size=ring_buffer.capacity // MIN_RING_BUFFER_PORTIONS)
+
+    def _pending_frames_count(self, channels_count: int) -> Optional[int]:
+        """ how many frames, as decimated, wait in the socket """
+        pending_bytes_count: Optional[int] = self.device.pending_bytes_count()
+        if pending_bytes_count is None:
+            return None
+        # a sample takes 4 bytes, be it a raw word or a float
+        pending_frames_count: int = pending_bytes_count // (4 * channels_count)
+        if self.decimator is not None:
+            pending_frames_count //= self.decimator.factor
+        return pending_frames_count
+
+    def _open_recording(self, ring_buffer: SharedRingBuffer, segment: int = 0) -> MappedRecording:
+        path: Path = segment_file_path(self.recording_path, segment)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        capacity: int
+        metadata: Dict[str, Any] = dict(self.recording_metadata or {}, **self.calibration)
+        if self.continuous:
+            capacity = self.segment_size
+            metadata.update(segment=segment, first_frame=segment * self.segment_size)
+        else:
+            # a portion more for the device clock to be slightly faster than the system one
+            capacity = math.ceil(self.duration.total_seconds() * self.frame_rate) + self.data_portion_size
+        return MappedRecording(path, capacity=capacity,
+                               channels_count=ring_buffer.channels_count, dtype=ring_buffer.dtype,
+                               sample_rate=self.frame_rate, metadata=metadata)
+
+    def run(self) -> None:
+        def on_terminate(_signal_number: int, _frame: Optional[FrameType]) -> None:
+            raise SystemExit
+
+        # let the recording get synced when the process gets terminated
+        signal.signal(signal.SIGTERM, on_terminate)
+
+        i: int
+        on: bool
+        with self.device.batch():
+            for i, on in enumerate(self.digital_lines):
+                self.device.write_digital(i, on)
+
+        self.device.enable_in_stream(from_adc=True)
+        self.device.start_data_stream()
+        self.device.preload_adc()
+        self.device.set_sync_io(True)
+
+        ring_buffer: SharedRingBuffer = SharedRingBuffer(self.ring_buffer_name)
+        recording: Optional[MappedRecording] = None
+        if self.recording_path is not None:
+            recording = self._open_recording(ring_buffer)
+
+        start_time: datetime = datetime.now()
+        sync_time: float = time.monotonic()
+        segment: int = 0
+        segment_frames_count: int = 0
+        metrics: Metrics = Metrics('measurement', self.metrics_queue)
+        receive_start_time: float
+        portion_time: float
+        portion_sizer: Optional[PortionSizer] = (self._portion_sizer(ring_buffer) if self.adaptive_portion_size
+                                                 else None)
+
+        try:
+            while not self._terminating and (self.continuous or self.duration is None
+                                             or datetime.now() - start_time < self.duration):
+                count: int
+                if portion_sizer is not None:
+                    # the tuned size is that of the frames stored
+                    count = portion_sizer.size
+                else:
+                    count = self.data_portion_size
+                    if self.decimator is not None:
+                        # the portion size is that of the frames received
+                        count = max(1, count // self.decimator.factor)
+                if self.continuous:
+                    # a portion never spans two segments, so they are split exactly
+                    count = min(count, self.segment_size - segment_frames_count)
+                portion: Optional[RingBufferSlice]
+                if recording is not None and not recording.free:
+                    break
+                receive_start_time = time.monotonic()
+                if self.decimator is not None:
+                    portion = self._decimate_portion(recording, ring_buffer, count)
+                    if portion is None:
+                        continue
+                elif recording is None:
+                    portion = self._receive_portion(ring_buffer, count)
+                else:
+                    portion = self._record_portion(recording, ring_buffer, count)
+                if recording is not None and time.monotonic() - sync_time >= RECORDING_SYNC_INTERVAL:
+                    recording.sync()
+                    sync_time = time.monotonic()
+                portion_time = time.monotonic() - receive_start_time
+                self.results_queue.put(portion._replace(segment=segment, received_time=time.monotonic()))
+                if portion_sizer is not None:
+                    portion_sizer.update(portion.count, portion_time,
+                                         pending_frames=self._pending_frames_count(ring_buffer.channels_count),
+                                         backlog=queue_depth(self.results_queue))
+
+                metrics.observe('portion_time', portion_time)
+                metrics.set('portion_size', count)
+                metrics.count('portions')
+                metrics.count('frames', portion.count)
+                metrics.counters['received_bytes'] = self.device.received_bytes_count
+                metrics.counters['receive_calls'] = self.device.receive_calls_count
+                metrics.set('results_queue_depth', queue_depth(self.results_queue))
+                metrics.publish()
+
+                if self.continuous:
+                    segment_frames_count += portion.count
+                    if segment_frames_count >= self.segment_size:
+                        segment += 1
+                        segment_frames_count = 0
+                        if recording is not None:
+                            recording.close()
+                            recording = self._open_recording(ring_buffer, segment)
+                            sync_time = time.monotonic()
+        finally:
+            if recording is not None:
+                recording.close()
+            ring_buffer.close()
+            metrics.publish(force=True)
+
+
+class MultiDeviceMeasurement(Process):
+    """ a measurement from several devices at once, the frames of all of them merged into one ring buffer """
+
+    def __init__(self, results_queue: Queue[RingBufferSlice], ring_buffer_name: str,
+                 devices: Sequence[Tuple[str, Sequence[ChannelSettings]]], frame_rate: float,
+                 data_portion_size: int, digital_lines: Iterable[bool],
+                 duration: Optional[timedelta] = None,
+                 statistics_queue: Optional[Queue[List[DeviceStatistics]]] = None,
+                 statistics_interval: float = 1.0) -> None:
+        super(MultiDeviceMeasurement, self).__init__()
+        self.results_queue: Queue[RingBufferSlice] = results_queue
+        self.ring_buffer_name: str = ring_buffer_name
+        self.statistics_queue: Optional[Queue[List[DeviceStatistics]]] = statistics_queue
+        self.statistics_interval: float = statistics_interval
+
+        # the devices get connected to in the process that reads them
+        self.devices: List[Tuple[str, List[ChannelSettings]]] = [(ip, list(settings)) for ip, settings in devices]
+        self.frame_rate: float = frame_rate
+        self.data_portion_size: int = data_portion_size
+        self.digital_lines: List[bool] = list(digital_lines)
+
+        self.duration: Optional[timedelta] = duration
+
+    async def _acquire(self, ring_buffer: SharedRingBuffer) -> None:
+        acquisition: MultiDeviceAcquisition = MultiDeviceAcquisition(self.devices, self.frame_rate,
+                                                                     self.data_portion_size)
+        if acquisition.channels_count != ring_buffer.channels_count:
+            raise ValueError('The ring buffer does not fit the channels', ring_buffer.channels_count)
+        await acquisition.start(self.digital_lines)
+        start_time: datetime = datetime.now()
+        statistics_time: float = time.monotonic()
+        try:
+            portion: np.ndarray
+            async for portion in acquisition.portions():
+                self.results_queue.put(ring_buffer.write(portion)._replace(received_time=time.monotonic()))
+                if self.statistics_queue is not None and time.monotonic() - statistics_time >= self.statistics_interval:
+                    self.statistics_queue.put(acquisition.statistics())
+                    statistics_time = time.monotonic()
+                if self.duration is not None and datetime.now() - start_time >= self.duration:
+                    break
+        finally:
+            await acquisition.stop()
+
+    def run(self) -> None:
+        ring_buffer: SharedRingBuffer = SharedRingBuffer(self.ring_buffer_name)
+        loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        task: asyncio.Task = loop.create_task(self._acquire(ring_buffer))
+        # let the devices get stopped when the process gets terminated
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+            ring_buffer.close()
@@ -0,0 +1,203 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import csv
+import json
+import sys
+import time
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, TextIO, Union
+
+import numpy as np
+
+from stubs import Final
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__all__ = ['Histogram', 'Metrics', 'MetricsLog', 'MetricsSnapshot', 'max_rss', 'queue_depth']
+
+# the name of the process, the time of the snapshot, the counters, the gauges, and the summaries of the histograms
+MetricsSnapshot = Dict[str, Any]
+
+
+def queue_depth(queue: Queue) -> Optional[int]:
+    """ the approximate count of the items in the queue, if the platform tells it """
+    try:
+        return queue.qsize()
+    except NotImplementedError:  # macOS
+        return None
+
+
+def max_rss() -> Optional[int]:
+    """ the peak resident memory of the process, in bytes, if the platform tells it """
+    if resource is None:
+        return None
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS tells it in bytes, and the other systems do in kibibytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Histogram:
+    """
+    The counts of the values that fall into logarithmically spaced buckets from `low` to `high`
+
+    The memory doesn't grow with the values added, and the quantiles are accurate to the bucket width,
+    about 26% for 10 buckets a decade.
+    """
+
+    QUANTILES: Final[Dict[str, float]] = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+    def __init__(self, low: float = 1e-6, high: float = 1e3, buckets_per_decade: int = 10) -> None:
+        if not (0.0 < low < high) or buckets_per_decade < 1:
+            raise ValueError('Invalid histogram buckets', low, high, buckets_per_decade)
+        self.edges: Final[np.ndarray] = np.logspace(np.log10(low), np.log10(high),
+                                                     round(np.log10(high / low) * buckets_per_decade) + 1)
+        # the values below the lowest edge, between the edges, and above the highest one
+        self.counts: Final[np.ndarray] = np.zeros(self.edges.size + 1, dtype=np.int64)
+        self.total: float = 0.0
+        self.max: Optional[float] = None
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def clear(self) -> None:
+        self.counts[...] = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, values: Union[float, np.ndarray]) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not values.size:
+            return
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side='right'), minlength=self.counts.size)
+        self.total += float(values.sum())
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def quantile(self, q: float) -> Optional[float]:
+        """ the upper edge of the bucket the quantile is in, or the maximum if it's less """
+        if self.max is None:
+            return None
+        bucket: int = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        if bucket >= self.edges.size:
+            return self.max
+        return min(float(self.edges[bucket]), self.max)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """ the statistics of the values, `None` for those undefined, for the summary to be valid JSON """
+        count: int = self.count
+        summary: Dict[str, Optional[float]] = {'count': count, 'mean': self.total / count if count else None}
+        name: str
+        q: float
+        for name, q in Histogram.QUANTILES.items():
+            summary[name] = self.quantile(q)
+        summary['max'] = self.max
+        return summary
+
+
+class Metrics:
+    """
+    The counters, the gauges, and the histograms of a process
+
+    The counters only grow, so the rates are the differences of two snapshots of them,
+    and a lost snapshot loses nothing. The gauges are the latest values measured.
+    The snapshots are plain dictionaries to pass to another process via `queue`.
+    """
+
+    def __init__(self, source: str, queue: Optional[Queue[MetricsSnapshot]] = None, interval: float = 1.0) -> None:
+        self.source: Final[str] = source
+        self.queue: Optional[Queue[MetricsSnapshot]] = queue
+        self.interval: float = interval
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, Optional[float]] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._publish_time: float = time.monotonic()
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: Optional[float]) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, values: Union[float, np.ndarray]) -> None:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].add(values)
+
+    def snapshot(self) -> MetricsSnapshot:
+        return {
+            'source': self.source,
+            'time': time.time(),
+            'monotonic_time': time.monotonic(),
+            'process_time': time.process_time(),
+            'max_rss': max_rss(),
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {name: histogram.summary() for name, histogram in self.histograms.items()},
+        }
+
+    def publish(self, force: bool = False) -> None:
+        """ put a snapshot into the queue if it's time to """
+        if self.queue is None:
+            return
+        if force or time.monotonic() - self._publish_time >= self.interval:
+            self._publish_time = time.monotonic()
+            self.queue.put(self.snapshot())
+
+
+class MetricsLog:
+    """
+    Append the snapshots of the metrics to a file, as JSON lines or, if the file name ends with `.csv`, as CSV
+
+    A CSV row is a single value: the time, the source, the metric name, and the value,
+    for the set of the metrics to be free to change.
+    """
+
+    CSV_COLUMNS: Final[tuple] = ('time', 'source', 'metric', 'value')
+
+    def __init__(self, path: Path) -> None:
+        self.path: Final[Path] = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._csv: Final[bool] = path.suffix.casefold() == '.csv'
+        new_file: bool = not path.exists() or not path.stat().st_size
+        self._file: TextIO = path.open('at', newline=('' if self._csv else None), encoding='utf-8')
+        self._writer: Optional[Any] = csv.writer(self._file) if self._csv else None
+        if self._writer is not None and new_file:
+            self._writer.writerow(MetricsLog.CSV_COLUMNS)
+
+    def __enter__(self) -> MetricsLog:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def flatten(snapshot: Mapping[str, Any]) -> Dict[str, Any]:
+        """ the metrics of the snapshot by their dotted names """
+        values: Dict[str, Any] = {name: snapshot[name] for name in ('process_time', 'max_rss') if name in snapshot}
+        kind: str
+        name: str
+        value: Any
+        for kind in ('counters', 'gauges'):
+            values.update(snapshot.get(kind, {}))
+        for name, value in snapshot.get('histograms', {}).items():
+            values.update({f'{name}.{statistic}': v for statistic, v in value.items()})
+        return values
+
+    def write(self, snapshot: Mapping[str, Any]) -> None:
+        if self._writer is None:
+            self._file.write(json.dumps(snapshot) + '\n')
+        else:
+            name: str
+            value: Any
+            for name, value in MetricsLog.flatten(snapshot).items():
+                self._writer.writerow((snapshot.get('time'), snapshot.get('source'), name, value))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,109 @@
+# coding: utf-8
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+from history_buffer import HistoryBuffer
+from stubs import Final
+
+__all__ = ['MinMaxPyramid']
+
+
+class MinMaxPyramid:
+    """
+    The minimums and the maximums of the samples over blocks of several sizes, built as the samples arrive
+
+    A block of a level spans `factor` blocks of the level below, and the lowest level blocks span `block_size` samples.
+    Every level keeps its latest `capacity` blocks, so the coarse levels reach much further back in time
+    than the fine ones, and the latest `raw_capacity` samples are kept as they are for the closest look.
+    """
+
+    def __init__(self, block_size: int = 64, factor: int = 4, levels_count: int = 8,
+                 capacity: int = 1 << 16, raw_capacity: int = 1 << 18) -> None:
+        if block_size < 2 or factor < 2 or levels_count < 1:
+            raise ValueError('Invalid pyramid shape', block_size, factor, levels_count)
+        self.block_size: Final[int] = block_size
+        self.factor: Final[int] = factor
+        self.raw: Final[HistoryBuffer] = HistoryBuffer(raw_capacity)
+        self.levels: Final[List[HistoryBuffer]] = [HistoryBuffer(capacity, shape=(2,)) for _ in range(levels_count)]
+        # the samples and the blocks that don't make a whole block of the level above yet
+        self._pending_samples: np.ndarray = np.empty(0, dtype=np.float32)
+        self._pending_blocks: List[np.ndarray] = [np.empty((0, 2), dtype=np.float32) for _ in range(levels_count)]
+
+    @property
+    def total_count(self) -> int:
+        """ how many samples have been appended ever """
+        return self.raw.total_count
+
+    def clear(self) -> None:
+        self.raw.clear()
+        level: HistoryBuffer
+        for level in self.levels:
+            level.clear()
+        self._pending_samples = np.empty(0, dtype=np.float32)
+        self._pending_blocks = [np.empty((0, 2), dtype=np.float32) for _ in self.levels]
+
+    def level_block_size(self, level: int) -> int:
+        return self.block_size * self.factor ** level
+
+    def append(self, data: np.ndarray) -> None:
+        data = np.asarray(data, dtype=np.float32).ravel()
+        self.raw.append(data)
+        if self._pending_samples.size:
+            data = np.concatenate((self._pending_samples, data))
+        blocks_count: int = data.size // self.block_size
+        self._pending_samples = data[blocks_count * self.block_size:].copy()
+        blocks: np.ndarray = data[:blocks_count * self.block_size].reshape((blocks_count, self.block_size))
+        extremes: np.ndarray = np.stack((blocks.min(axis=1), blocks.max(axis=1)), axis=1)
+
+        level: int
+        for level in range(len(self.levels)):
+            if not extremes.shape[0]:
+                break
+            self.levels[level].append(extremes)
+            if level + 1 == len(self.levels):
+                break
+            if self._pending_blocks[level].shape[0]:
+                extremes = np.concatenate((self._pending_blocks[level], extremes))
+            blocks_count = extremes.shape[0] // self.factor
+            self._pending_blocks[level] = extremes[blocks_count * self.factor:].copy()
+            grouped: np.ndarray = extremes[:blocks_count * self.factor].reshape((blocks_count, self.factor, 2))
+            extremes = np.stack((grouped[..., 0].min(axis=1), grouped[..., 1].max(axis=1)), axis=1)
+
+    def envelope(self, start: int, end: int, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        get the sample indices and the values of a curve that looks the same as the samples from `start` to `end`
+        drawn on `max_points` pixels
+
+        The curve goes through the minimum and the maximum of every block of the level that fits the span the best,
+        or through the samples themselves if there are few enough.
+        """
+        start = max(start, 0)
+        end = min(end, self.total_count)
+        if end <= start or max_points <= 0:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+
+        samples_per_point: float = (end - start) / max_points
+        if samples_per_point < self.block_size and self.total_count - start <= len(self.raw):
+            values: np.ndarray = self.raw.last(self.total_count - start)[:end - start]
+            return np.arange(start, start + values.size), values
+
+        # the finest level with at most two blocks per point that still reaches back to the start
+        level: int
+        block_size: int
+        blocks: HistoryBuffer
+        for level in range(len(self.levels)):
+            block_size = self.level_block_size(level)
+            blocks = self.levels[level]
+            if 2 * block_size >= samples_per_point and (blocks.total_count - len(blocks)) * block_size <= start:
+                break
+        first_block: int = max(start // block_size, blocks.total_count - len(blocks))
+        last_block: int = min(-(-end // block_size), blocks.total_count)
+        if last_block <= first_block:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+        extremes: np.ndarray = blocks.last(blocks.total_count - first_block)[:last_block - first_block]
+        # a vertical stroke from the minimum to the maximum in the middle of every block
+        indices: np.ndarray = np.repeat((np.arange(first_block, last_block) + 0.5) * block_size, 2)
+        return indices, extremes.ravel()
@@ -0,0 +1,239 @@
+# coding: utf-8
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from channel_settings import ChannelSettings
+from e502 import X502_ADC_FREQ_DIV_MAX, X502_REF_FREQ, adc_frame_rate
+from e502_async import AsyncE502
+from stubs import Final
+
+__all__ = ['DeviceStatistics', 'MultiDeviceAcquisition', 'frequency_dividers']
+
+
+def frequency_dividers(frame_rate: float, channels_counts: Sequence[int]) -> List[int]:
+    """
+    the ADC frequency dividers for the devices of `channels_counts` channels to have the same frame rate,
+    the nearest to `frame_rate` there is
+
+    A frame takes the divider times the channels count periods of the reference frequency,
+    so the periods of a frame common to all the devices are a multiple of every channels count.
+    """
+    if frame_rate <= 0.0:
+        raise ValueError('Invalid frame rate', frame_rate)
+    if not channels_counts or min(channels_counts) <= 0:
+        raise ValueError('Invalid channels counts', channels_counts)
+    step: int = 1
+    channels_count: int
+    for channels_count in channels_counts:
+        step = step * channels_count // math.gcd(step, channels_count)
+    # the longest frame that no divider exceeds the limit for
+    max_frame_period: int = X502_ADC_FREQ_DIV_MAX * min(channels_counts) // step * step
+    if max_frame_period < step:
+        raise ValueError('No frame rate is possible for all the devices at once', channels_counts)
+    frame_period: int = min(max(step, round(X502_REF_FREQ / frame_rate / step) * step), max_frame_period)
+    return [frame_period // channels_count for channels_count in channels_counts]
+
+
+class DeviceStatistics(NamedTuple):
+    ip: str
+    frames_count: int
+    # frames per second, as received
+    throughput: float
+    # how many frames the device is behind the one that has sent the most
+    lag: int
+    # how much faster the clock of the device is than the one of the first device, in parts per million
+    drift: float
+
+
+class _DeviceStream:
+    def __init__(self, ip: str, settings: Sequence[ChannelSettings], adc_frequency_divider: int,
+                 data_portion_size: int, max_pending_portions: int) -> None:
+        self.device: Final[AsyncE502] = AsyncE502(ip)
+        self.settings: Final[List[ChannelSettings]] = list(settings)
+        self.adc_frequency_divider: Final[int] = adc_frequency_divider
+        self.portions: Deque[np.ndarray] = deque()
+        # the portions get received into these in turn, for no more of them than there are wait to be merged
+        self._buffers: Final[np.ndarray] = np.empty((max_pending_portions, data_portion_size, len(settings)),
+                                                    dtype=np.float32)
+        self._next_buffer: int = 0
+        self.frames_count: int = 0
+        # when the first and the last portions have arrived
+        self.first_time: Optional[float] = None
+        self.first_frames_count: int = 0
+        self.last_time: Optional[float] = None
+
+    @property
+    def channels_count(self) -> int:
+        return len(self.settings)
+
+    def next_buffer(self) -> np.ndarray:
+        """ the buffer for the next portion, while fewer portions than there are buffers are pending """
+        buffer: np.ndarray = self._buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % self._buffers.shape[0]
+        return buffer
+
+    @property
+    def rate(self) -> float:
+        """ the frame rate measured over the whole run, so that the network jitter averages out """
+        if self.first_time is None or self.last_time is None or self.last_time <= self.first_time:
+            return 0.0
+        return (self.frames_count - self.first_frames_count) / (self.last_time - self.first_time)
+
+
+class MultiDeviceAcquisition:
+    """
+    Stream several devices concurrently and merge their portions into frames of all their channels
+
+    The devices get configured alike and started as close in time to each other as the network allows.
+    They may have different counts of channels, and their ADC frequency dividers are then chosen
+    for their frame rates to be the same exactly, so no frames need resampling.
+    Then, the n-th frame of every device is considered taken at the same time.
+    The devices have their own clocks, so the drift between them is measured and reported.
+    """
+
+    def __init__(self, devices: Sequence[Tuple[str, Sequence[ChannelSettings]]], frame_rate: float,
+                 data_portion_size: int, max_pending_portions: int = 16) -> None:
+        if not devices:
+            raise ValueError('No devices')
+        if data_portion_size <= 0:
+            raise ValueError('Invalid data portion size', data_portion_size)
+        if max_pending_portions <= 0:
+            raise ValueError('Invalid pending portions count', max_pending_portions)
+        ip: str
+        settings: Sequence[ChannelSettings]
+        for ip, settings in devices:
+            if not settings:
+                raise ValueError('No channels to read from', ip)
+        adc_frequency_dividers: List[int] = frequency_dividers(frame_rate, [len(settings) for _, settings in devices])
+        self._streams: Final[List[_DeviceStream]] = [
+            _DeviceStream(ip, settings, adc_frequency_divider, data_portion_size, max_pending_portions)
+            for (ip, settings), adc_frequency_divider in zip(devices, adc_frequency_dividers)]
+
+        self.frame_rate: Final[float] = adc_frame_rate(self._streams[0].adc_frequency_divider,
+                                                       self._streams[0].channels_count)
+        self.data_portion_size: Final[int] = data_portion_size
+        self.max_pending_portions: Final[int] = max_pending_portions
+        self.channels_count: Final[int] = sum(stream.channels_count for stream in self._streams)
+        # the merged frames, overwritten by every portion
+        self._merged: Final[np.ndarray] = np.empty((data_portion_size, self.channels_count), dtype=np.float32)
+
+        self._portion_arrived: Optional[asyncio.Condition] = None
+        self._receivers: List[asyncio.Task] = []
+        self._failure: Optional[Exception] = None
+
+    @property
+    def devices(self) -> List[AsyncE502]:
+        return [stream.device for stream in self._streams]
+
+    def statistics(self) -> List[DeviceStatistics]:
+        reference_rate: float = self._streams[0].rate
+        most_frames_count: int = max(stream.frames_count for stream in self._streams)
+        return [DeviceStatistics(ip=stream.device.ip,
+                                 frames_count=stream.frames_count,
+                                 throughput=stream.rate,
+                                 lag=most_frames_count - stream.frames_count,
+                                 drift=((stream.rate / reference_rate - 1.0) * 1e6 if reference_rate else 0.0))
+                for stream in self._streams]
+
+    async def start(self, digital_lines: Sequence[bool] = ()) -> None:
+        stream: _DeviceStream
+        await asyncio.gather(*(stream.device.connect() for stream in self._streams))
+        await asyncio.gather(*(self._prepare(stream, digital_lines) for stream in self._streams))
+        # the last step to be done as simultaneously as possible
+        await asyncio.gather(*(stream.device.set_sync_io(True) for stream in self._streams))
+
+        self._portion_arrived = asyncio.Condition()
+        self._receivers = [asyncio.ensure_future(self._receive(stream)) for stream in self._streams]
+
+    async def _prepare(self, stream: _DeviceStream, digital_lines: Sequence[bool]) -> None:
+        device: AsyncE502 = stream.device
+        await device.write_channels_settings_table(stream.settings)
+        await device.set_adc_frequency_divider(stream.adc_frequency_divider)
+        i: int
+        on: bool
+        for i, on in enumerate(digital_lines):
+            await device.write_digital(i, on)
+        await device.enable_in_stream(from_adc=True)
+        await device.start_data_stream()
+        await device.preload_adc()
+
+    async def stop(self) -> None:
+        receiver: asyncio.Task
+        for receiver in self._receivers:
+            receiver.cancel()
+        await asyncio.gather(*self._receivers, return_exceptions=True)
+        self._receivers.clear()
+
+        async def stop_device(device: AsyncE502) -> None:
+            try:
+                await device.set_sync_io(False)
+                await device.stop_data_stream()
+            finally:
+                await device.close()
+
+        await asyncio.gather(*(stop_device(stream.device) for stream in self._streams), return_exceptions=True)
+
+    async def __aenter__(self) -> MultiDeviceAcquisition:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_args: object) -> None:
+        await self.stop()
+
+    async def _receive(self, stream: _DeviceStream) -> None:
+        portion_arrived: asyncio.Condition = self._portion_arrived
+        try:
+            await self._receive_portions(stream, portion_arrived)
+        except Exception as ex:
+            # let the merging notice the failure
+            async with portion_arrived:
+                self._failure = ex
+                portion_arrived.notify_all()
+            raise
+
+    async def _receive_portions(self, stream: _DeviceStream, portion_arrived: asyncio.Condition) -> None:
+        while True:
+            async with portion_arrived:
+                # don't let a device get too far ahead of the others
+                await portion_arrived.wait_for(lambda: len(stream.portions) < self.max_pending_portions)
+            portion: np.ndarray = stream.next_buffer()
+            await stream.device.get_data(self.data_portion_size, out=portion)
+            now: float = time.monotonic()
+            async with portion_arrived:
+                stream.portions.append(portion)
+                if stream.first_time is None:
+                    # the frames of the first portion could have been waiting for long, so they are not timed
+                    stream.first_time = now
+                    stream.first_frames_count = self.data_portion_size
+                stream.last_time = now
+                stream.frames_count += self.data_portion_size
+                portion_arrived.notify_all()
+
+    async def portions(self) -> AsyncIterator[np.ndarray]:
+        """
+        yield the portions of frames of all the channels, in the order of the devices;
+        a portion is valid until the next one is asked for, for they share the memory
+        """
+        if self._portion_arrived is None:
+            raise RuntimeError('The acquisition has not been started')
+        portion_arrived: asyncio.Condition = self._portion_arrived
+        stream: _DeviceStream
+        while True:
+            async with portion_arrived:
+                await portion_arrived.wait_for(lambda: all(stream.portions for stream in self._streams)
+                                               or self._failure is not None)
+                if self._failure is not None:
+                    raise self._failure
+                column: int = 0
+                for stream in self._streams:
+                    self._merged[:, column:column + stream.channels_count] = stream.portions.popleft()
+                    column += stream.channels_count
+                portion_arrived.notify_all()
+            yield self._merged
@@ -0,0 +1,320 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Mapping, Optional, TextIO, Tuple, Type
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+from stubs import Final, Literal
+from text_format import format_text
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+try:
+    import hdf5plugin  # provides Blosc
+except ImportError:
+    hdf5plugin = None
+
+__all__ = ['FileWritingMode', 'OutputBackend', 'TextBackend', 'BinaryBackend', 'NpyBackend', 'HDF5Backend',
+           'BACKENDS', 'backend_for']
+
+FileWritingMode = Literal['w', 'w+', '+w', 'wt', 'tw', 'wt+', 'w+t', '+wt', 'tw+', 't+w', '+tw',
+                          'a', 'a+', '+a', 'at', 'ta', 'at+', 'a+t', '+at', 'ta+', 't+a', '+ta',
+                          'x', 'x+', '+x', 'xt', 'tx', 'xt+', 'x+t', '+xt', 'tx+', 't+x', '+tx']
+
+
+class OutputBackend:
+    """ a file the data portions get appended to; it's opened upon the first portion """
+
+    SUFFIX: str = ''
+    # whether the file holds all the channels of a measurement rather than one
+    ALL_CHANNELS: bool = False
+    # whether `write_header` stores the parameters, in the file or alongside it
+    HOLDS_HEADER: bool = False
+
+    def __init__(self, path: Path, mode: FileWritingMode, buffering: int = -1, **_options: Any) -> None:
+        self.path: Final[Path] = path
+        self.mode: Final[FileWritingMode] = mode
+        self.buffering: Final[int] = buffering
+
+    def __enter__(self) -> OutputBackend:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    @property
+    def binary_mode(self) -> str:
+        return self.mode.replace('t', '').replace('+', '') + 'b'
+
+    @property
+    def sidecar_path(self) -> Path:
+        return self.path.with_suffix('.json')
+
+    def write_header(self, header: Mapping[str, Any]) -> None:
+        """ store the measurement parameters, if the format can hold them """
+
+    def write(self, data: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def _write_sidecar(self, header: Mapping[str, Any]) -> None:
+        with self.sidecar_path.open('wt') as f_out:
+            json.dump(header, f_out, indent=2, default=str)
+
+
+class TextBackend(OutputBackend):
+    """ tab-separated values, a line per frame, with all the digits unless `precision` is set """
+
+    SUFFIX: str = '.csv'
+
+    def __init__(self, path: Path, mode: FileWritingMode, precision: Optional[int] = None, **options: Any) -> None:
+        super().__init__(path, mode, **options)
+        self.precision: Final[Optional[int]] = precision
+        self._file: Optional[TextIO] = None
+
+    def write(self, data: np.ndarray) -> None:
+        if self._file is None:
+            self._file = self.path.open(self.mode, buffering=self.buffering)
+        self._file.write(format_text(data, self.precision))
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BinaryBackend(OutputBackend):
+    """ raw little-endian `float32` or `int32` values with the parameters in a JSON file alongside """
+
+    SUFFIX: str = '.bin'
+    HOLDS_HEADER: bool = True
+
+    def __init__(self, path: Path, mode: FileWritingMode, **options: Any) -> None:
+        super().__init__(path, mode, **options)
+        self._file: Optional[BinaryIO] = None
+
+    @staticmethod
+    def dtype(data: np.ndarray) -> np.dtype:
+        if np.issubdtype(data.dtype, np.integer):
+            return np.dtype('<i4')
+        return np.dtype('<f4')
+
+    def write_header(self, header: Mapping[str, Any]) -> None:
+        self._write_sidecar(header)
+
+    def write(self, data: np.ndarray) -> None:
+        if self._file is None:
+            self._file = self.path.open(self.binary_mode, buffering=self.buffering)
+        # no copy is made unless the data are of another type or scattered
+        self._file.write(memoryview(np.ascontiguousarray(data, dtype=self.dtype(data))).cast('B'))
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+class NpyBackend(BinaryBackend):
+    """
+    A `.npy` file with the shape in its header updated whenever the appended chunks are flushed
+
+    The chunks get flushed at least every `header_interval` seconds while appended, so after a crash,
+    the header misses only the frames of the last interval. They are still in the file, though:
+    the frames count is the size of the file less the header size over the size of a frame.
+    """
+
+    SUFFIX: str = '.npy'
+
+    # enough to hold the header of any shape the data might grow to
+    HEADER_SIZE: Final[int] = 128
+
+    def __init__(self, path: Path, mode: FileWritingMode, header_interval: float = 1.0, **options: Any) -> None:
+        super().__init__(path, mode, **options)
+        self.header_interval: Final[float] = header_interval
+        self._dtype: Optional[np.dtype] = None
+        self._shape: Tuple[int, ...] = ()
+        self._header_size: int = self.HEADER_SIZE
+        self._header_time: float = time.monotonic()
+
+    def _open(self, data: np.ndarray) -> BinaryIO:
+        f: BinaryIO
+        if self.binary_mode.startswith('a') and self.path.exists() and self.path.stat().st_size:
+            f = self.path.open('r+b', buffering=self.buffering)
+            fortran_order: bool
+            if npy_format.read_magic(f) != (1, 0):
+                f.close()
+                raise ValueError('Unsupported file format version', self.path)
+            self._shape, fortran_order, self._dtype = npy_format.read_array_header_1_0(f)
+            self._header_size = f.tell()
+            if fortran_order or self._dtype != self.dtype(data) or self._shape[1:] != data.shape[1:]:
+                f.close()
+                raise ValueError('Incompatible data to append to the file', self.path)
+            f.seek(0, 2)
+        else:
+            # the header gets rewritten, so no append mode
+            f = self.path.open(self.binary_mode.replace('a', 'w'), buffering=self.buffering)
+            self._dtype = self.dtype(data)
+            self._shape = (0,) + data.shape[1:]
+            self._header_size = self.HEADER_SIZE
+            self._write_npy_header(f)
+        return f
+
+    def _write_npy_header(self, f: BinaryIO) -> None:
+        header: bytes = repr({
+            'descr': npy_format.dtype_to_descr(self._dtype),
+            'fortran_order': False,
+            'shape': self._shape,
+        }).encode('latin1')
+        prefix: bytes = npy_format.magic(1, 0)
+        header_length: int = self._header_size - len(prefix) - 2
+        if len(header) + 1 > header_length:
+            raise ValueError('The shape does not fit into the file header', self._shape)
+        f.write(prefix + header_length.to_bytes(2, 'little') + header.ljust(header_length - 1) + b'\n')
+
+    def write(self, data: np.ndarray) -> None:
+        if self._file is None:
+            self._file = self._open(data)
+        self._file.write(memoryview(np.ascontiguousarray(data, dtype=self._dtype)).cast('B'))
+        self._shape = (self._shape[0] + data.shape[0],) + self._shape[1:]
+        if time.monotonic() - self._header_time >= self.header_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is not None:
+            # the frames get onto the disk before the header counts them
+            self._file.flush()
+            position: int = self._file.tell()
+            self._file.seek(0)
+            self._write_npy_header(self._file)
+            self._file.seek(position)
+        super().flush()
+        self._header_time = time.monotonic()
+
+
+class HDF5Backend(OutputBackend):
+    """ a file per measurement with an extendable chunked dataset per channel and the parameters as attributes """
+
+    SUFFIX: str = '.h5'
+    ALL_CHANNELS: bool = True
+    HOLDS_HEADER: bool = True
+
+    def __init__(self, path: Path, mode: FileWritingMode,
+                 compression: Optional[str] = None, chunk_size: int = 1 << 16, **options: Any) -> None:
+        if h5py is None:
+            raise ImportError('`h5py` is required to write HDF5 files')
+        super().__init__(path, mode, **options)
+        self.compression: Final[Optional[str]] = compression
+        self.chunk_size: Final[int] = chunk_size
+        self._file: Optional[h5py.File] = None
+        # the datasets by the channel index, not to look them up by every write
+        self._datasets: Dict[int, h5py.Dataset] = {}
+
+    def _open(self) -> h5py.File:
+        if self._file is None:
+            file_mode: str = 'a' if 'a' in self.mode else self.mode.replace('t', '').replace('+', '')
+            self._file = h5py.File(self.path, file_mode,
+                                   rdcc_nbytes=(self.buffering if self.buffering > 0 else None))
+        return self._file
+
+    def _compression_options(self) -> Dict[str, Any]:
+        if not self.compression:
+            return {}
+        if self.compression == 'blosc':
+            if hdf5plugin is None:
+                raise ImportError('`hdf5plugin` is required for Blosc compression')
+            return dict(hdf5plugin.Blosc())
+        return {'compression': self.compression, 'shuffle': True}
+
+    def _dataset(self, index: int, name: str = '', dtype: np.dtype = np.dtype(np.float32)) -> h5py.Dataset:
+        """ get the dataset of the channel, and create it if needed """
+        if index in self._datasets:
+            return self._datasets[index]
+        f: h5py.File = self._open()
+        names: List[str] = json.loads(f.attrs.get('channels', '[]'))
+        if index < len(names):
+            self._datasets[index] = f[names[index]]
+        else:
+            names.extend(f'channel {i}' for i in range(len(names), index))
+            names.append(name or f'channel {index}')
+            f.attrs['channels'] = json.dumps(names)
+            self._datasets[index] = f.create_dataset(names[index], shape=(0,), maxshape=(None,), dtype=dtype,
+                                                     chunks=(self.chunk_size,), **self._compression_options())
+        return self._datasets[index]
+
+    @staticmethod
+    def _attributes(values: Mapping[str, Any]) -> Dict[str, Any]:
+        """ make the values fit HDF5 attributes: no `None`, the lists of numbers as arrays, and the rest as JSON """
+        def attribute(value: Any) -> Any:
+            if isinstance(value, (str, int, float, bool)):
+                return value
+            if (isinstance(value, (list, tuple)) and value
+                    and all(isinstance(item, (int, float)) and not isinstance(item, bool) for item in value)):
+                return np.asarray(value, dtype=np.float64)
+            return json.dumps(value, default=str)
+
+        return {key: attribute(value) for key, value in values.items() if value is not None}
+
+    def write_header(self, header: Mapping[str, Any]) -> None:
+        f: h5py.File = self._open()
+        dtype: np.dtype = np.dtype(header.get('dtype') or np.float32)
+        index: int
+        channel: Mapping[str, Any]
+        for index, channel in enumerate(header.get('channels', [])):
+            self._dataset(index, channel.get('name', ''), dtype).attrs.update(self._attributes(channel))
+        f.attrs.update(self._attributes({key: value for key, value in header.items() if key != 'channels'}))
+
+    def write(self, data: np.ndarray) -> None:
+        if data.ndim < 2:
+            data = data.reshape((-1, 1))
+        index: int
+        for index in range(data.shape[1]):
+            dataset: h5py.Dataset = self._dataset(index, dtype=data.dtype)
+            size: int = dataset.shape[0]
+            dataset.resize((size + data.shape[0],))
+            dataset[size:] = data[:, index]
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.attrs['last_write_time'] = datetime.now().isoformat()
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._datasets.clear()
+            self._file.close()
+            self._file = None
+
+
+BACKENDS: Final[Dict[str, Type[OutputBackend]]] = {
+    backend.SUFFIX: backend for backend in (TextBackend, BinaryBackend, NpyBackend)
+}
+if h5py is not None:
+    BACKENDS[HDF5Backend.SUFFIX] = HDF5Backend
+
+
+def backend_for(path: Path) -> Type[OutputBackend]:
+    return BACKENDS.get(path.suffix.lower(), TextBackend)
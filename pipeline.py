@@ -0,0 +1,136 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import signal
+from multiprocessing import Process, Queue
+from pathlib import Path
+from queue import Empty
+from types import FrameType
+from typing import Any, Callable, List, Mapping, Optional, Sequence, Tuple, cast
+
+import numpy as np
+
+from file_writer import FileWritingMode, FileWritingRequest
+from ring_buffer import RingBufferReader, RingBufferSlice
+
+__all__ = ['FileTarget', 'PipelineStage', 'PortionDispatcher']
+
+# a file to save the frames into: the path, the channel to save alone, or `None` for all of them, and the header
+FileTarget = Tuple[Path, Optional[int], Optional[Mapping[str, Any]]]
+
+
+class PipelineStage(Process):
+    """
+    A process that handles the frames of a measurement, reading them from the shared ring buffer
+
+    The portions to handle are announced with the slices put into `portions_queue`;
+    a slice of no frames marks the end of a measurement.
+    The subclasses do the work in `process`, and `idle` is called at least every `idle_interval` seconds.
+    """
+
+    def __init__(self, portions_queue: Queue[RingBufferSlice], idle_interval: float = 0.1) -> None:
+        super(PipelineStage, self).__init__()
+        self.portions_queue: Queue[RingBufferSlice] = portions_queue
+        self.idle_interval: float = idle_interval
+
+        self.ring_buffer_reader: Optional[RingBufferReader] = None
+
+    def process(self, portion: RingBufferSlice, data: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def idle(self) -> None:
+        pass
+
+    def finish(self) -> None:
+        """ the measurement is over, so whatever is accumulated is to be published """
+        pass
+
+    def close(self) -> None:
+        """ release what the stage holds when the process ends """
+        pass
+
+    def run(self) -> None:
+        def on_terminate(_signal_number: int, _frame: Optional[FrameType]) -> None:
+            raise SystemExit
+
+        # let the results be published when the process gets terminated
+        signal.signal(signal.SIGTERM, on_terminate)
+
+        self.ring_buffer_reader = RingBufferReader()
+        portion: RingBufferSlice
+        data: Optional[np.ndarray]
+        try:
+            while True:
+                try:
+                    portion = self.portions_queue.get(block=True, timeout=self.idle_interval)
+                except Empty:
+                    self.idle()
+                    continue
+                if not portion.count:
+                    self.finish()
+                    continue
+                data = self.ring_buffer_reader.read(portion)
+                if data is not None:  # otherwise, the data has been overwritten already
+                    self.process(portion, data)
+                self.idle()
+        finally:
+            self.finish()
+            self.close()
+            self.ring_buffer_reader.close()
+
+
+class PortionDispatcher:
+    """
+    Hand every portion of a measurement on to the pipeline stages and the file writer, and read its frames
+
+    The stages and the file writer read the frames from the shared ring buffer by themselves,
+    so only the slices are put into `stages_queues` and `file_requests_queue`.
+    The files to save all the frames into are got from `file_targets` for every segment of the measurement,
+    as the first portion of the segment comes, and the files of the former segment get closed.
+    """
+
+    def __init__(self, ring_buffer_reader: RingBufferReader,
+                 stages_queues: Sequence[Queue[RingBufferSlice]] = (),
+                 file_requests_queue: Optional[Queue[FileWritingRequest]] = None,
+                 file_targets: Optional[Callable[[], Sequence[FileTarget]]] = None) -> None:
+        self.ring_buffer_reader: RingBufferReader = ring_buffer_reader
+        self.stages_queues: List[Queue[RingBufferSlice]] = list(stages_queues)
+        self.file_requests_queue: Optional[Queue[FileWritingRequest]] = file_requests_queue
+        self.file_targets: Optional[Callable[[], Sequence[FileTarget]]] = file_targets
+
+        self.segment: int = 0
+        self._files: List[Tuple[Path, Optional[int]]] = []
+        self._open_files()
+
+    def _open_files(self) -> None:
+        """ send the headers of the files of the segment, and remember where the frames go """
+        self._files = []
+        if self.file_requests_queue is None or self.file_targets is None:
+            return
+        path: Path
+        column: Optional[int]
+        header: Optional[Mapping[str, Any]]
+        for path, column, header in self.file_targets():
+            if header is not None:
+                self.file_requests_queue.put((path, cast(FileWritingMode, 'at'), header))
+            self._files.append((path, column))
+
+    def dispatch(self, portion: RingBufferSlice) -> Optional[np.ndarray]:
+        """ hand the portion on; get its frames unless they have been overwritten already """
+        if portion.segment != self.segment:
+            self.segment = portion.segment
+            if self.file_requests_queue is not None:
+                # the files of the former segment are complete
+                self.file_requests_queue.put((None, cast(FileWritingMode, 'at'), np.empty(0)))
+                self._open_files()
+        queue: Queue[RingBufferSlice]
+        for queue in self.stages_queues:
+            queue.put(portion)
+        path: Path
+        column: Optional[int]
+        for path, column in self._files:
+            # the file writer reads the data from the shared memory by itself
+            self.file_requests_queue.put((path, cast(FileWritingMode, 'at'),
+                                          portion if column is None else portion._replace(column=column)))
+        return self.ring_buffer_reader.read(portion)
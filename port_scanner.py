@@ -2,67 +2,282 @@
 
 from __future__ import annotations
 
-import concurrent.futures
+import asyncio
 import ipaddress
-from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import os
+import time
 from multiprocessing import Process, Queue
+from pathlib import Path
 from socket import socket, AF_INET, SOCK_STREAM
-from typing import Final, Sequence, Tuple, Dict, List
+from typing import (Any, AsyncIterator, Dict, Final, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set,
+                    Tuple)
 
 import netifaces
 
-__all__ = ['IPv4PortScanner']
+from device_cache import cache_directory
+from e502 import CONTROL_PORT, DATA_PORT, parse_module_data
+from e502_async import AsyncE502
+from hardware_info import HardwareInfo
 
-PORTS_TO_CHECK: Final[Sequence[int]] = [11114, 11115]
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
+__all__ = ['DiscoveredDevice', 'DiscoveryCache', 'IPv4PortScanner', 'default_concurrency', 'discover', 'identify',
+           'local_hosts', 'raise_open_files_limit']
 
-def port_scan(target: str) -> Tuple[str, bool]:
-    s: socket = socket(AF_INET, SOCK_STREAM)
-    s.settimeout(1.)
+PORTS_TO_CHECK: Final[Sequence[int]] = [CONTROL_PORT, DATA_PORT]
 
+# the most hosts probed at a time: more of the connections attempted would flood the network rather than help
+MAX_CONCURRENCY: Final[int] = 4096
+# how many hosts are probed at a time where there is no open files limit to derive the count from
+WINDOWS_CONCURRENCY: Final[int] = 512
+# the open files left for the rest of the process
+RESERVED_FILES_COUNT: Final[int] = 64
+
+
+def port_scan(target: str, timeout: float = 1.) -> Tuple[str, bool]:
+    """ whether all the ports of a device accept connections at `target`, with no identification """
     port: int
+    for port in PORTS_TO_CHECK:
+        s: socket
+        with socket(AF_INET, SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            try:
+                s.connect((target, port))
+            except (TimeoutError, OSError):
+                return target, False
+    return target, True
+
+
+class DiscoveredDevice(NamedTuple):
+    ip: str
+    name: str
+    serial_number: str
+    firmware_version: str
+    hardware: Optional[HardwareInfo]
+    # the round trip of reading the module data, in seconds
+    latency: float
+    # when the device has been identified, by `time.time`
+    time: float
+
+    def __str__(self) -> str:
+        return ' '.join(filter(None, (self.ip, self.name, str(self.hardware or ''), self.serial_number)))
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(self._asdict(), hardware=(self.hardware.data.hex() if self.hardware is not None else None))
+
+    @staticmethod
+    def from_json(data: Dict[str, Any]) -> DiscoveredDevice:
+        hardware: Optional[str] = data.get('hardware')
+        return DiscoveredDevice(**dict(data, hardware=(HardwareInfo(bytes.fromhex(hardware))
+                                                       if hardware is not None else None)))
+
+
+class DiscoveryCache:
+    """
+    The devices found, stored on the disk between the scans
+
+    The devices found within `max_age` seconds are shown before a scan finds them anew,
+    and the addresses of all the devices stored are probed first, the latest found first.
+    """
+
+    VERSION: Final[int] = 1
+
+    def __init__(self, path: Optional[Path] = None, max_age: float = 24 * 3600., max_count: int = 16) -> None:
+        self.path: Final[Path] = path if path is not None else cache_directory() / 'discovered_devices.json'
+        self.max_age: Final[float] = max_age
+        self.max_count: Final[int] = max_count
+
+    def _load(self) -> List[DiscoveredDevice]:
+        try:
+            data: Dict[str, Any] = json.loads(self.path.read_text())
+            if not isinstance(data, dict) or data.get('version') != self.VERSION:
+                return []
+            devices: List[DiscoveredDevice] = [DiscoveredDevice.from_json(item) for item in data.get('devices', [])]
+        except (OSError, ValueError, TypeError):
+            return []
+        return sorted(devices, key=lambda device: device.time, reverse=True)
+
+    def addresses(self) -> List[str]:
+        """ the addresses of the devices stored, the latest found first, however old they are """
+        return [device.ip for device in self._load()]
+
+    def devices(self) -> List[DiscoveredDevice]:
+        """ the devices found within `max_age` seconds, the latest found first """
+        return [device for device in self._load() if time.time() - device.time <= self.max_age]
+
+    def put(self, device: DiscoveredDevice) -> None:
+        devices: List[DiscoveredDevice] = [device] + [d for d in self._load() if d.ip != device.ip]
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path: Path = self.path.with_name(self.path.name + f'.{os.getpid()}')
+            temporary_path.write_text(json.dumps({'version': self.VERSION,
+                                                  'devices': [d.to_json() for d in devices[:self.max_count]]},
+                                                 indent=1))
+            # the readers in other processes never get a partially written file
+            temporary_path.replace(self.path)
+        except OSError:
+            pass  # it's just a cache
+
+
+def local_hosts() -> Iterator[str]:
+    """ all the hosts of the IPv4 subnets of the network interfaces but the loopback ones """
+    interface: str
+    for interface in netifaces.interfaces():
+        if interface.startswith('lo') and interface[2:].isdecimal():
+            continue
+        addresses: Dict[int, List[Dict[str, str]]] = netifaces.ifaddresses(interface)
+        if netifaces.AF_INET not in addresses:
+            continue
+        address: Dict[str, str]
+        for address in addresses[netifaces.AF_INET]:
+            if address['add''r'] in ('127.0.0.1', '::1'):
+                continue
+            host: ipaddress.IPv4Address  # IPv6 is far too wast to scan
+            for host in ipaddress.IPv4Network(f"{address['add''r'].split('%')[0]}/{address['netmask'].split('/')[-1]}",
+                                              strict=False).hosts():
+                yield str(host)
+
+
+def default_concurrency() -> int:
+    """ how many hosts to probe at a time: a probe takes two sockets, so half as many as the open files limit allows """
+    if resource is None:
+        return WINDOWS_CONCURRENCY
+    soft_limit: int = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if soft_limit == resource.RLIM_INFINITY:
+        return MAX_CONCURRENCY
+    return max(1, min(MAX_CONCURRENCY, (soft_limit - RESERVED_FILES_COUNT) // 2))
+
+
+def raise_open_files_limit() -> None:
+    """ let the process open as many files as `MAX_CONCURRENCY` probes take, as far as the hard limit allows """
+    if resource is None:
+        return
+    soft_limit: int
+    hard_limit: int
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted_limit: int = 2 * MAX_CONCURRENCY + RESERVED_FILES_COUNT
+    if hard_limit != resource.RLIM_INFINITY:
+        wanted_limit = min(wanted_limit, hard_limit)
+    if soft_limit == resource.RLIM_INFINITY or soft_limit >= wanted_limit:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted_limit, hard_limit))
+    except (ValueError, OSError):
+        pass  # the system limit is lower, and the scan just takes longer
+
+
+async def identify(host: str, timeout: float = 1.0) -> Optional[DiscoveredDevice]:
+    """
+    connect to both ports of `host`, and read the module data and the hardware info,
+    each step taking `timeout` seconds at most; get `None` unless a device has answered as one
+    """
+    device: AsyncE502 = AsyncE502(host)
     try:
-        for port in PORTS_TO_CHECK:
-            s.connect((target, port))
-    except (TimeoutError, OSError):
-        return target, False
-    else:
-        s.close()
-        return target, True
+        await asyncio.wait_for(device.connect(), timeout)
+        start_time: float = time.monotonic()
+        module_data: bytes
+        error: int
+        module_data, error = await asyncio.wait_for(device.read_module_data(), timeout)
+        latency: float = time.monotonic() - start_time
+        if error:
+            return None
+        name: str
+        serial_number: str
+        firmware_version: str
+        name, serial_number, firmware_version = parse_module_data(module_data)
+        hardware: Optional[HardwareInfo] = await asyncio.wait_for(device.hardware(), timeout)
+    except (asyncio.TimeoutError, OSError, ValueError):
+        return None
+    finally:
+        await device.close()
+    return DiscoveredDevice(host, name, serial_number, firmware_version, hardware, latency, time.time())
+
+
+async def discover(hosts: Iterable[str], concurrency: Optional[int] = None,
+                   timeout: float = 1.0) -> AsyncIterator[DiscoveredDevice]:
+    """
+    yield the devices as soon as they are identified, the hosts being probed in their order,
+    `concurrency` of them at a time, as many as `default_concurrency` tells by default,
+    each step of a probe taking `timeout` seconds at most
+
+    The hosts that don't answer take the whole `timeout`, so a scan takes about the count of the hosts
+    times `timeout` over `concurrency`, and one `timeout` more for the probes to start:
+    a /24 subnet takes two seconds, and a /16 one of 65534 hosts takes 17 s at 4096 hosts at a time,
+    or over 4 minutes at 256.
+    """
+    if concurrency is None:
+        concurrency = default_concurrency()
+    found: asyncio.Queue[Optional[DiscoveredDevice]] = asyncio.Queue()
+    seen: Set[str] = set()
+
+    def unique_hosts() -> Iterator[str]:
+        host: str
+        for host in hosts:
+            if host not in seen:
+                seen.add(host)
+                yield host
+
+    # the workers share the iterator, so a host is probed once, and the hosts never get listed all at once
+    hosts_iterator: Iterator[str] = unique_hosts()
+
+    async def work(index: int) -> None:
+        # the workers start evenly over the first timeout, for a burst of connections not to delay the answers
+        # to the first of them, and then the hosts get probed at a steady rate
+        await asyncio.sleep(index * timeout / concurrency)
+        host: str
+        for host in hosts_iterator:
+            device: Optional[DiscoveredDevice] = await identify(host, timeout)
+            if device is not None:
+                found.put_nowait(device)
+
+    async def work_all() -> None:
+        try:
+            await asyncio.gather(*(work(index) for index in range(concurrency)))
+        finally:
+            found.put_nowait(None)
+
+    workers: asyncio.Task = asyncio.ensure_future(work_all())
+    try:
+        while True:
+            result: Optional[DiscoveredDevice] = await found.get()
+            if result is None:
+                break
+            yield result
+        await workers
+    finally:
+        workers.cancel()
 
 
 class IPv4PortScanner(Process):
-    def __init__(self, results_queue: Queue[str]) -> None:
+    """
+    find the devices on the local networks, trying the addresses they have recently been found at first
+
+    The process raises its open files limit for `concurrency` to be as large as `discover` may take,
+    unless the count is given; see `discover` for how long a scan takes.
+    """
+
+    def __init__(self, results_queue: Queue[DiscoveredDevice], concurrency: Optional[int] = None,
+                 timeout: float = 1.0, cache: Optional[DiscoveryCache] = None) -> None:
         super().__init__(daemon=True)
-        self.results_queue: Queue[str] = results_queue
+        self.results_queue: Queue[DiscoveredDevice] = results_queue
+        self.concurrency: Optional[int] = concurrency
+        self.timeout: float = timeout
+        self.cache: DiscoveryCache = cache if cache is not None else DiscoveryCache()
+
+    async def _scan(self) -> None:
+        def hosts() -> Iterator[str]:
+            yield from self.cache.addresses()
+            yield from local_hosts()
+
+        device: DiscoveredDevice
+        async for device in discover(hosts(), self.concurrency, self.timeout):
+            self.results_queue.put(device)
+            self.cache.put(device)
 
     def run(self) -> None:
-        executor: ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=65535) as executor:
-            tasks: List[Future[Tuple[str, bool]]] = []
-            interface: str
-            for interface in netifaces.interfaces():
-                if interface.startswith('lo') and interface[2:].isdecimal():
-                    continue
-                addresses: Dict[int, List[Dict[str, str]]] = netifaces.ifaddresses(interface)
-                net: int
-                for net in (netifaces.AF_INET,):
-                    if net not in addresses:
-                        continue
-                    address: Dict[str, str]
-                    for address in addresses[net]:
-                        if address['add''r'] in ('127.0.0.1', '::1'):
-                            continue
-                        host: ipaddress.IPv4Address  # IPv6 is far too wast to scan
-                        for host in ipaddress.IPv4Network(
-                                f"{address['add''r'].split('%')[0]}/{address['netmask'].split('/')[-1]}",
-                                strict=False).hosts():
-                            tasks.append(executor.submit(port_scan, str(host),))
-
-            future: Future[Tuple[str, bool]]
-            for future in concurrent.futures.as_completed(tasks):
-                host_name: str
-                result: bool
-                host_name, result = future.result()
-                if result:
-                    self.results_queue.put(host_name)
+        raise_open_files_limit()
+        asyncio.run(self._scan())
@@ -0,0 +1,73 @@
+# coding: utf-8
+from __future__ import annotations
+
+import math
+from typing import Optional
+
+from stubs import Final
+
+__all__ = ['PortionSizer']
+
+
+class PortionSizer:
+    """
+    The count of the frames to receive at once, tuned between the portions within the latency bounds
+
+    A portion takes at least `min_latency` and at most `max_latency` seconds of frames.
+    When the frames pile up in the socket or the portions do in the queue, the receiving falls behind,
+    and the portions double, for fewer portions to have less overhead.
+    When the receiving waits for the device and nothing piles up, the portions shrink slowly, for less latency.
+    Without the socket fill known, the receiving falls behind if a portion is received much faster than it lasts.
+    """
+
+    # how many portions may wait in the queue before the consumer is taken for lagging
+    MAX_BACKLOG: Final[int] = 2
+    GROWTH: Final[float] = 2.0
+    SHRINKAGE: Final[float] = 0.9
+
+    def __init__(self, frame_rate: float, min_latency: float = 0.01, max_latency: float = 0.5,
+                 initial_size: Optional[int] = None, max_size: Optional[int] = None) -> None:
+        if frame_rate <= 0.0:
+            raise ValueError('Invalid frame rate', frame_rate)
+        if not (0.0 < min_latency <= max_latency):
+            raise ValueError('Invalid latency bounds', min_latency, max_latency)
+        self.frame_rate: Final[float] = frame_rate
+        self.min_size: Final[int] = max(1, math.ceil(min_latency * frame_rate))
+        if max_size is None:
+            max_size = math.floor(max_latency * frame_rate)
+        else:
+            max_size = min(max_size, math.floor(max_latency * frame_rate))
+        self.max_size: Final[int] = max(self.min_size, max_size)
+        self._size: float = float(self.min_size if initial_size is None else initial_size)
+        self._size = min(max(self._size, self.min_size), self.max_size)
+
+    @property
+    def size(self) -> int:
+        return round(self._size)
+
+    def update(self, count: int, receive_time: float,
+               pending_frames: Optional[int] = None, backlog: Optional[int] = None) -> int:
+        """
+        take a portion of `count` frames received in `receive_time` seconds into account,
+        `pending_frames` having stayed in the socket after it, and `backlog` portions waiting in the queue;
+        return the size of the next portion
+        """
+        if count <= 0:
+            return self.size
+        lagging: bool
+        idle: bool
+        if pending_frames is None:
+            # the duration of the portion is the time to receive it if the frames are taken as they come
+            lagging = receive_time < 0.5 * count / self.frame_rate
+            idle = receive_time > 0.9 * count / self.frame_rate
+        else:
+            lagging = pending_frames > count
+            idle = pending_frames < count // 4
+        if backlog is not None:
+            lagging = lagging or backlog > PortionSizer.MAX_BACKLOG
+            idle = idle and backlog <= 1
+        if lagging:
+            self._size = min(self._size * PortionSizer.GROWTH, self.max_size)
+        elif idle:
+            self._size = max(self._size * PortionSizer.SHRINKAGE, self.min_size)
+        return self.size
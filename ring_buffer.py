@@ -0,0 +1,209 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import mmap
+import os
+import sys
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, NamedTuple, Optional, Union
+
+import numpy as np
+from numpy.typing import DTypeLike
+
+from stubs import Final
+
+try:
+    import _posixshmem
+except ImportError:  # Windows, where there is no resource tracker
+    _posixshmem = None
+
+__all__ = ['SharedRingBuffer', 'RingBufferReader', 'RingBufferSlice']
+
+
+class RingBufferSlice(NamedTuple):
+    """ a small picklable reference to the frames `start` to `start + count` of a ring buffer """
+    buffer: str
+    start: int
+    count: int
+    column: Optional[int] = None
+    # the part of a continuous measurement the frames belong to
+    segment: int = 0
+    # when the frames were received, by `time.monotonic`, for the latency downstream to be measured
+    received_time: float = 0.0
+
+
+class _UntrackedSharedMemory:
+    """
+    The shared memory of another process, attached as `SharedMemory(name=name, track=False)` of Python 3.13 does
+
+    Otherwise, the memory gets unlinked twice: by the owner and by the resource tracker.
+    Unregistering it afterwards won't do, for a forked process shares the tracker with the owner,
+    and no module globals are swapped, for the other threads to get their resources tracked meanwhile.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name: Final[str] = name
+        fd: int = _posixshmem.shm_open('/' + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap: mmap.mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.buf: memoryview = memoryview(self._mmap)
+
+    def close(self) -> None:
+        self.buf.release()
+        self._mmap.close()
+
+
+class SharedRingBuffer:
+    """
+    A single-producer/multi-consumer ring buffer of frames in shared memory
+
+    The frames are addressed by their sequence number that grows monotonically.
+    The producer announces the frames it is about to overwrite via `reserve` before writing them
+    and publishes them via `commit`, so the consumers detect the overwritten frames without any lock.
+    """
+
+    # committed sequence number, reserved sequence number, capacity, channels count, dtype string
+    HEADER_SIZE: Final[int] = 64
+
+    def __init__(self, name: Optional[str] = None,
+                 capacity: int = 0, channels_count: int = 0, dtype: DTypeLike = np.float32) -> None:
+        self._shared_memory: Union[SharedMemory, _UntrackedSharedMemory]
+        header: np.ndarray
+        if name is None:
+            if capacity <= 0 or channels_count <= 0:
+                raise ValueError('Invalid ring buffer shape', capacity, channels_count)
+            dtype = np.dtype(dtype)
+            self._shared_memory = SharedMemory(create=True,
+                                               size=self.HEADER_SIZE + capacity * channels_count * dtype.itemsize)
+            header = np.ndarray((4,), dtype=np.int64, buffer=self._shared_memory.buf)
+            header[:] = 0, 0, capacity, channels_count
+            self._shared_memory.buf[32:32 + len(dtype.str)] = dtype.str.encode()
+            self._owner: Final[bool] = True
+        else:
+            if sys.version_info >= (3, 13):
+                self._shared_memory = SharedMemory(name=name, track=False)
+            elif _posixshmem is not None:
+                self._shared_memory = _UntrackedSharedMemory(name)
+            else:
+                self._shared_memory = SharedMemory(name=name)
+            header = np.ndarray((4,), dtype=np.int64, buffer=self._shared_memory.buf)
+            capacity, channels_count = int(header[2]), int(header[3])
+            dtype = np.dtype(bytes(self._shared_memory.buf[32:self.HEADER_SIZE]).rstrip(b'\0').decode())
+            self._owner: Final[bool] = False
+
+        self._header: np.ndarray = header
+        self.capacity: Final[int] = capacity
+        self.channels_count: Final[int] = channels_count
+        self.dtype: Final[np.dtype] = np.dtype(dtype)
+        self._frames: np.ndarray = np.ndarray((capacity, channels_count), dtype=self.dtype,
+                                              buffer=self._shared_memory.buf, offset=self.HEADER_SIZE)
+
+    def __del__(self) -> None:
+        self.close()
+
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+    @property
+    def committed(self) -> int:
+        """ the sequence number of the frame to be written next """
+        return int(self._header[0])
+
+    def close(self) -> None:
+        if not hasattr(self, '_frames'):
+            return
+        # the arrays refer to the shared memory, and it can't be closed while they exist
+        del self._header, self._frames
+        try:
+            self._shared_memory.close()
+        except BufferError:
+            pass  # some views are still in use, e.g., by a traceback; the memory gets closed along with them
+        if self._owner:
+            self._shared_memory.unlink()
+
+    def reserve(self, count: int) -> List[np.ndarray]:
+        """ get the views to write the next `count` frames into, one or two when the buffer wraps around """
+        if not (0 <= count <= self.capacity):
+            raise ValueError('Invalid frames count', count)
+        start: Final[int] = int(self._header[0])
+        self._header[1] = start + count
+        position: Final[int] = start % self.capacity
+        if position + count <= self.capacity:
+            return [self._frames[position:position + count]]
+        return [self._frames[position:], self._frames[:position + count - self.capacity]]
+
+    def commit(self) -> RingBufferSlice:
+        """ publish the frames written into the views got from the last `reserve` call """
+        start: Final[int] = int(self._header[0])
+        self._header[0] = self._header[1]
+        return RingBufferSlice(self.name, start, int(self._header[1]) - start)
+
+    def write(self, frames: np.ndarray) -> RingBufferSlice:
+        frames = frames.reshape((-1, self.channels_count))
+        offset: int = 0
+        view: np.ndarray
+        for view in self.reserve(frames.shape[0]):
+            view[...] = frames[offset:offset + view.shape[0]]
+            offset += view.shape[0]
+        return self.commit()
+
+    def read(self, start: int, count: int, column: Optional[int] = None,
+             out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """ copy the frames out of the buffer, or return `None` if they have been overwritten already """
+        if count < 0 or start + count > self.committed:
+            raise ValueError('Invalid frames range', start, count)
+        if start < int(self._header[1]) - self.capacity:
+            return None
+        frames: np.ndarray = self._frames if column is None else self._frames[:, column]
+        if out is None:
+            out = np.empty((count,) + frames.shape[1:], dtype=self.dtype)
+        position: Final[int] = start % self.capacity
+        if position + count <= self.capacity:
+            out[...] = frames[position:position + count]
+        else:
+            out[:self.capacity - position] = frames[position:]
+            out[self.capacity - position:] = frames[:position + count - self.capacity]
+        # the producer might have got to the frames while they were being copied
+        if start < int(self._header[1]) - self.capacity:
+            return None
+        return out
+
+
+class RingBufferReader:
+    """ a consumer of a `SharedRingBuffer` that counts the frames lost for being read too late """
+
+    def __init__(self) -> None:
+        self._buffer: Optional[SharedRingBuffer] = None
+        self.overrun_count: int = 0
+        self.lost_frames_count: int = 0
+
+    def close(self) -> None:
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    def buffer(self, name: str) -> SharedRingBuffer:
+        """ attach to the buffer, forgetting the previously used one """
+        if self._buffer is None or self._buffer.name != name:
+            self.close()
+            self._buffer = SharedRingBuffer(name)
+        return self._buffer
+
+    def read(self, ring_buffer_slice: RingBufferSlice,
+             out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        buffer: Optional[SharedRingBuffer]
+        try:
+            buffer = self.buffer(ring_buffer_slice.buffer)
+        except FileNotFoundError:  # the producer has gone already
+            buffer = None
+        data: Optional[np.ndarray] = None
+        if buffer is not None:
+            data = buffer.read(ring_buffer_slice.start, ring_buffer_slice.count, ring_buffer_slice.column, out=out)
+        if data is None:
+            self.overrun_count += 1
+            self.lost_frames_count += ring_buffer_slice.count
+        return data
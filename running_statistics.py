@@ -0,0 +1,81 @@
+# coding: utf-8
+from __future__ import annotations
+
+from typing import Tuple, Union
+
+import numpy as np
+
+from stubs import Final
+
+__all__ = ['RunningStatistics']
+
+
+class RunningStatistics:
+    """
+    The mean and the variance of the vectors appended, updated online by Welford's method
+
+    A batch of the vectors is reduced to its own mean and sum of the squared deviations first,
+    and then merged into the totals the way Chan et al. do, so the memory used stays the same however many come.
+    The batches are at most `batch_capacity` vectors long for the buffers to get allocated once.
+    """
+
+    def __init__(self, shape: Union[int, Tuple[int, ...]], batch_capacity: int = 256) -> None:
+        if batch_capacity < 1:
+            raise ValueError('Invalid batch capacity', batch_capacity)
+        self.shape: Final[Tuple[int, ...]] = (shape,) if isinstance(shape, int) else tuple(shape)
+        self.batch_capacity: Final[int] = batch_capacity
+        self.count: int = 0
+        self._mean: np.ndarray = np.zeros(self.shape, dtype=np.float64)
+        # the sum of the squared deviations from the mean
+        self._m2: np.ndarray = np.zeros(self.shape, dtype=np.float64)
+        self._batch_mean: np.ndarray = np.empty(self.shape, dtype=np.float64)
+        self._batch_m2: np.ndarray = np.empty(self.shape, dtype=np.float64)
+        self._deviations: np.ndarray = np.empty((batch_capacity,) + self.shape, dtype=np.float64)
+
+    def reset(self) -> None:
+        self.count = 0
+        self._mean[...] = 0.0
+        self._m2[...] = 0.0
+
+    @property
+    def mean(self) -> np.ndarray:
+        if not self.count:
+            return np.full(self.shape, np.nan)
+        return self._mean.copy()
+
+    @property
+    def variance(self) -> np.ndarray:
+        """ the unbiased estimate of the variance """
+        if self.count < 2:
+            return np.full(self.shape, np.nan)
+        return self._m2 / (self.count - 1)
+
+    def snapshot(self) -> Tuple[int, np.ndarray, np.ndarray]:
+        return self.count, self.mean, self.variance
+
+    def _merge(self, batch: np.ndarray) -> None:
+        batch_count: int = batch.shape[0]
+        deviations: np.ndarray = self._deviations[:batch_count]
+        np.sum(batch, axis=0, dtype=np.float64, out=self._batch_mean)
+        self._batch_mean /= batch_count
+        np.subtract(batch, self._batch_mean, out=deviations)
+        np.square(deviations, out=deviations)
+        np.sum(deviations, axis=0, out=self._batch_m2)
+        self._m2 += self._batch_m2
+
+        total_count: int = self.count + batch_count
+        # the difference of the means, and then its square, in the buffers already used
+        delta: np.ndarray = np.subtract(self._batch_mean, self._mean, out=self._batch_mean)
+        np.square(delta, out=self._batch_m2)
+        self._batch_m2 *= self.count * batch_count / total_count
+        self._m2 += self._batch_m2
+        delta *= batch_count / total_count
+        self._mean += delta
+        self.count = total_count
+
+    def append(self, values: np.ndarray) -> None:
+        """ add the vectors, one per row of `values` """
+        values = np.asarray(values).reshape((-1,) + self.shape)
+        start: int
+        for start in range(0, values.shape[0], self.batch_capacity):
+            self._merge(values[start:start + self.batch_capacity])
@@ -0,0 +1,209 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import time
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, cast
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from file_writer import FileWritingMode, FileWritingRequest, segment_file_path
+from output_backends import backend_for
+from pipeline import PipelineStage
+from ring_buffer import RingBufferSlice
+from stubs import Final
+
+__all__ = ['SpectrumStage', 'WelchAccumulator', 'WINDOWS']
+
+# periodic windows, as suit spectral analysis
+WINDOWS: Final[Dict[str, Callable[[int], np.ndarray]]] = {
+    'rectangular': np.ones,
+    'hann': lambda n: np.hanning(n + 1)[:-1],
+    'hamming': lambda n: np.hamming(n + 1)[:-1],
+    'blackman': lambda n: np.blackman(n + 1)[:-1],
+    'bartlett': lambda n: np.bartlett(n + 1)[:-1],
+}
+
+
+class WelchAccumulator:
+    """
+    The power spectral density of every channel, averaged over the overlapping windowed segments of the frames
+
+    The segments are transformed in batches, in buffers allocated once.
+    The frames that don't make a whole segment yet wait for the next ones in a buffer allocated once, too,
+    and only the segments that begin with them get copied there.
+    """
+
+    def __init__(self, segment_size: int, channels_count: int, sample_rate: float,
+                 overlap: float = 0.5, window: str = 'hann', batch_size: int = 32) -> None:
+        if segment_size < 2:
+            raise ValueError('Invalid segment size', segment_size)
+        if not (0.0 <= overlap < 1.0):
+            raise ValueError('Invalid overlap', overlap)
+        if window not in WINDOWS:
+            raise ValueError('Unknown window', window)
+        self.segment_size: Final[int] = segment_size
+        self.channels_count: Final[int] = channels_count
+        self.sample_rate: Final[float] = sample_rate
+        self.step: Final[int] = max(1, segment_size - round(overlap * segment_size))
+        self.batch_size: Final[int] = batch_size
+
+        self._window: np.ndarray = WINDOWS[window](segment_size).astype(np.float64)
+        self._windowed: np.ndarray = np.empty((batch_size, channels_count, segment_size), dtype=np.float64)
+        self._spectra: np.ndarray = np.empty((batch_size, channels_count, segment_size // 2 + 1),
+                                             dtype=np.complex128)
+        self._powers: np.ndarray = np.empty(self._spectra.shape, dtype=np.float64)
+        self._power_sum: np.ndarray = np.zeros((channels_count, segment_size // 2 + 1), dtype=np.float64)
+        # the frames pending, and then the first of the next ones, as many as the segments begun take
+        self._carry_over: np.ndarray = np.empty((2 * segment_size, channels_count), dtype=np.float64)
+        self._pending_count: int = 0
+        self.segments_count: int = 0
+
+        # one-sided density: the power of the positive and the negative frequencies together
+        self._scale: np.ndarray = np.full(segment_size // 2 + 1,
+                                          2.0 / (sample_rate * np.sum(np.square(self._window))))
+        self._scale[0] /= 2.0
+        if not segment_size % 2:
+            self._scale[-1] /= 2.0
+
+    @property
+    def frequencies(self) -> np.ndarray:
+        return np.fft.rfftfreq(self.segment_size, 1.0 / self.sample_rate)
+
+    def reset(self, keep_pending: bool = True) -> None:
+        """ start averaging anew, and forget the frames of an incomplete segment unless `keep_pending` """
+        self._power_sum[...] = 0.0
+        self.segments_count = 0
+        if not keep_pending:
+            self._pending_count = 0
+
+    def _transform(self, segments: np.ndarray) -> None:
+        count: int = segments.shape[0]
+        np.multiply(segments, self._window, out=self._windowed[:count])
+        try:
+            np.fft.rfft(self._windowed[:count], axis=-1, out=self._spectra[:count])
+        except TypeError:  # NumPy 1, where there is no `out`
+            self._spectra[:count] = np.fft.rfft(self._windowed[:count], axis=-1)
+        np.square(self._spectra[:count].real, out=self._powers[:count])
+        self._power_sum += self._powers[:count].sum(axis=0)
+        np.square(self._spectra[:count].imag, out=self._powers[:count])
+        self._power_sum += self._powers[:count].sum(axis=0)
+        self.segments_count += count
+
+    def _transform_frames(self, frames: np.ndarray, starts_count: Optional[int] = None) -> int:
+        """ transform the whole segments of `frames` beginning within `starts_count` frames; get the frames taken """
+        if frames.shape[0] < self.segment_size:
+            return 0
+        # (segments, channels, segment size) views of the frames
+        segments: np.ndarray = sliding_window_view(frames, self.segment_size, axis=0)[::self.step]
+        if starts_count is not None:
+            segments = segments[:-(-starts_count // self.step)]
+        start: int
+        for start in range(0, segments.shape[0], self.batch_size):
+            self._transform(segments[start:start + self.batch_size])
+        return segments.shape[0] * self.step
+
+    def append(self, frames: np.ndarray) -> None:
+        frames = np.asarray(frames).reshape((-1, self.channels_count))
+        # where the next segment begins, counted from the first of the frames
+        start: int = 0
+        if self._pending_count:
+            # a segment beginning with the pending frames takes fewer than `segment_size` of the frames
+            joined_count: int = self._pending_count + min(frames.shape[0], self.segment_size - 1)
+            self._carry_over[self._pending_count:joined_count] = frames[:joined_count - self._pending_count]
+            start = (self._transform_frames(self._carry_over[:joined_count], self._pending_count)
+                     - self._pending_count)
+            if start < 0:
+                # too few frames for the next segment, and they are all in the buffer already
+                self._carry_over[:joined_count - self._pending_count - start] = \
+                    self._carry_over[self._pending_count + start:joined_count]
+                self._pending_count = frames.shape[0] - start
+                return
+        start += self._transform_frames(frames[start:])
+        self._pending_count = frames.shape[0] - start
+        self._carry_over[:self._pending_count] = frames[start:]
+
+    def spectrum(self) -> np.ndarray:
+        """ the power spectral density, in squared units per hertz, channel by channel """
+        if not self.segments_count:
+            return np.full(self._power_sum.shape, np.nan)
+        return self._power_sum * self._scale / self.segments_count
+
+
+class SpectrumStage(PipelineStage):
+    """
+    Publish the Welch-averaged spectra of the frames every `publish_interval` seconds
+
+    A spectrum averages the segments taken since the previous one. It is put into `results_queue`
+    along with the frequencies, and, if `file_path` is set, it is appended to the file, a bin per row,
+    the frequency of the bin first unless the format holds the header, where the frequencies are.
+    The spectra of a continuous measurement go into a file per segment of it, named as the segment files are.
+    """
+
+    def __init__(self, portions_queue: Queue[RingBufferSlice],
+                 results_queue: Queue[Tuple[np.ndarray, np.ndarray]],
+                 sample_rate: float, channels_count: int,
+                 segment_size: int = 4096, overlap: float = 0.5, window: str = 'hann',
+                 publish_interval: float = 1.0,
+                 file_requests_queue: Optional[Queue[FileWritingRequest]] = None,
+                 file_path: Optional[Path] = None) -> None:
+        super(SpectrumStage, self).__init__(portions_queue, idle_interval=publish_interval / 4)
+        self.results_queue: Queue[Tuple[np.ndarray, np.ndarray]] = results_queue
+        self.publish_interval: float = publish_interval
+        self.file_requests_queue: Optional[Queue[FileWritingRequest]] = file_requests_queue
+        self.file_path: Optional[Path] = file_path
+
+        # check the parameters before the process starts
+        self.accumulator: WelchAccumulator = WelchAccumulator(segment_size, channels_count, sample_rate,
+                                                              overlap=overlap, window=window)
+        self._window_name: Final[str] = window
+        self._overlap: Final[float] = overlap
+        self._publish_time: float = time.monotonic()
+        self._header_written: bool = False
+        self._segment: int = 0
+
+    def process(self, portion: RingBufferSlice, data: np.ndarray) -> None:
+        if portion.segment != self._segment:
+            self._publish()
+            # the frames of another segment don't follow the ones pending
+            self.accumulator.reset(keep_pending=False)
+            self._segment = portion.segment
+            self._header_written = False
+        self.accumulator.append(data)
+
+    def _publish(self) -> None:
+        self._publish_time = time.monotonic()
+        if not self.accumulator.segments_count:
+            return
+        frequencies: np.ndarray = self.accumulator.frequencies
+        spectrum: np.ndarray = self.accumulator.spectrum()
+        self.accumulator.reset()
+        self.results_queue.put((frequencies, spectrum))
+        if self.file_requests_queue is not None and self.file_path is not None:
+            file_path: Path = segment_file_path(self.file_path, self._segment)
+            if not self._header_written:
+                self.file_requests_queue.put((file_path, cast(FileWritingMode, 'at'), {
+                    'frequencies': frequencies.tolist(),
+                    'sample_rate': self.accumulator.sample_rate,
+                    'segment_size': self.accumulator.segment_size,
+                    'overlap': self._overlap,
+                    'window': self._window_name,
+                    'publish_interval': self.publish_interval,
+                }))
+                self._header_written = True
+            rows: np.ndarray = spectrum.T
+            if not backend_for(file_path).HOLDS_HEADER:
+                # with no header, the frequency of a bin goes before its densities
+                rows = np.column_stack((frequencies, rows))
+            self.file_requests_queue.put((file_path, cast(FileWritingMode, 'at'), rows.astype(np.float32)))
+
+    def idle(self) -> None:
+        if time.monotonic() - self._publish_time >= self.publish_interval:
+            self._publish()
+
+    def finish(self) -> None:
+        self._publish()
+        self.accumulator.reset(keep_pending=False)
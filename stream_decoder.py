@@ -0,0 +1,107 @@
+# coding: utf-8
+from __future__ import annotations
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from channel_settings import ChannelSettings
+from stubs import Final
+
+__all__ = ['StreamDecoder', 'X502_ADC_SCALE_CODE_MAX']
+
+# the ADC code of the upper limit of a range
+X502_ADC_SCALE_CODE_MAX: Final[int] = 6000000
+
+
+class StreamDecoder:
+    """
+    Convert the raw 32-bit words of the input stream into volts
+
+    An ADC word has the highest bit set, the channel mode in bits 29–28, the physical channel in bits 27–24,
+    and the 24-bit signed code in the lowest bits.
+    A word with the highest byte zero holds the states of the digital inputs.
+    The other words are service messages, and they get skipped.
+
+    The ADC words come in the order of the logical channels table, so a word is assigned to a logical channel
+    by its position, and the tag of the word is only checked against the table.
+    Everything the conversion of a channel depends on is put into lookup tables beforehand,
+    so decoding takes a few array operations no matter how many channels there are.
+    """
+
+    ADC_FLAG: Final[int] = 0x80000000
+    TAG_MASK: Final[int] = 0x3F
+    TAG_SHIFT: Final[int] = 24
+
+    def __init__(self, settings: Sequence[ChannelSettings],
+                 adc_offsets: Sequence[float] = (), adc_scales: Sequence[float] = ()) -> None:
+        """
+        `adc_offsets` and `adc_scales` are the calibration coefficients as read from the device,
+        range by range, and channel by channel within a range if the calibration is per channel
+        """
+        if not settings:
+            raise ValueError('No channels to decode')
+        self.channels_count: Final[int] = len(settings)
+
+        ranges_count: Final[int] = len(ChannelSettings.VOLTAGE_RANGE)
+        calibration_channels_count: int = 0
+        if adc_offsets and len(adc_offsets) == len(adc_scales) and not len(adc_offsets) % ranges_count:
+            calibration_channels_count = len(adc_offsets) // ranges_count
+
+        self._tags: np.ndarray = np.empty(self.channels_count, dtype=np.uint32)
+        self._offsets: np.ndarray = np.zeros(self.channels_count, dtype=np.float64)
+        self._gains: np.ndarray = np.empty(self.channels_count, dtype=np.float64)
+        channel: int
+        channel_settings: ChannelSettings
+        for channel, channel_settings in enumerate(settings):
+            self._tags[channel] = (channel_settings.mode << 4) | channel_settings.physical_channel
+            self._gains[channel] = channel_settings.range_value() / X502_ADC_SCALE_CODE_MAX
+            if calibration_channels_count:
+                index: int = (channel_settings.range * calibration_channels_count
+                              + min(channel_settings.physical_channel, calibration_channels_count - 1))
+                self._offsets[channel] = adc_offsets[index]
+                self._gains[channel] *= adc_scales[index]
+        self.calibrated: Final[bool] = bool(calibration_channels_count)
+
+        # the ADC words of an incomplete frame left from the previous portion
+        self._pending: np.ndarray = np.empty(0, dtype=np.uint32)
+        self.tag_errors_count: int = 0
+
+    @property
+    def pending_count(self) -> int:
+        """ how many ADC words of an incomplete frame are waiting for the rest of it """
+        return self._pending.size
+
+    def reset(self) -> None:
+        """ forget the incomplete frame, e.g., when the stream restarts """
+        self._pending = np.empty(0, dtype=np.uint32)
+
+    def decode(self, words: np.ndarray, out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        get the voltages of the complete frames and the digital inputs words found among `words`
+
+        When `out` is given, it gets filled, and it must have room for all the complete frames.
+        """
+        words = np.asarray(words, dtype=np.uint32).ravel()
+        digital_words: np.ndarray = words[(words >> self.TAG_SHIFT) == 0]
+
+        adc_words: np.ndarray = words[(words & self.ADC_FLAG).astype(bool)]
+        if self._pending.size:
+            adc_words = np.concatenate((self._pending, adc_words))
+        frames_count: int = adc_words.size // self.channels_count
+        self._pending = adc_words[frames_count * self.channels_count:].copy()
+        adc_words = adc_words[:frames_count * self.channels_count].reshape((frames_count, self.channels_count))
+
+        self.tag_errors_count += int(np.count_nonzero(((adc_words >> self.TAG_SHIFT) & self.TAG_MASK)
+                                                      != self._tags))
+
+        # shift the code up to the sign bit and back to extend the sign
+        codes: np.ndarray = (adc_words << 8).view(np.int32) >> 8
+        if out is None:
+            out = np.empty((frames_count, self.channels_count), dtype=np.float32)
+        elif out.shape[0] < frames_count or out.shape[1:] != (self.channels_count,):
+            raise ValueError('Invalid output array', out.shape)
+        else:
+            out = out[:frames_count]
+        np.multiply(codes + self._offsets, self._gains, out=out, casting='same_kind')
+        return out, digital_words
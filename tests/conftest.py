@@ -0,0 +1,6 @@
+# coding: utf-8
+import sys
+from pathlib import Path
+
+# the modules lie in the root of the repository, not in a package
+sys.path.insert(0, str(Path(__file__).parent.parent))
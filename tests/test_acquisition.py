@@ -0,0 +1,257 @@
+# coding: utf-8
+from __future__ import annotations
+
+from datetime import timedelta
+from multiprocessing import Queue
+from queue import Empty
+from typing import Iterator, List, Sequence
+
+import numpy as np
+import pytest
+
+from channel_settings import ChannelSettings
+from decimator import Decimator, design_low_pass
+from e502 import E502, X502_ADC_FREQ_DIV_MAX, X502_REF_FREQ
+from e502_simulator import E502Simulator
+from measurement import MultiDeviceMeasurement
+from multi_device import frequency_dividers
+from ring_buffer import RingBufferReader, RingBufferSlice, SharedRingBuffer
+from spectrum import WINDOWS, WelchAccumulator
+from stream_decoder import StreamDecoder
+from trigger import TriggerDetector, WindowExtractor
+
+SIMULATOR_HOST: str = '127.0.0.2'
+FREQUENCY_DIVIDER: int = 50
+PORTION_SIZE: int = 500
+PORTIONS_COUNT: int = 4
+
+
+def channels_settings(count: int) -> List[ChannelSettings]:
+    settings: List[ChannelSettings] = []
+    channel: int
+    for channel in range(count):
+        channel_settings: ChannelSettings = ChannelSettings()
+        channel_settings.range = 0
+        channel_settings.physical_channel = channel
+        channel_settings.mode = 0
+        channel_settings.averaging = 1
+        settings.append(channel_settings)
+    return settings
+
+
+def ramp(frames: np.ndarray, channels_count: int) -> np.ndarray:
+    """ a saw of 10 V peak to peak, of a distinct sign and offset on every channel, for the frame numbers """
+    volts: np.ndarray = (np.mod(frames, 2000) / 200.0 - 5.0)[:, np.newaxis] * np.ones(channels_count)
+    volts[:, 1::2] *= -1.0
+    return volts + 0.25 * np.arange(channels_count)
+
+
+def random_splits(size: int, rng: np.random.Generator) -> List[int]:
+    """ the points to split `size` samples at into pieces of random sizes, empty ones and single samples among them """
+    return sorted(rng.integers(0, size + 1, rng.integers(1, 40)).tolist() + [1, 1])
+
+
+def numbered_simulator(host: str) -> E502Simulator:
+    """ a simulator sending `ramp` for the frames numbered from the start of the stream """
+    simulator: E502Simulator = E502Simulator(host)
+    simulator.signal_function = lambda times, settings: ramp(np.rint(times * simulator.frame_rate), len(settings))
+    return simulator
+
+
+@pytest.fixture
+def rng() -> np.random.Generator:
+    return np.random.default_rng(502)
+
+
+@pytest.fixture(params=[(False, 0), (True, 0), (False, 7), (True, 7)],
+                ids=['volts', 'raw words', 'volts fragmented', 'raw words fragmented'])
+def simulator(request: pytest.FixtureRequest) -> Iterator[E502Simulator]:
+    raw_words: bool
+    max_fragment_size: int
+    raw_words, max_fragment_size = request.param
+    simulator: E502Simulator = numbered_simulator(SIMULATOR_HOST)
+    simulator.raw_words = raw_words
+    simulator.max_fragment_size = max_fragment_size
+    simulator.jitter = 0.0005 if max_fragment_size else 0.0
+    with simulator:
+        yield simulator
+
+
+def start(device: E502, channels_count: int) -> None:
+    device.write_channels_settings_table(channels_settings(channels_count))
+    device.set_adc_frequency_divider(FREQUENCY_DIVIDER)
+    device.calibration_data()
+    device.enable_in_stream(from_adc=True)
+    device.start_data_stream()
+    device.preload_adc()
+    device.set_sync_io(True)
+
+
+@pytest.mark.parametrize('channels_count', [1, 3])
+def test_device_stream(simulator: E502Simulator, channels_count: int) -> None:
+    device: E502 = E502(SIMULATOR_HOST)
+    start(device, channels_count)
+    assert simulator.frame_rate == X502_REF_FREQ / FREQUENCY_DIVIDER / channels_count
+
+    ring_buffer: SharedRingBuffer = SharedRingBuffer(capacity=3 * PORTION_SIZE, channels_count=channels_count)
+    reader: RingBufferReader = RingBufferReader()
+    received: List[np.ndarray] = []
+    try:
+        for _ in range(PORTIONS_COUNT):
+            view: np.ndarray
+            for view in ring_buffer.reserve(PORTION_SIZE):
+                if simulator.raw_words:
+                    device.get_voltages(view.shape[0], out=view)
+                else:
+                    view[...] = device.get_data(view.shape[0])
+            portion: np.ndarray = reader.read(ring_buffer.commit())
+            assert portion is not None
+            received.append(portion)
+        # the buffer holds three portions only, so the first one is gone
+        assert ring_buffer.read(0, PORTION_SIZE) is None
+        assert ring_buffer.read(PORTION_SIZE, PORTION_SIZE) is not None
+    finally:
+        device.set_sync_io(False)
+        device.stop_data_stream()
+        reader.close()
+        ring_buffer.close()
+        del device
+
+    data: np.ndarray = np.concatenate(received)
+    expected: np.ndarray = ramp(np.arange(data.shape[0]), channels_count)
+    # the ADC codes are about 2 µV apart on the ±10 V range
+    np.testing.assert_allclose(data, expected, rtol=0.0, atol=1e-4 if simulator.raw_words else 1e-6)
+
+
+@pytest.mark.parametrize('channels_counts', [[2, 2], [1, 2], [3, 4, 1], [32, 5]])
+def test_frequency_dividers(channels_counts: List[int]) -> None:
+    frame_rate: float
+    for frame_rate in (1.0, 777.0, 20e3, 1e6, 2e6):
+        dividers: List[int] = frequency_dividers(frame_rate, channels_counts)
+        frame_periods: List[int] = [divider * count for divider, count in zip(dividers, channels_counts)]
+        assert min(dividers) >= 1
+        assert max(dividers) <= X502_ADC_FREQ_DIV_MAX
+        assert min(frame_periods) == max(frame_periods)
+    # a frame rate that every device has is kept
+    assert frequency_dividers(X502_REF_FREQ / 480.0, channels_counts) == [480 // count for count in channels_counts]
+
+
+def test_multi_device_measurement() -> None:
+    channels_counts: List[int] = [1, 2]
+    hosts: List[str] = ['127.0.0.5', '127.0.0.6']
+    ring_buffer: SharedRingBuffer = SharedRingBuffer(capacity=20 * PORTION_SIZE, channels_count=sum(channels_counts))
+    results_queue: Queue[RingBufferSlice] = Queue()
+    measurement: MultiDeviceMeasurement = MultiDeviceMeasurement(
+        results_queue, ring_buffer.name,
+        [(host, channels_settings(count)) for host, count in zip(hosts, channels_counts)], frame_rate=20e3,
+        data_portion_size=PORTION_SIZE, digital_lines=[], duration=timedelta(seconds=0.2))
+    received: List[np.ndarray] = []
+    try:
+        with numbered_simulator(hosts[0]), numbered_simulator(hosts[1]):
+            measurement.start()
+            while measurement.is_alive() or not results_queue.empty():
+                try:
+                    portion: RingBufferSlice = results_queue.get(timeout=0.1)
+                except Empty:
+                    continue
+                assert portion.received_time > 0.0
+                received.append(ring_buffer.read(portion.start, portion.count))
+            measurement.join()
+    finally:
+        ring_buffer.close()
+    assert measurement.exitcode == 0
+    assert received
+
+    data: np.ndarray = np.concatenate(received)
+    frames: np.ndarray = np.arange(data.shape[0])
+    # the devices start at once, so the frames of the same number get merged
+    np.testing.assert_allclose(data, np.hstack([ramp(frames, count) for count in channels_counts]),
+                               rtol=0.0, atol=1e-6)
+
+
+def test_stream_decoder_split(rng: np.random.Generator) -> None:
+    settings: List[ChannelSettings] = channels_settings(3)
+    offsets: List[float] = rng.uniform(-100.0, 100.0, len(ChannelSettings.VOLTAGE_RANGE)).tolist()
+    scales: List[float] = rng.uniform(0.99, 1.01, len(ChannelSettings.VOLTAGE_RANGE)).tolist()
+    simulator: E502Simulator = E502Simulator(raw_words=True)
+    simulator.adc_coefficients = list(zip(offsets, scales))
+    volts: np.ndarray = ramp(np.arange(1001), len(settings))
+    words: np.ndarray = np.frombuffer(simulator.encode(volts, settings), dtype='<u4')
+    # the digital inputs words and the service messages get among the ADC words
+    words = np.insert(words, rng.integers(0, words.size, 50), rng.integers(0, 1 << 24, 50, dtype=np.uint32))
+    words = np.insert(words, rng.integers(0, words.size, 20), 0x40000000)
+
+    whole: np.ndarray = StreamDecoder(settings, offsets, scales).decode(words)[0]
+    np.testing.assert_allclose(whole, volts[:1001], rtol=0.0, atol=1e-4)
+
+    decoder: StreamDecoder = StreamDecoder(settings, offsets, scales)
+    parts: List[np.ndarray] = [decoder.decode(part)[0] for part in np.split(words, random_splits(words.size, rng))]
+    np.testing.assert_array_equal(np.concatenate(parts), whole)
+    assert decoder.pending_count == 0
+    assert decoder.tag_errors_count == 0
+
+
+@pytest.mark.parametrize('mode, slope, hysteresis, holdoff',
+                         [('edge', 'rising', 0.5, 0), ('edge', 'falling', 0.5, 30), ('level', 'rising', 0.0, 70)])
+def test_trigger_split(rng: np.random.Generator, mode: str, slope: str, hysteresis: float, holdoff: int) -> None:
+    samples: np.ndarray = (np.sin(np.arange(5000) / 20.0) + rng.normal(0.0, 0.2, 5000)).astype(np.float32)
+    whole_detector: TriggerDetector = TriggerDetector(0.3, hysteresis, mode, slope, holdoff)
+    whole: np.ndarray = whole_detector.detect(samples)
+    assert whole.size
+
+    detector: TriggerDetector = TriggerDetector(0.3, hysteresis, mode, slope, holdoff)
+    extractor: WindowExtractor = WindowExtractor(25, 40)
+    triggers: List[np.ndarray] = []
+    windows: List[np.ndarray] = []
+    part: np.ndarray
+    for part in np.split(samples, random_splits(samples.size, rng)):
+        complete_triggers: np.ndarray
+        part_windows: np.ndarray
+        complete_triggers, part_windows = extractor.extract(part, detector.detect(part))
+        triggers.append(complete_triggers)
+        windows.append(part_windows)
+    assert detector.position == samples.size
+
+    # the windows cut off by the ends of the samples never come
+    expected_triggers: np.ndarray = whole[(whole >= extractor.pre) & (whole + extractor.post <= samples.size)]
+    np.testing.assert_array_equal(np.concatenate(triggers), expected_triggers)
+    np.testing.assert_array_equal(np.concatenate(windows),
+                                  samples[expected_triggers[:, np.newaxis] + np.arange(-extractor.pre, extractor.post)])
+
+
+@pytest.mark.parametrize('factor', [1, 4, 10])
+def test_decimator(rng: np.random.Generator, factor: int) -> None:
+    frames: np.ndarray = rng.standard_normal((3000, 2))
+    decimator: Decimator = Decimator(factor, 2, taps_per_phase=8, dtype=np.dtype(np.float64))
+    output: np.ndarray = np.concatenate([decimator.decimate(part)
+                                         for part in np.split(frames, random_splits(frames.shape[0], rng))])
+    assert output.shape == (frames.shape[0] // factor, 2)
+
+    # the filter starting from zeros, every `factor`-th frame of the convolution with the taps is kept
+    taps: np.ndarray = design_low_pass(factor, 8) if factor > 1 else np.ones(1)
+    channel: int
+    for channel in range(2):
+        expected: np.ndarray = np.convolve(frames[:, channel], taps)[factor - 1::factor][:output.shape[0]]
+        np.testing.assert_allclose(output[:, channel], expected, rtol=0.0, atol=1e-12)
+
+
+@pytest.mark.parametrize('segment_size, overlap, window', [(64, 0.5, 'hann'), (100, 0.75, 'blackman'),
+                                                           (7, 0.0, 'rectangular')])
+def test_welch(rng: np.random.Generator, segment_size: int, overlap: float, window: str) -> None:
+    sample_rate: float = 1000.0
+    frames: np.ndarray = rng.standard_normal((4000, 2)).astype(np.float32)
+    accumulator: WelchAccumulator = WelchAccumulator(segment_size, 2, sample_rate, overlap, window, batch_size=5)
+    part: np.ndarray
+    for part in np.split(frames, random_splits(frames.shape[0], rng)):
+        accumulator.append(part)
+
+    # segment by segment, straight from the definition
+    taper: np.ndarray = WINDOWS[window](segment_size)
+    starts: range = range(0, frames.shape[0] - segment_size + 1, accumulator.step)
+    powers: np.ndarray = np.mean([np.abs(np.fft.rfft(frames[s:s + segment_size].T * taper, axis=-1)) ** 2
+                                  for s in starts], axis=0)
+    powers[:, 1:(segment_size + 1) // 2] *= 2.0
+    expected: np.ndarray = powers / (sample_rate * np.sum(np.square(taper)))
+    assert accumulator.segments_count == len(starts)
+    np.testing.assert_allclose(accumulator.spectrum(), expected, rtol=1e-9)
+    np.testing.assert_allclose(accumulator.frequencies, np.fft.rfftfreq(segment_size, 1.0 / sample_rate))
@@ -0,0 +1,58 @@
+# coding: utf-8
+from __future__ import annotations
+
+from typing import Dict, Optional
+
+import numpy as np
+import pytest
+
+from text_format import format_text
+
+
+def expected_text(values: np.ndarray, precision: Optional[int] = None) -> str:
+    """ the text formatted value by value, as `repr` or `'%.Nf'` writes the `float` of every value """
+    value_format: str = '%r' if precision is None else f'%.{precision}f'
+    return ''.join('\t'.join(value_format % value for value in row) + '\n' for row in values.tolist())
+
+
+def float32_values() -> Dict[str, np.ndarray]:
+    rng: np.random.Generator = np.random.default_rng(4)
+    float32_info: np.finfo = np.finfo(np.float32)
+    return {
+        'signed zeros': np.array([[0.0, -0.0], [-0.0, 0.0]], dtype=np.float32),
+        'subnormals': np.array([[1e-45, -1e-45, 1.1754942e-38, 5.877472e-39]], dtype=np.float32),
+        'not finite': np.array([[np.inf, -np.inf, np.nan, 1.0]], dtype=np.float32),
+        'limits': np.array([[float32_info.max, -float32_info.max, float32_info.tiny, -float32_info.tiny]],
+                           dtype=np.float32),
+        'about the positional range': np.array([[1e-4, 9.9999e-5, 1e16, 9.999999e15, 1e-5, 123456790.0]],
+                                               dtype=np.float32),
+        'powers of two': np.ldexp(np.float32(1.0), np.arange(-149, 128)).astype(np.float32).reshape((-1, 1)),
+        'integers': np.arange(-1000, 1000, 7, dtype=np.float32).reshape((-1, 2)),
+        'random bits': rng.integers(0, 1 << 32, (20000, 3), dtype=np.uint64).astype(np.uint32).view(np.float32),
+        'uniform': rng.uniform(-10.0, 10.0, (5000, 4)).astype(np.float32),
+    }
+
+
+@pytest.mark.parametrize('name', list(float32_values()))
+def test_repr(name: str) -> None:
+    values: np.ndarray = float32_values()[name]
+    assert format_text(values) == expected_text(values)
+    # the `float64` values that `float32` holds exactly take the vectorized way, too
+    with np.errstate(invalid='ignore'):  # for the signaling NaNs among the random bits
+        values_64: np.ndarray = values.astype(np.float64)
+    assert format_text(values_64) == expected_text(values)
+
+
+@pytest.mark.parametrize('precision', [0, 1, 3, 6, 12, 15])
+@pytest.mark.parametrize('name', list(float32_values()))
+def test_fixed(name: str, precision: int) -> None:
+    values: np.ndarray = float32_values()[name]
+    assert format_text(values, precision) == expected_text(values, precision)
+
+
+def test_other_values() -> None:
+    values: np.ndarray = np.random.default_rng(5).uniform(-1.0, 1.0, (100, 3))
+    assert format_text(values) == expected_text(values)
+    assert format_text(values, 4) == expected_text(values, 4)
+    assert format_text(np.arange(5, dtype=np.float32)) == expected_text(np.arange(5.0).reshape((-1, 1)))
+    assert format_text(np.empty((0, 3), dtype=np.float32)) == ''
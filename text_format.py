@@ -0,0 +1,295 @@
+# coding: utf-8
+
+""" the text of blocks of values, tab-separated, as `repr` or `'%.Nf'` would write every value, but vectorized """
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from stubs import Final
+
+__all__ = ['format_text']
+
+
+# the powers of ten that fit `uint64`, the last one being the largest
+_POWERS_OF_TEN: Final[np.ndarray] = 10 ** np.arange(20, dtype=np.uint64)
+# the powers of five that fit `uint64`
+_POWERS_OF_FIVE: Final[np.ndarray] = 5 ** np.arange(28, dtype=np.uint64)
+_LOW_32_BITS: Final[np.uint64] = np.uint64(0xFFFFFFFF)
+# the values `repr` writes with no exponent and `_shortest_digits` handles, besides zeros
+_POSITIONAL_RANGE: Final[Tuple[float, float]] = (1e-4, 1e16)
+# how many values get formatted at once, for the intermediate arrays to stay in the CPU cache
+# and to be small enough for the memory allocator not to map them anew every time
+_BLOCK_SIZE: Final[int] = 1 << 13
+
+
+def _as_float32(values: np.ndarray) -> Optional[np.ndarray]:
+    """ the values as `float32` if they are floats that `float32` holds exactly, or `None` """
+    if values.dtype == np.float32:
+        return values
+    if not np.issubdtype(values.dtype, np.floating):
+        return None
+    with np.errstate(over='ignore', invalid='ignore'):
+        values_32: np.ndarray = values.astype(np.float32)
+    if not np.array_equal(values_32, values, equal_nan=True):
+        return None
+    return values_32
+
+
+def _scaled(mantissas: np.ndarray, exponents: np.ndarray, decimals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ `m × 2 ** e × 10 ** k` as its integer part and the exact rest, for `e + k ≤ 0` and `k` up to 27 """
+    # the value is `m × 5 ** k / 2 ** s`
+    shifts: np.ndarray = (-exponents - decimals).astype(np.uint64)
+    # the product `m × 5 ** k` fits `uint64` for `k` up to 17, and it's fixed below for the rest
+    products: np.ndarray = mantissas * _POWERS_OF_FIVE[decimals]
+    quotients: np.ndarray = products >> shifts
+    remainders: np.ndarray = products & ((np.uint64(1) << shifts) - np.uint64(1))
+    wide_products: np.ndarray = np.flatnonzero(decimals > 17)
+    if wide_products.size:
+        # the product of up to 87 bits as two parts, of the higher bits and of the lower 32 bits
+        powers: np.ndarray = _POWERS_OF_FIVE[decimals[wide_products]]
+        wide_mantissas: np.ndarray = mantissas[wide_products]
+        high_part: np.ndarray = wide_mantissas * (powers >> np.uint64(32))
+        low_part: np.ndarray = wide_mantissas * (powers & _LOW_32_BITS)
+        high_part += low_part >> np.uint64(32)
+        low_part &= _LOW_32_BITS
+        shifts_part: np.ndarray = shifts[wide_products]
+        wide: np.ndarray = shifts_part > np.uint64(32)
+        narrow_shifts: np.ndarray = np.where(wide, np.uint64(0), shifts_part)
+        wide_shifts: np.ndarray = np.where(wide, shifts_part - np.uint64(32), np.uint64(0))
+        quotients[wide_products] = np.where(wide, high_part >> wide_shifts,
+                                            (high_part << (np.uint64(32) - narrow_shifts))
+                                            | (low_part >> narrow_shifts))
+        remainders[wide_products] = np.where(wide,
+                                             ((high_part & ((np.uint64(1) << wide_shifts) - np.uint64(1)))
+                                              << np.uint64(32)) | low_part,
+                                             low_part & ((np.uint64(1) << narrow_shifts) - np.uint64(1)))
+    return quotients, np.ldexp(remainders.astype(np.float64), -shifts.astype(np.int32))
+
+
+def _rounded(integer_parts: np.ndarray, rests: np.ndarray, dropped: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    the numbers of `integer_parts + rests` rounded to `dropped` digits fewer, half to even,
+    and the roundings less the numbers, in the units of the last digit of the numbers
+    """
+    power: np.uint64 = _POWERS_OF_TEN[dropped]
+    half: np.uint64 = power // np.uint64(2)
+    rounded: np.ndarray = (integer_parts + half) // power
+    differences: np.ndarray = (rounded * power - integer_parts).view(np.int64) - rests
+    # the exact halves have been rounded up, and the odd ones of them must be rounded down
+    ties: np.ndarray = np.flatnonzero(differences == float(half))
+    if ties.size:
+        ties = ties[(rounded[ties] & np.uint64(1)).astype(np.bool_)]
+        rounded[ties] -= np.uint64(1)
+        differences[ties] -= float(power)
+    return rounded, differences
+
+
+def _shortest_digits(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    the digits and the count of the decimals of the shortest text that reads back as the `float64` of every value
+
+    The values are positive `float32` within `_POSITIONAL_RANGE`.
+    A value `x` is `m × 2 ** e`, the mantissa `m` of 24 bits, so its `float64` has 29 more bits of zeros,
+    and a text reads back as it if the text is within half of the `float64` spacing from it, rounding half to even,
+    or within half of that below a power of two.
+    With 17 significant digits, which always read back, `x × 10 ** k` is computed exactly,
+    as an integer and a binary fraction, and the texts with fewer digits are it rounded to the tens,
+    the hundreds, and so on, the differences being small enough for `float64` to be exact.
+    The fewer digits, the farther the text is, so the digits are dropped one by one while the text reads back.
+    Most values need 16 or 17 digits, so 16 and 15 digits are tried for all the values at once.
+    """
+    fractions: np.ndarray
+    exponents: np.ndarray
+    fractions, exponents = np.frexp(values)
+    mantissas: np.ndarray = np.ldexp(fractions, 24).astype(np.uint64)
+    exponents = exponents.astype(np.int64) - 24
+
+    fractional: np.ndarray = np.flatnonzero(exponents < 0)
+    digits: Optional[np.ndarray] = None
+    decimals: Optional[np.ndarray] = None
+    if fractional.size < values.size:
+        # the integers are all the digits and a zero decimal
+        digits = (mantissas << np.maximum(exponents, 0).astype(np.uint64)) * np.uint64(10)
+        decimals = np.ones(values.shape, dtype=np.int64)
+        values = values[fractional]
+        mantissas = mantissas[fractional]
+        exponents = exponents[fractional]
+    # `float64` gets the count of the integer digits right even next to a power of ten
+    fraction_decimals: np.ndarray = np.clip(16 - np.floor(np.log10(values, dtype=np.float64)).astype(np.int64),
+                                            1, -exponents)
+    integer_parts: np.ndarray
+    rests: np.ndarray
+    integer_parts, rests = _scaled(mantissas, exponents, fraction_decimals)
+    tolerances: np.ndarray = np.ldexp(_POWERS_OF_FIVE[fraction_decimals].astype(np.float64),
+                                      (-30 + exponents + fraction_decimals).astype(np.int32))
+    # below a power of two, the `float64` spacing is half as large
+    lower_bounds: np.ndarray = np.where(mantissas == np.uint64(1 << 23), tolerances / -2.0, -tolerances)
+    fraction_digits: np.ndarray = integer_parts + ((rests > 0.5)
+                                                   | ((rests == 0.5) & (integer_parts & np.uint64(1)).astype(np.bool_)))
+
+    rounded: np.ndarray
+    differences: np.ndarray
+    reads_back: np.ndarray
+    dropped: int
+    for dropped in (1, 2):
+        rounded, differences = _rounded(integer_parts, rests, dropped)
+        reads_back = (differences <= tolerances) & (differences >= lower_bounds) & (fraction_decimals > 1)
+        fraction_digits = np.where(reads_back, rounded, fraction_digits)
+        fraction_decimals -= reads_back
+    # the indices of the values that might do with even fewer digits
+    candidates: np.ndarray = np.flatnonzero(reads_back & (fraction_decimals > 1))
+    while candidates.size:
+        dropped += 1
+        rounded, differences = _rounded(integer_parts[candidates], rests[candidates], dropped)
+        reads_back = (differences <= tolerances[candidates]) & (differences >= lower_bounds[candidates])
+        candidates = candidates[reads_back]
+        fraction_digits[candidates] = rounded[reads_back]
+        fraction_decimals[candidates] -= 1
+        candidates = candidates[fraction_decimals[candidates] > 1]
+
+    if digits is not None and decimals is not None:
+        digits[fractional] = fraction_digits
+        decimals[fractional] = fraction_decimals
+        return digits, decimals
+    return fraction_digits, fraction_decimals
+
+
+def _format_repr(values: np.ndarray) -> bytes:
+    """
+    the same as `f'{value}'` for the `float64` of every value, with tab-separated columns and a line per row
+
+    The values are `float32`. The digits of those within `_POSITIONAL_RANGE` and of zeros are vectorized,
+    and `repr` formats the others, usually few.
+    A cell is the sign, the integer part aligned right, the decimal point, the decimals aligned left,
+    and the separator, or the text of `repr` aligned left and the separator.
+    The padding is zero bytes, dropped at once. The characters are made a column of the cells at once.
+    """
+    shape: Tuple[int, ...] = values.shape
+    values = values.ravel()
+    magnitudes: np.ndarray = np.abs(values)
+    with np.errstate(invalid='ignore'):
+        positional: np.ndarray = ((magnitudes >= np.float64(_POSITIONAL_RANGE[0]))
+                                  & (magnitudes < np.float64(_POSITIONAL_RANGE[1])))
+    digits: np.ndarray
+    decimals: np.ndarray
+    if positional.all():
+        digits, decimals = _shortest_digits(magnitudes)
+    else:
+        digits = np.zeros(values.shape, dtype=np.uint64)
+        decimals = np.ones(values.shape, dtype=np.int64)
+        digits[positional], decimals[positional] = _shortest_digits(magnitudes[positional])
+    # the decimals, left-aligned, must fit `uint64`
+    others: np.ndarray = np.flatnonzero((~positional & (magnitudes != 0.0)) | (decimals >= _POWERS_OF_TEN.size))
+    decimals[others] = 1
+    digits[others] = 0
+
+    integer_parts: np.ndarray = digits // _POWERS_OF_TEN[decimals]
+    decimals_width: int = int(decimals.max(initial=1))
+    # the decimals as the same count of digits, padded with zeros on the right
+    decimal_parts: np.ndarray = ((digits - integer_parts * _POWERS_OF_TEN[decimals])
+                                 * _POWERS_OF_TEN[decimals_width - decimals])
+    # at least one digit before the decimal point
+    digits_width: int = max(int(np.searchsorted(_POWERS_OF_TEN, integer_parts.max(initial=0), side='right')), 1)
+    texts: np.ndarray = np.array([repr(value) for value in values[others].tolist()], dtype=np.bytes_)
+    # the texts take the cell but the separator, the integer part being padded on the left if they are longer
+    integers_width: int = max(digits_width, texts.itemsize - decimals_width - 2)
+
+    # the comparisons of bytes are the fastest
+    decimals = decimals.astype(np.uint8)
+    cells: np.ndarray = np.empty((values.size, 1 + integers_width + 1 + decimals_width + 1), dtype=np.uint8)
+    cells[:, 0] = np.signbit(values) * np.uint8(ord('-'))
+    cells[:, 1:integers_width - digits_width + 1] = 0
+    column: int
+    remaining: np.ndarray
+    # the digits of a column, in place
+    characters: np.ndarray = np.empty(values.size, dtype=np.uint8)
+    for column in range(integers_width, integers_width - digits_width, -1):
+        remaining = integer_parts // np.uint64(10)
+        np.subtract(integer_parts, remaining * np.uint64(10), out=characters, casting='unsafe')
+        characters |= ord('0')
+        if column < integers_width:
+            # no leading zeros
+            characters *= integer_parts != 0
+        cells[:, column] = characters
+        integer_parts = remaining
+    cells[:, integers_width + 1] = ord('.')
+    for column in range(integers_width + 1 + decimals_width, integers_width + 1, -1):
+        remaining = decimal_parts // np.uint64(10)
+        np.subtract(decimal_parts, remaining * np.uint64(10), out=characters, casting='unsafe')
+        characters |= ord('0')
+        # no trailing zeros but the one of the integers
+        characters *= decimals >= column - (integers_width + 1)
+        cells[:, column] = characters
+        decimal_parts = remaining
+    if others.size:
+        cells[others, :-1] = 0
+        cells[others, :texts.itemsize] = texts.view(np.uint8).reshape((texts.size, texts.itemsize))
+    separators: np.ndarray = cells[:, -1].reshape(shape)
+    separators[...] = ord('\t')
+    separators[..., -1] = ord('\n')
+    cells = cells.ravel()
+    return cells[cells != 0].tobytes()
+
+
+def _format_fixed(values: np.ndarray, decimals: int) -> Optional[bytes]:
+    """
+    the same as `f'{value:.{decimals}f}'` for every value, with tab-separated columns and a line per row
+
+    For `float32` values and up to 12 decimals, the scaled values are exact, and so is the rounding,
+    so `None` is returned for other values or more decimals, as well as if a value is not finite
+    or too large for the digits to fit `uint64`.
+    """
+    if values.dtype != np.float32 or decimals > 12:
+        return None
+    with np.errstate(invalid='ignore'):  # for the signaling NaNs
+        scaled: np.ndarray = np.rint(np.abs(values.astype(np.float64)) * (10.0 ** decimals))
+    if not np.all(scaled < float(_POWERS_OF_TEN[-1])):  # `False` for NaN, too
+        return None
+    scaled_int: np.ndarray = scaled.astype(np.uint64)
+    # at least one digit before the decimal point
+    digits_count: np.ndarray = np.maximum(np.searchsorted(_POWERS_OF_TEN, scaled_int, side='right'), decimals + 1)
+    width: int = int(digits_count.max(initial=decimals + 1))
+
+    # a cell is the sign, the digits with the decimal point, and the separator
+    point: int = bool(decimals)
+    cells: np.ndarray = np.empty(values.shape + (1 + width + point + 1,), dtype=np.uint8)
+    valid: np.ndarray = np.ones(cells.shape, dtype=np.bool_)
+    cells[..., 0] = ord('-')
+    valid[..., 0] = np.signbit(values)
+    position: int
+    for position in range(width):
+        column: int = 1 + position + (point if position >= width - decimals else 0)
+        power: np.uint64 = _POWERS_OF_TEN[width - 1 - position]
+        cells[..., column] = (scaled_int // power) % np.uint64(10) + ord('0')
+        valid[..., column] = digits_count >= width - position
+    if point:
+        cells[..., 1 + width - decimals] = ord('.')
+    cells[..., :-1, -1] = ord('\t')
+    cells[..., -1, -1] = ord('\n')
+    return cells[valid].tobytes()
+
+
+def format_text(data: np.ndarray, precision: Optional[int] = None) -> str:
+    """ format a block of values as the lines of tab-separated columns in a few vectorized passes """
+    values: np.ndarray = np.asarray(data)
+    if values.ndim < 2:
+        values = values.reshape((-1, 1))
+    if not values.size:
+        return ''
+    # the kernels are exact for `float32` values only
+    values_32: Optional[np.ndarray] = _as_float32(values)
+    if precision is not None:
+        text: Optional[bytes] = _format_fixed(values_32, precision) if values_32 is not None else None
+        if text is not None:
+            return text.decode('ascii')
+        line_format: str = '\t'.join([f'%.{precision}f'] * values.shape[1]) + '\n'
+        return (line_format * values.shape[0]) % tuple(values.ravel().tolist())
+    if values_32 is not None:
+        rows_count: int = max(1, _BLOCK_SIZE // values.shape[1])
+        return b''.join([_format_repr(values_32[start:start + rows_count])
+                         for start in range(0, values.shape[0], rows_count)]).decode('ascii')
+    line_format = '\t'.join(['%r'] * values.shape[1]) + '\n'
+    return (line_format * values.shape[0]) % tuple(values.ravel().tolist())
@@ -2,102 +2,115 @@
 <!DOCTYPE TS>
 <TS version="2.1" language="ru_RU">
 <context>
-    <name>si prefix alternative micro</name>
-    <message encoding="utf-8">
-        <source>u</source>
-        <translation>мк</translation>
-    </message>
-</context>
-<context>
-    <name>si prefixes</name>
-    <message encoding="utf-8">
-        <source>y,z,a,f,p,n,µ,m, ,k,M,G,T,P,E,Z,Y</source>
-        <translation>и,з,а,ф,п,н,мк,м, ,к,М,Г,Т,П,Э,З,И</translation>
+    <name>App</name>
+    <message>
+        <location filename="../gui/app.py" line="228"/>
+        <source>Latest</source>
+        <translation>Последний</translation>
+    </message>
+    <message>
+        <location filename="../gui/app.py" line="228"/>
+        <source>Average</source>
+        <translation>Среднее</translation>
+    </message>
+    <message>
+        <location filename="../gui/app.py" line="232"/>
+        <source>Standard deviation</source>
+        <translation>Стандартное отклонение</translation>
+    </message>
+    <message numerus="yes">
+        <location filename="../gui/app.py" line="381"/>
+        <source>%n pulse(s)</source>
+        <translation>
+            <numerusform>%n импульс</numerusform>
+            <numerusform>%n импульса</numerusform>
+            <numerusform>%n импульсов</numerusform>
+        </translation>
     </message>
 </context>
 <context>
     <name>ChannelSettings</name>
-    <message encoding="utf-8">
-        <location filename="../gui/channel_settings.py" line="24"/>
+    <message>
+        <location filename="../gui/channel_settings.py" line="25"/>
         <source>Enabled</source>
         <translation>Включён</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="51"/>
         <source>Differential</source>
         <translation>Дифференциальный</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="51"/>
         <source>Channels 1 to 16 with common GND</source>
         <translation>Каналы 1–16 с общей землёй</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="51"/>
         <source>Channels 16 to 32 with common GND</source>
         <translation>Каналы 16–32 с общей землёй</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="51"/>
         <source>Grounded ADC</source>
         <translation>Заземлённый</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/channel_settings.py" line="99"/>
+    <message>
+        <location filename="../gui/channel_settings.py" line="88"/>
         <source>Range:</source>
         <translation>Диапазон:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/channel_settings.py" line="100"/>
+    <message>
+        <location filename="../gui/channel_settings.py" line="89"/>
         <source>Channel:</source>
         <translation>Канал:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/channel_settings.py" line="101"/>
+    <message>
+        <location filename="../gui/channel_settings.py" line="90"/>
         <source>Mode:</source>
         <translation>Режим:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/channel_settings.py" line="102"/>
+    <message>
+        <location filename="../gui/channel_settings.py" line="91"/>
         <source>Averaging:</source>
         <translation>Усреднение:</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="103"/>
         <source>Line color:</source>
-        <translation>Цвет линии:</translation>
+        <translation type="obsolete">Цвет линии:</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="104"/>
         <source>Data file:</source>
-        <translation>Файл данных:</translation>
+        <translation type="obsolete">Файл данных:</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="40"/>
         <source>±10 V</source>
         <translation>±10 В</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="40"/>
         <source>±5 V</source>
         <translation>±5 В</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="40"/>
         <source>±2 V</source>
         <translation>±2 В</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="40"/>
         <source>±1 V</source>
         <translation>±1 В</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="40"/>
         <source>±0.5 V</source>
         <translation>±0,5 В</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/channel_settings.py" line="40"/>
         <source>±0.2 V</source>
         <translation>±0,2 В</translation>
@@ -105,22 +118,22 @@
 </context>
 <context>
     <name>DigitalLines</name>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/digital_lines.py" line="24"/>
         <source>Increase emitter voltage</source>
         <translation>Повышенное напряжение излучателя</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/digital_lines.py" line="30"/>
         <source>Amplification:</source>
         <translation>Усиление:</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/digital_lines.py" line="35"/>
         <source>Pulse duration:</source>
         <translation>Длительность импульса:</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/digital_lines.py" line="40"/>
         <source>Pulse rate:</source>
         <translation>Частота импульсов:</translation>
@@ -128,78 +141,294 @@
 </context>
 <context>
     <name>GUI</name>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="96"/>
+    <message>
+        <location filename="../gui/gui.py" line="156"/>
         <source>Digital Lines</source>
         <translation>Цифровые линии</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="112"/>
+    <message>
+        <location filename="../gui/gui.py" line="181"/>
         <source>Start</source>
         <translation>ПУСК</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="113"/>
+    <message>
+        <location filename="../gui/gui.py" line="182"/>
         <source>Stop</source>
         <translation>ОСТАНОВ</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="72"/>
+    <message>
+        <location filename="../gui/gui.py" line="93"/>
         <source>s</source>
         <comment>unit: seconds</comment>
         <translation>сек</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="61"/>
+    <message>
+        <location filename="../gui/gui.py" line="82"/>
         <source>S/s</source>
         <comment>unit: samples per second</comment>
         <translation>отч/сек</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="98"/>
+    <message>
+        <location filename="../gui/gui.py" line="158"/>
         <source>IP address:</source>
         <translation>IP-адрес:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="99"/>
+    <message>
+        <location filename="../gui/gui.py" line="159"/>
         <source>Sample rate:</source>
         <translation>Частота измерения:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="100"/>
+    <message>
+        <location filename="../gui/gui.py" line="160"/>
         <source>Measurement duration:</source>
         <translation>Длительность измерения:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="101"/>
+    <message>
+        <location filename="../gui/gui.py" line="165"/>
         <source>Portion size:</source>
         <translation>Размер порции данных:</translation>
     </message>
-    <message encoding="utf-8">
-        <location filename="../gui/gui.py" line="102"/>
+    <message>
+        <location filename="../gui/gui.py" line="168"/>
         <source>Sync input frequency divider:</source>
         <translation>Делитель частоты синхронизации:</translation>
     </message>
+    <message>
+        <location filename="../gui/gui.py" line="106"/>
+        <source>Measure continuously, split into files by the duration</source>
+        <translation>Измерять непрерывно, разбивая на файлы по длительности</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="108"/>
+        <source>Compute power spectra</source>
+        <translation>Вычислять спектры мощности</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="110"/>
+        <source>All the data</source>
+        <translation>Все данные</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="111"/>
+        <source>Pulses triggered by Sync</source>
+        <translation>Импульсы по синхронизации</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="112"/>
+        <source>Average pulse triggered by Sync</source>
+        <translation>Средний импульс по синхронизации</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="115"/>
+        <source>Tune the portion size to the load</source>
+        <translation>Подстраивать размер порции под нагрузку</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="116"/>
+        <source>Receive the raw ADC words and calibrate them here</source>
+        <translation>Принимать коды АЦП и калибровать их здесь</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="120"/>
+        <source>Text (*.csv)</source>
+        <translation>Текст (*.csv)</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="121"/>
+        <source>Binary (*.bin)</source>
+        <translation>Двоичный (*.bin)</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="122"/>
+        <source>NumPy (*.npy)</source>
+        <translation>NumPy (*.npy)</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="124"/>
+        <source>HDF5 (*.h5)</source>
+        <translation>HDF5 (*.h5)</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="125"/>
+        <source>Memory-mapped (*.e502)</source>
+        <translation>Отображаемый в память (*.e502)</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="131"/>
+        <source>Frequency</source>
+        <translation>Частота</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="136"/>
+        <source>Time since trigger</source>
+        <translation>Время от срабатывания синхронизации</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="162"/>
+        <source>History length:</source>
+        <translation>Длина истории:</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="164"/>
+        <source>Keep:</source>
+        <translation>Хранить:</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="169"/>
+        <source>Decimation factor:</source>
+        <translation>Коэффициент прореживания:</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="170"/>
+        <source>Data location:</source>
+        <translation>Расположение данных:</translation>
+    </message>
+    <message>
+        <location filename="../gui/gui.py" line="171"/>
+        <source>File format:</source>
+        <translation>Формат файлов:</translation>
+    </message>
 </context>
 <context>
     <name>IPAddressDialog</name>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/ip_address_dialog.py" line="19"/>
         <source>Search</source>
         <translation>Поиск</translation>
     </message>
+    <message>
+        <location filename="../gui/ip_address_dialog.py" line="88"/>
+        <source>{0} (found before)</source>
+        <translation>{0} (найден ранее)</translation>
+    </message>
+    <message>
+        <location filename="../gui/ip_address_dialog.py" line="89"/>
+        <source>Serial number: {0}
+Firmware: {1}
+Latency: {2:.3g} ms</source>
+        <translation>Серийный номер: {0}
+Прошивка: {1}
+Задержка: {2:.3g} мс</translation>
+    </message>
 </context>
 <context>
     <name>IPAddressEntry</name>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/ip_address_entry.py" line="24"/>
         <source>...</source>
         <translation>…</translation>
     </message>
-    <message encoding="utf-8">
+    <message>
         <location filename="../gui/ip_address_entry.py" line="25"/>
         <source>Browse...</source>
         <translation>Обзор…</translation>
     </message>
 </context>
+<context>
+    <name>LivePlot</name>
+    <message>
+        <location filename="../gui/live_plot.py" line="42"/>
+        <source>Time</source>
+        <translation>Время</translation>
+    </message>
+</context>
+<context>
+    <name>StatusPanel</name>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Received:</source>
+        <translation>Принято:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Receive calls:</source>
+        <translation>Вызовов приёма:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Portion size:</source>
+        <translation>Размер порции данных:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Portion time:</source>
+        <translation>Время порции:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Results queue:</source>
+        <translation>Очередь результатов:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Display latency:</source>
+        <translation>Задержка отображения:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Timer interval:</source>
+        <translation>Интервал таймера:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Writer backlog:</source>
+        <translation>Очередь записи:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Written:</source>
+        <translation>Записано:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Write latency:</source>
+        <translation>Задержка записи:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Frames lost for display:</source>
+        <translation>Кадров потеряно для отображения:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="17"/>
+        <source>Frames lost for files:</source>
+        <translation>Кадров потеряно для файлов:</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="34"/>
+        <source>Status</source>
+        <translation>Состояние</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="88"/>
+        <source>{0:.3g} MB/s</source>
+        <translation>{0:.3g} МБ/сек</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="88"/>
+        <source>{0:.0f} /s</source>
+        <translation>{0:.0f} /сек</translation>
+    </message>
+    <message>
+        <location filename="../gui/status_panel.py" line="93"/>
+        <source>{0} median, {1} at 99%</source>
+        <translation>медиана {0}, 99-й процентиль {1}</translation>
+    </message>
+</context>
+<context>
+    <name>si prefix alternative micro</name>
+    <message>
+        <location filename="../gui/__init__.py" line="47"/>
+        <source>u</source>
+        <translation>мк</translation>
+    </message>
+</context>
+<context>
+    <name>si prefixes</name>
+    <message>
+        <location filename="../gui/__init__.py" line="43"/>
+        <source>y,z,a,f,p,n,µ,m, ,k,M,G,T,P,E,Z,Y</source>
+        <translation>и,з,а,ф,п,н,мк,м, ,к,М,Г,Т,П,Э,З,И</translation>
+    </message>
+</context>
 </TS>
@@ -0,0 +1,292 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import time
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple, cast
+
+import numpy as np
+
+from file_writer import FileWritingMode, FileWritingRequest, segment_file_path
+from pipeline import PipelineStage
+from ring_buffer import RingBufferSlice
+from running_statistics import RunningStatistics
+from stubs import Final, Literal
+
+__all__ = ['TriggerDetector', 'TriggerMode', 'TriggerSlope', 'TriggerStage', 'WindowExtractor']
+
+TriggerMode = Literal['edge', 'level']
+TriggerSlope = Literal['rising', 'falling']
+
+
+class TriggerDetector:
+    """
+    Find the samples where the trigger fires
+
+    In the edge mode, the trigger fires when the signal crosses the level after having been beyond
+    the level less the hysteresis on the other side, so the noise about the level makes no extra triggers.
+    In the level mode, the trigger fires whenever the signal is beyond the level and the holdoff is over,
+    so the holdoff is required there, or every sample beyond the level would fire.
+    After the trigger fires, it doesn't fire again for `holdoff` samples.
+    The samples are counted from the start of the measurement, and the state is kept between the portions.
+    """
+
+    def __init__(self, level: float, hysteresis: float = 0.0, mode: TriggerMode = 'edge',
+                 slope: TriggerSlope = 'rising', holdoff: int = 0) -> None:
+        if hysteresis < 0.0:
+            raise ValueError('Invalid hysteresis', hysteresis)
+        if mode not in ('edge', 'level'):
+            raise ValueError('Unknown trigger mode', mode)
+        if slope not in ('rising', 'falling'):
+            raise ValueError('Unknown trigger slope', slope)
+        if mode == 'level' and holdoff <= 0:
+            raise ValueError('The level mode requires a holdoff', holdoff)
+        self.level: Final[float] = level
+        self.hysteresis: Final[float] = hysteresis
+        self.mode: Final[TriggerMode] = mode
+        self.slope: Final[TriggerSlope] = slope
+        self.holdoff: Final[int] = max(0, holdoff)
+
+        # the sample number of the start of the next portion
+        self.position: int = 0
+        # whether the signal has been beyond the hysteresis band, so that the next crossing is an edge
+        self._armed: bool = False
+        self._last_trigger: Optional[int] = None
+
+    def reset(self) -> None:
+        self.position = 0
+        self._armed = False
+        self._last_trigger = None
+
+    def detect(self, samples: np.ndarray) -> np.ndarray:
+        """ get the sample numbers of the triggers among the samples of the next portion """
+        samples = np.asarray(samples).ravel()
+        if not samples.size:
+            return np.empty(0, dtype=np.int64)
+        if self.slope == 'falling':
+            samples = -samples
+            level: float = -self.level
+        else:
+            level = self.level
+        beyond: np.ndarray = samples >= level
+
+        candidates: np.ndarray
+        if self.mode == 'level':
+            candidates = np.flatnonzero(beyond)
+        else:
+            # +1 where the signal reaches the level, -1 where it gets back beyond the hysteresis, 0 elsewhere;
+            # the state of the Schmitt trigger at a sample is the last non-zero event before it
+            events: np.ndarray = beyond.astype(np.int8) - (samples <= level - self.hysteresis).astype(np.int8)
+            event_indices: np.ndarray = np.where(events != 0, np.arange(samples.size), -1)
+            np.maximum.accumulate(event_indices, out=event_indices)
+            states: np.ndarray = np.where(event_indices >= 0, events[np.maximum(event_indices, 0)],
+                                          1 - 2 * int(self._armed))
+            previous_states: np.ndarray = np.empty_like(states)
+            previous_states[0] = -1 if self._armed else 1
+            previous_states[1:] = states[:-1]
+            candidates = np.flatnonzero((states == 1) & (previous_states == -1))
+            if states.size:
+                self._armed = bool(states[-1] == -1)
+
+        candidates += self.position
+        self.position += samples.size
+        if not self.holdoff or not candidates.size:
+            if candidates.size:
+                self._last_trigger = int(candidates[-1])
+            return candidates
+
+        # the holdoff depends on the triggers accepted, so it's done one by one, but over the candidates only
+        accepted: List[int] = []
+        last_trigger: Optional[int] = self._last_trigger
+        candidate: int
+        if self.mode == 'level':
+            # no need to look at every sample of a long pulse
+            next_allowed: int = candidates[0] if last_trigger is None else last_trigger + self.holdoff
+            while True:
+                index: int = int(np.searchsorted(candidates, next_allowed))
+                if index >= candidates.size:
+                    break
+                last_trigger = int(candidates[index])
+                accepted.append(last_trigger)
+                next_allowed = last_trigger + self.holdoff
+        else:
+            for candidate in candidates.tolist():
+                if last_trigger is None or candidate - last_trigger >= self.holdoff:
+                    accepted.append(candidate)
+                    last_trigger = candidate
+        self._last_trigger = last_trigger
+        return np.array(accepted, dtype=np.int64)
+
+
+class WindowExtractor:
+    """
+    Cut the windows of `pre` samples before a trigger and `post` samples since it
+
+    The samples are kept for as long as the windows might need them,
+    so the windows that span the portions come whole, only later.
+    The windows that start before the measurement are skipped.
+    """
+
+    def __init__(self, pre: int, post: int, dtype: np.dtype = np.dtype(np.float32)) -> None:
+        if pre < 0 or post <= 0:
+            raise ValueError('Invalid window', pre, post)
+        self.pre: Final[int] = pre
+        self.post: Final[int] = post
+        self._offsets: Final[np.ndarray] = np.arange(-pre, post)
+        # the latest samples, and the sample number of the first of them
+        self._tail: np.ndarray = np.empty(0, dtype=dtype)
+        self._tail_start: int = 0
+        # the triggers whose windows are not complete yet
+        self._pending: np.ndarray = np.empty(0, dtype=np.int64)
+
+    @property
+    def size(self) -> int:
+        return self.pre + self.post
+
+    def reset(self) -> None:
+        self._tail = self._tail[:0]
+        self._tail_start = 0
+        self._pending = self._pending[:0]
+
+    def extract(self, samples: np.ndarray, triggers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ get the triggers that have got their windows complete, and the windows, a window per row """
+        samples = np.asarray(samples).ravel()
+        data: np.ndarray = np.concatenate((self._tail, samples)) if self._tail.size else samples
+        end: int = self._tail_start + data.size
+        triggers = np.concatenate((self._pending, np.asarray(triggers, dtype=np.int64)))
+        triggers = triggers[triggers - self.pre >= self._tail_start]
+        complete: np.ndarray = triggers + self.post <= end
+        self._pending = triggers[~complete]
+        triggers = triggers[complete]
+        windows: np.ndarray = data[(triggers - self._tail_start)[:, np.newaxis] + self._offsets]
+
+        # keep what the pending windows and the windows of the next triggers need
+        keep_from: int = end - self.pre
+        if self._pending.size:
+            keep_from = min(keep_from, int(self._pending[0]) - self.pre)
+        keep_from = max(keep_from, self._tail_start)
+        self._tail = data[keep_from - self._tail_start:].copy()
+        self._tail_start = keep_from
+        return triggers, windows
+
+
+class TriggerStage(PipelineStage):
+    """
+    Cut the windows of the signal channel about the triggers on the sync channel
+
+    The count of the triggers, the latest window, and the mean and the standard deviation of the windows
+    are put into `results_queue` every `publish_interval` seconds.
+    If `file_path` is set, the windows are appended to the file, a window per row, so that only the pulses get stored,
+    or, if `average_only`, a snapshot of the statistics of the windows of the segment is
+    every `snapshot_interval` seconds and at the end of the segment. A snapshot row holds the count of the windows,
+    then the mean, and then the variance of every sample of them.
+    """
+
+    def __init__(self, portions_queue: Queue[RingBufferSlice],
+                 results_queue: Queue[Tuple[int, np.ndarray, np.ndarray, np.ndarray]],
+                 sync_column: int, signal_column: int,
+                 detector: TriggerDetector, pre: int, post: int,
+                 average_only: bool = False, publish_interval: float = 0.5, snapshot_interval: float = 10.0,
+                 file_requests_queue: Optional[Queue[FileWritingRequest]] = None,
+                 file_path: Optional[Path] = None,
+                 file_header: Optional[Mapping[str, Any]] = None) -> None:
+        super(TriggerStage, self).__init__(portions_queue, idle_interval=publish_interval / 4)
+        self.results_queue: Queue[Tuple[int, np.ndarray, np.ndarray, np.ndarray]] = results_queue
+        self.sync_column: int = sync_column
+        self.signal_column: int = signal_column
+        self.detector: TriggerDetector = detector
+        self.extractor: WindowExtractor = WindowExtractor(pre, post)
+        self.average_only: bool = average_only
+        self.publish_interval: float = publish_interval
+        self.snapshot_interval: float = snapshot_interval
+        self.file_requests_queue: Optional[Queue[FileWritingRequest]] = file_requests_queue
+        self.file_path: Optional[Path] = file_path
+        self.file_header: Dict[str, Any] = dict(file_header or {},
+                                                trigger_level=detector.level,
+                                                trigger_hysteresis=detector.hysteresis,
+                                                trigger_mode=detector.mode,
+                                                trigger_slope=detector.slope,
+                                                trigger_holdoff=detector.holdoff,
+                                                pre_trigger_samples=pre,
+                                                post_trigger_samples=post)
+        if average_only:
+            # the count of the windows, and then the mean and the variance, each as long as a window is
+            self.file_header['snapshot_layout'] = ['windows_count', 'mean', 'variance']
+
+        # the triggers since the measurement start, and the statistics of the windows since the segment start
+        self.triggers_count: int = 0
+        self.statistics: RunningStatistics = RunningStatistics(self.extractor.size)
+        self._latest_window: np.ndarray = np.full(self.extractor.size, np.nan, dtype=np.float32)
+        self._snapshot: np.ndarray = np.empty((1, 1 + 2 * self.extractor.size), dtype=np.float64)
+        self._published_count: int = 0
+        self._publish_time: float = time.monotonic()
+        self._snapshot_time: float = time.monotonic()
+        self._snapshot_count: int = 0
+        self._segment: int = 0
+        self._header_written: bool = False
+
+    def _write(self, data: np.ndarray) -> None:
+        if self.file_requests_queue is None or self.file_path is None:
+            return
+        file_path: Path = segment_file_path(self.file_path, self._segment)
+        if not self._header_written:
+            self.file_requests_queue.put((file_path, cast(FileWritingMode, 'at'), self.file_header))
+            self._header_written = True
+        self.file_requests_queue.put((file_path, cast(FileWritingMode, 'at'), data))
+
+    def _publish(self) -> None:
+        self._publish_time = time.monotonic()
+        if self.triggers_count == self._published_count:
+            return
+        self._published_count = self.triggers_count
+        self.results_queue.put((self.triggers_count, self._latest_window.copy(),
+                                self.statistics.mean.astype(np.float32),
+                                np.sqrt(self.statistics.variance).astype(np.float32)))
+
+    def _write_snapshot(self) -> None:
+        self._snapshot_time = time.monotonic()
+        if not self.average_only or self.statistics.count == self._snapshot_count:
+            return
+        self._snapshot_count = self.statistics.count
+        size: int = self.extractor.size
+        self._snapshot[0, 0], self._snapshot[0, 1:size + 1], self._snapshot[0, size + 1:] = self.statistics.snapshot()
+        self._write(self._snapshot.copy())
+
+    def _end_segment(self) -> None:
+        self._publish()
+        self._write_snapshot()
+        self.statistics.reset()
+        self._snapshot_count = 0
+        self._header_written = False
+
+    def process(self, portion: RingBufferSlice, data: np.ndarray) -> None:
+        if portion.segment != self._segment:
+            self._end_segment()
+            self._segment = portion.segment
+        triggers: np.ndarray = self.detector.detect(data[:, self.sync_column])
+        windows: np.ndarray
+        triggers, windows = self.extractor.extract(data[:, self.signal_column], triggers)
+        if not triggers.size:
+            return
+        self.triggers_count += triggers.size
+        self.statistics.append(windows)
+        self._latest_window[:] = windows[-1]
+        if not self.average_only:
+            self._write(windows)
+
+    def idle(self) -> None:
+        if time.monotonic() - self._publish_time >= self.publish_interval:
+            self._publish()
+        if time.monotonic() - self._snapshot_time >= self.snapshot_interval:
+            self._write_snapshot()
+
+    def finish(self) -> None:
+        # the windows still incomplete are never to be complete
+        self._end_segment()
+        self.detector.reset()
+        self.extractor.reset()
+        self.triggers_count = 0
+        self._published_count = 0
+        self._segment = 0